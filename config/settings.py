@@ -2,8 +2,13 @@
 
 from pathlib import Path
 import os
+import tempfile
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -85,6 +90,69 @@ DATABASES = {
     }
 }
 
+# Read replicas as comma separated "host:port" pairs, the reads of safe
+# requests to views using core.db_router.ReplicaReadMixin are spread over them
+DATABASE_REPLICAS = [
+    replica for replica in os.getenv('DATABASE_REPLICAS', '').split(',') if replica
+]
+DATABASE_REPLICA_ALIASES = []
+for index, replica in enumerate(DATABASE_REPLICAS, start=1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICA_ALIASES.append(f'replica{index}')
+
+# Extra databases the conversations are sharded over by user, as comma
+# separated "host:port" pairs. New users are spread over the default database
+# and the shards; existing users stay where they are until moved with the
+# rebalance_user_shard command.
+DATABASE_SHARDS = [
+    shard for shard in os.getenv('DATABASE_SHARDS', '').split(',') if shard
+]
+USER_SHARDS = ['default']
+for index, shard in enumerate(DATABASE_SHARDS, start=1):
+    host, _, port = shard.partition(':')
+    DATABASES[f'shard{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+    }
+    USER_SHARDS.append(f'shard{index}')
+# seconds the shard of a user is cached for
+SHARD_MAP_CACHE_SECONDS = int(os.getenv('SHARD_MAP_CACHE_SECONDS', 60))
+
+# Cache shared by all app processes, e.g. redis://zassist_redis:6379/0.
+# Without it every process keeps its own cache, which only suits a single
+# development process.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    }
+SHARED_CACHE = bool(REDIS_URL)
+
+DATABASE_ROUTERS = [
+    'core.db_router.UserShardRouter',
+    'core.db_router.PrimaryReplicaRouter',
+]
+# seconds the reads of a user stay on the primary after they wrote, must
+# exceed the replication lag; needs a cache shared by all app processes
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 30))
+if DATABASE_REPLICA_ALIASES and not SHARED_CACHE:
+    # a user pinned by one process would read a lagging replica in the others
+    raise ImproperlyConfigured('DATABASE_REPLICAS needs REDIS_URL, a shared cache.')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -125,6 +193,92 @@ SIMPLE_JWT = {
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True,  
 }
+
+# AI agent chat history
+AI_HISTORY_LIMIT = 12
+# estimated token budget of the history sent with each agent request
+AI_HISTORY_BUDGETS = {
+    'chat': int(os.getenv('AI_HISTORY_CHAT_BUDGET', 4000)),
+    'ops': int(os.getenv('AI_HISTORY_OPS_BUDGET', 2000)),
+}
+AI_HISTORY_CACHE_MAX_ENTRIES = int(os.getenv('AI_HISTORY_CACHE_MAX_ENTRIES', 1024))
+AI_HISTORY_CACHE_TTL = int(os.getenv('AI_HISTORY_CACHE_TTL', 300))  # seconds
+
+# S3 object storage (django-storages). AWS_S3_ENDPOINT_URL points it to an
+# S3 compatible stand-in, e.g. the minio service of docker-compose.yml
+AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL') or None
+AWS_S3_ADDRESSING_STYLE = 'path' if AWS_S3_ENDPOINT_URL else None
+ZAD_ASSIST_BUCKET = os.getenv('ZAD_ASSIST_BUCKET')
+DATA_UPSERTION_BUCKET = os.getenv('DATA_UPSERTION_BUCKET', 'data-upsertions')
+# storages and their boto3 clients are shared by the process
+# (core/storage_registry.py); each client keeps a pool of this many connections
+AWS_S3_CLIENT_CONFIG = Config(
+    s3={'addressing_style': AWS_S3_ADDRESSING_STYLE},
+    max_pool_connections=int(os.getenv('AWS_S3_MAX_POOL_CONNECTIONS', 20)),
+)
+# image and document URLs handed to clients are presigned (core/url_signer.py)
+# when the buckets are private; signatures are reused until
+# SIGNED_URL_REFRESH_MARGIN seconds before they expire
+SIGNED_URLS = os.getenv('SIGNED_URLS', 'False') == 'True'
+SIGNED_URL_EXPIRES = int(os.getenv('SIGNED_URL_EXPIRES', 3600))
+SIGNED_URL_REFRESH_MARGIN = int(os.getenv('SIGNED_URL_REFRESH_MARGIN', 300))
+
+# Direct uploads: clients upload to the bucket with a presigned POST, then
+# finalize the upload (core/uploads.py)
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+# seconds a presigned POST is valid for, and the token finalizing it
+UPLOAD_URL_EXPIRES = int(os.getenv('UPLOAD_URL_EXPIRES', 900))
+UPLOAD_TOKEN_MAX_AGE = int(os.getenv('UPLOAD_TOKEN_MAX_AGE', 3600))
+# resumable multipart uploads of large documents
+MULTIPART_UPLOAD_MAX_SIZE = int(os.getenv('MULTIPART_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))
+MULTIPART_PART_SIZE = int(os.getenv('MULTIPART_PART_SIZE', 8 * 1024 * 1024))
+# files saved through a storage go up as parallel multipart uploads too
+AWS_S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_PART_SIZE,
+    multipart_chunksize=MULTIPART_PART_SIZE,
+    max_concurrency=int(os.getenv('AWS_S3_MAX_CONCURRENCY', 4)),
+)
+# local disk cache of the S3 objects read server-side (core/storage_cache.py),
+# 0 disables it; entries are checked against S3 every STORAGE_CACHE_REVALIDATE s
+STORAGE_CACHE_DIR = os.getenv(
+    'STORAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'zassist-storage-cache')
+)
+STORAGE_CACHE_MAX_SIZE = int(os.getenv('STORAGE_CACHE_MAX_SIZE', 512 * 1024 * 1024))
+STORAGE_CACHE_REVALIDATE = int(os.getenv('STORAGE_CACHE_REVALIDATE', 300))
+
+# Variants of uploaded images rendered with Pillow (zbot/helpers/image_variants.py),
+# by a pool of IMAGE_PIPELINE_WORKERS processes (0: in the request thread)
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+IMAGE_PIPELINE_TIMEOUT = int(os.getenv('IMAGE_PIPELINE_TIMEOUT', 30))  # seconds
+# longest side, in pixels, of the variant the agent analyzes and of the
+# medium and thumbnail variants clients display
+IMAGE_ANALYSIS_MAX_SIDE = int(os.getenv('IMAGE_ANALYSIS_MAX_SIDE', 2048))
+IMAGE_MEDIUM_MAX_SIDE = int(os.getenv('IMAGE_MEDIUM_MAX_SIDE', 1024))
+IMAGE_THUMBNAIL_MAX_SIDE = int(os.getenv('IMAGE_THUMBNAIL_MAX_SIDE', 320))
+# seconds the agent's description of an image content is cached for
+IMAGE_DESCRIPTION_CACHE_SECONDS = int(
+    os.getenv('IMAGE_DESCRIPTION_CACHE_SECONDS', 30 * 24 * 3600)
+)
+# images uploaded with ?async=true are written to storage by a pool of
+# IMAGE_UPLOAD_WORKERS threads; the agent waits up to IMAGE_UPLOAD_READY_TIMEOUT
+# seconds for an image it is asked about
+IMAGE_UPLOAD_WORKERS = int(os.getenv('IMAGE_UPLOAD_WORKERS', 4))
+IMAGE_UPLOAD_READY_TIMEOUT = int(os.getenv('IMAGE_UPLOAD_READY_TIMEOUT', 30))
+
+# Conversation history pages
+HISTORY_BUCKET_SECONDS = int(os.getenv('HISTORY_BUCKET_SECONDS', 3600))
+
+# Pool of raw psycopg2 connections for the raw-SQL hot paths (core/db_pool.py)
+# used by the views decorated with core.decorators.use_db_pool when enabled
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', 'False') == 'True'
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 20))
+# seconds to wait for a free connection
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+# seconds a connection may stay idle, and may live, before it is replaced
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 300))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 3600))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True') == 'True'
     
 
 
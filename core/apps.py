@@ -7,6 +7,9 @@ class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
 
+    def ready(self):
+        from . import signals  # noqa: F401
+
     # def ready(self):
     #     db_pool = DatabaseConnectionPool()
     #     atexit.register(db_pool.close_all_connections)
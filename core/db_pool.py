@@ -1,48 +1,279 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import pool
-import os
+from psycopg2 import extensions
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection frees up within the checkout timeout."""
+
 
 class DatabaseConnectionPool:
+    """
+    Thread-safe pool of raw psycopg2 connections for the raw-SQL hot paths.
+
+    Checkout blocks up to `timeout` seconds when `max_size` connections are
+    in use. Connections are validated on checkout: closed or older than
+    `max_lifetime` ones are replaced, ones idle longer than `recycle` are
+    replaced too (server side or NAT idle timeouts), and ones idle longer
+    than `ping_after` are pinged with `SELECT 1` first if `pre_ping` is set.
+
+    Connections run in autocommit mode with the session time zone set to
+    UTC, like Django's own connections.
+    """
+
     _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(
+        self,
+        connect_kwargs=None,
+        min_size=1,
+        max_size=20,
+        timeout=5.0,
+        recycle=300.0,
+        max_lifetime=3600.0,
+        pre_ping=True,
+        ping_after=0.0,
+        connect=psycopg2.connect,
+    ):
+        self.connect_kwargs = connect_kwargs or {}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.max_lifetime = max_lifetime
+        self.pre_ping = pre_ping
+        self.ping_after = ping_after
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        # idle connections as (connection, created at, returned at)
+        self._idle = deque()
+        # created at of the connections checked out, by connection id
+        self._in_use = {}
+        # open connections, plus the ones being opened
+        self._size = 0
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "discarded": 0,
+            "checkout_time": 0.0,
+            "max_checkout_time": 0.0,
+        }
+
+        for _ in range(min_size):
+            try:
+                self._idle.append((self._open(), time.monotonic(), time.monotonic()))
+                self._size += 1
+            except psycopg2.Error as e:
+                # the pool still works, connections are opened on demand
+                logger.error(f"Error opening pooled connection: {e}")
+                break
+
+    @classmethod
+    def from_settings(cls, alias="default"):
+        """Builds a pool for a database of settings.DATABASES."""
+        database = settings.DATABASES[alias]
+        connect_kwargs = {
+            "dbname": database["NAME"],
+            "user": database.get("USER"),
+            "password": database.get("PASSWORD"),
+            "host": database.get("HOST") or None,
+            "port": database.get("PORT") or None,
+            **database.get("OPTIONS", {}),
+        }
+        return cls(
+            connect_kwargs=connect_kwargs,
+            min_size=settings.DB_POOL_MIN_SIZE,
+            max_size=settings.DB_POOL_MAX_SIZE,
+            timeout=settings.DB_POOL_TIMEOUT,
+            recycle=settings.DB_POOL_RECYCLE,
+            max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+            pre_ping=settings.DB_POOL_PRE_PING,
+        )
 
-    def __new__(cls):
+    @classmethod
+    def instance(cls):
+        """Returns the process wide pool of the default database."""
         if cls._instance is None:
-            cls._instance = super(DatabaseConnectionPool, cls).__new__(cls)
-            cls._instance.connection_pool = None  
-            cls._instance.initialize_pool()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls.from_settings()
+                    logger.info(
+                        f"Connection pool created (max {cls._instance.max_size} connections)"
+                    )
         return cls._instance
 
-    def initialize_pool(self):
-        """Initialize the connection pool using environment variables or Django settings."""
-        if self.connection_pool is None: 
+    def _open(self):
+        conn = self._connect(**self.connect_kwargs)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SET TIME ZONE 'UTC';")
+        return conn
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _usable(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            return False
+        if self.recycle and now - returned_at > self.recycle:
+            return False
+        if self.pre_ping and now - returned_at >= self.ping_after:
+            return self._ping(conn)
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+
+    def get_connection(self, timeout=None):
+        """
+        Checks out a connection, waiting up to `timeout` seconds (the pool
+        timeout if None) for one to be released.
+
+        Raises:
+        PoolTimeout: If no connection could be checked out in time.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.InterfaceError("connection pool is closed")
+                    if self._idle:
+                        # most recently used first, lets the others age out
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no connection available within {timeout} seconds"
+                        )
+                    if not waited:
+                        waited = True
+                        self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    conn, created_at = self._open(), time.monotonic()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn, created_at, returned_at = entry
+                if not self._usable(conn, created_at, returned_at):
+                    self._discard(conn)
+                    continue
+            break
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._in_use[id(conn)] = created_at
+            self._stats["checkouts"] += 1
+            self._stats["checkout_time"] += elapsed
+            self._stats["max_checkout_time"] = max(
+                self._stats["max_checkout_time"], elapsed
+            )
+        return conn
+
+    def release_connection(self, conn, discard=False):
+        """Returns a connection to the pool, closing it if it is unusable."""
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            logger.warning("Released a connection that is not checked out")
+            return
+
+        if not discard and not conn.closed:
             try:
-                self.connection_pool = psycopg2.pool.SimpleConnectionPool(
-                    minconn=1,
-                    maxconn=20,  
-                    user=os.getenv("PG_USER"),  # Use environment variables
-                    password="admin",
-                    host="postgresql",
-                    port=os.getenv("PG_PORT"),
-                    database=os.getenv("PG_DB"),
-                )
-                print("Connection pool created successfully")
-            except Exception as e:
-                print(f"Error initializing connection pool: {e}")
-                self.connection_pool = None  # Reset on error
-
-    def get_connection(self):
-        """Get a connection from the pool."""
-        if self.connection_pool is None:
-            raise Exception("Connection pool is not initialized.")
-        return self.connection_pool.getconn()
-
-    def release_connection(self, connection):
-        """Release a connection back to the pool."""
-        if self.connection_pool is not None:
-            self.connection_pool.putconn(connection)
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Checks out a connection for the duration of a with block."""
+        conn = self.get_connection(timeout)
+        try:
+            yield conn
+        finally:
+            # broken connections are discarded on release
+            self.release_connection(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "checkouts": checkouts,
+                "waits": self._stats["waits"],
+                "timeouts": self._stats["timeouts"],
+                "discarded": self._stats["discarded"],
+                "avg_checkout_ms": (
+                    self._stats["checkout_time"] / checkouts * 1000 if checkouts else 0.0
+                ),
+                "max_checkout_ms": self._stats["max_checkout_time"] * 1000,
+            }
 
     def close_all_connections(self):
-        """Close all connections in the pool."""
-        if self.connection_pool is not None:
-            self.connection_pool.closeall()
-            self.connection_pool = None  
\ No newline at end of file
+        """Closes the idle connections, checked out ones close on release."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+        logger.info(f"Connection pool closed, stats: {self.stats()}")
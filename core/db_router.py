@@ -0,0 +1,234 @@
+import zlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .decorators import DatabaseBusy
+
+
+# models stored on the shard of the user owning the conversation
+SHARDED_MODELS = {
+    "zbot.conversation",
+    "zbot.conversationarchive",
+    "zbot.textmessage",
+    "zbot.imagemessage",
+    "zbot.machineparameter",
+}
+
+# shard of the user of the current request, None outside of requests
+_shard = ContextVar("user_shard", default=None)
+# whether reads of the current request may go to a replica
+_replica_reads = ContextVar("replica_reads", default=False)
+# whether reads of the current request must stay on the primary, set once
+# the request wrote or when its user wrote recently
+_pinned = ContextVar("pinned_to_primary", default=False)
+
+
+def _pin_key(user_id):
+    return f"zbot:db-pin:{user_id}"
+
+
+def pin_user(user_id):
+    """Sends the reads of a user to the primary until replicas caught up."""
+    cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_user_pinned(user_id):
+    return bool(cache.get(_pin_key(user_id)))
+
+
+def _shard_key(user_id):
+    return f"zbot:user-shard:{user_id}"
+
+
+def hashed_shard(user_id):
+    """Returns the shard a new user is placed on."""
+    shards = settings.USER_SHARDS
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def user_shard(user_id):
+    """
+    Returns the shard holding the conversations of a user, from the UserShard
+    directory. Users without an entry (created before sharding) stay on the
+    default database.
+
+    Returns:
+    tuple: (database alias, whether the user is being moved to another shard).
+    """
+    if len(settings.USER_SHARDS) == 1:
+        return DEFAULT_DB_ALIAS, False
+    entry = cache.get(_shard_key(user_id))
+    if entry is None:
+        from .models import UserShard
+
+        entry = (
+            UserShard.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .values_list("shard", "moving")
+            .first()
+        ) or (DEFAULT_DB_ALIAS, False)
+        cache.set(_shard_key(user_id), entry, settings.SHARD_MAP_CACHE_SECONDS)
+    return tuple(entry)
+
+
+def shard_for_user(user_id):
+    return user_shard(user_id)[0]
+
+
+def forget_user_shard(user_id):
+    cache.delete(_shard_key(user_id))
+
+
+def write_alias():
+    """Returns the database alias writes to sharded models should use."""
+    return _shard.get() or DEFAULT_DB_ALIAS
+
+
+def replica_alias():
+    """Returns the database alias reads of the default database should use."""
+    replicas = settings.DATABASE_REPLICA_ALIASES
+    if not replicas or not _replica_reads.get() or _pinned.get():
+        return DEFAULT_DB_ALIAS
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        # reads of a transaction (e.g. SELECT ... FOR UPDATE) go with it
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+def read_alias():
+    """Returns the database alias reads of sharded models should use."""
+    shard = _shard.get()
+    if shard and shard != DEFAULT_DB_ALIAS:
+        # shards other than the default one have no replicas
+        return shard
+    return replica_alias()
+
+
+def instance_shard(instance):
+    """Returns the shard of a model instance, if it can be told from it."""
+    if instance._state.db:
+        return instance._state.db
+    conversation = instance._state.fields_cache.get("conversation")
+    if conversation is not None and conversation._state.db:
+        return conversation._state.db
+    if instance._meta.label_lower == "zbot.conversation" and instance.user_id:
+        return shard_for_user(instance.user_id)
+    return None
+
+
+class UserShardRouter:
+    """
+    Sends the conversations of a user and everything stored with them to
+    the shard of that user: the shard of the instance involved if known,
+    the shard of the user of the current request (see UserShardMixin)
+    otherwise. Everything else, and the default shard, falls through to
+    PrimaryReplicaRouter.
+    """
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        if len(settings.USER_SHARDS) == 1:
+            return None
+        instance = hints.get("instance")
+        shard = instance_shard(instance) if instance is not None else None
+        return shard or _shard.get()
+
+    def db_for_read(self, model, **hints):
+        shard = self._shard(model, hints)
+        # the default shard keeps its read replicas
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def db_for_write(self, model, **hints):
+        shard = self._shard(model, hints)
+        return None if shard == DEFAULT_DB_ALIAS else shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # users, machines and materials are referenced from every shard
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in settings.USER_SHARDS:
+            return None
+        return f"{app_label}.{model_name}" in SHARDED_MODELS
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends writes to the primary and reads to the primary too, unless they
+    run in a request of a view using ReplicaReadMixin.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica_alias()
+
+    def db_for_write(self, model, **hints):
+        # read your own writes for the rest of the request
+        _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """
+    Sends the reads of safe requests (GET, HEAD, OPTIONS) of a view to the
+    read replicas. Requests of users who wrote within the last
+    REPLICA_PIN_SECONDS stay on the primary, so e.g. the history right after
+    a streamsse includes the new messages.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        replica_token = _replica_reads.set(request.method in SAFE_METHODS)
+        pinned_token = _pinned.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # worker threads serve many requests, do not leak the routing
+            _pinned.reset(pinned_token)
+            _replica_reads.reset(replica_token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if not user or not user.is_authenticated:
+            return
+        if request.method not in SAFE_METHODS:
+            _pinned.set(True)
+            pin_user(user.pk)
+        elif is_user_pinned(user.pk):
+            _pinned.set(True)
+
+
+class UserShardMixin:
+    """
+    Routes the sharded models of a view to the shard of the request user,
+    and rejects writes while the user is being moved to another shard.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = _shard.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _shard.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if not user or not user.is_authenticated:
+            return
+        shard, moving = user_shard(user.pk)
+        if moving and request.method not in SAFE_METHODS:
+            raise DatabaseBusy("Your conversations are being moved, please retry shortly.")
+        _shard.set(shard)
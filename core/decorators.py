@@ -1,38 +1,55 @@
 from functools import wraps
-from .db_pool import DatabaseConnectionPool
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .db_pool import DatabaseConnectionPool, PoolTimeout
+
+
+class DatabaseBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The database is busy, please try again later."
+    default_code = "database_busy"
+
 
 def use_db_pool(cls):
-    """Class decorator to manage database connections."""
-    
-    original_init = cls.__init__
-
-    @wraps(original_init)
-    def new_init(self, *args, **kwargs):
-        self.db_pool = DatabaseConnectionPool()  # Ensure db_pool is initialized
-        original_init(self, *args, **kwargs)
-
-    cls.__init__ = new_init
-
-    # Wrap each method that may require a database connection
-    for attr in dir(cls):
-        # Skip special methods and DRF's internal methods
-        if attr.startswith("__") or attr in ["get_extra_actions", "as_view", "get_queryset"]:
-            continue
-
-        method = getattr(cls, attr)
-        if callable(method):
-            # Create a closure that captures the current method
-            def create_wrapper(method_ref):
-                @wraps(method_ref)
-                def wrapper(self, *args, **kwargs):
-                    connection = self.db_pool.get_connection()
-                    try:
-                        return method_ref(self, connection, *args, **kwargs)
-                    finally:
-                        self.db_pool.release_connection(connection)
-                return wrapper
-            
-            # Set the wrapped method
-            setattr(cls, attr, create_wrapper(method))
-
-    return cls
\ No newline at end of file
+    """
+    Class decorator giving a view a pooled raw connection per request.
+
+    `self.db_connection` checks a connection out of the pool on first use and
+    the connection goes back to the pool when dispatch() exits, on every exit
+    path. It is None when settings.DB_POOL_ENABLED is off or when the request
+    user lives on another shard than the default one (the pool only holds
+    connections to the default database), raw-SQL helpers then run on
+    Django's connection. Do not use it from the generators of
+    streaming responses, they run after dispatch() returned.
+    """
+    original_dispatch = cls.dispatch
+
+    @wraps(original_dispatch)
+    def dispatch(self, request, *args, **kwargs):
+        self._db_connection = None
+        try:
+            return original_dispatch(self, request, *args, **kwargs)
+        finally:
+            if self._db_connection is not None:
+                DatabaseConnectionPool.instance().release_connection(self._db_connection)
+                self._db_connection = None
+
+    def db_connection(self):
+        from .db_router import write_alias
+
+        if not settings.DB_POOL_ENABLED or write_alias() != DEFAULT_DB_ALIAS:
+            return None
+        if getattr(self, "_db_connection", None) is None:
+            try:
+                self._db_connection = DatabaseConnectionPool.instance().get_connection()
+            except PoolTimeout:
+                raise DatabaseBusy()
+        return self._db_connection
+
+    cls.dispatch = dispatch
+    cls.db_connection = property(db_connection)
+    return cls
@@ -0,0 +1,41 @@
+"""
+    Django command to resume user deletions interrupted by a restart or failure
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import UserDeletionJob
+from core.user_deletion import run_user_deletion
+
+
+class Command(BaseCommand):
+    """Django command to resume unfinished user deletion jobs"""
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--stale-minutes",
+            type=int,
+            default=10,
+            help="Resume running jobs without progress for this many minutes.",
+        )
+
+    def handle(self, *args, **options):
+        """Handle the command"""
+        # running jobs still making progress belong to a live worker thread
+        stale = timezone.now() - timedelta(minutes=options["stale_minutes"])
+        jobs = (
+            UserDeletionJob.objects.exclude(status=UserDeletionJob.DONE)
+            .exclude(status=UserDeletionJob.RUNNING, updated_at__gte=stale)
+            .order_by("id")
+        )
+        for job in jobs:
+            self.stdout.write(f"Resuming deletion of user {job.user_id} ({job.step or 'start'})")
+            run_user_deletion(job.id, batch_size=options["batch_size"])
+            job.refresh_from_db()
+            self.stdout.write(f"{job.status}: {job.deleted_rows} rows deleted")
+
+        self.stdout.write(self.style.SUCCESS("User deletions resumed."))
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 import uuid
 
@@ -17,9 +19,50 @@ class TimestampedModel(models.Model):
         abstract = True
 
 
+class SoftDeleteQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(is_deleted=False)
+
+    def deleted(self):
+        return self.filter(is_deleted=True)
+
+    def soft_delete(self):
+        """
+        Marks the live rows of the queryset as deleted in a single UPDATE.
+
+        Unlike SoftDeleteModel.delete() no save() is called, so no signals
+        are sent; callers own the invalidation of anything derived from the
+        rows.
+
+        Returns:
+        int: The number of rows marked as deleted.
+        """
+        fields = {"is_deleted": True}
+        if any(field.name == "updated_at" for field in self.model._meta.concrete_fields):
+            fields["updated_at"] = timezone.now()
+        return self.live().update(**fields)
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    def __init__(self, is_deleted=None):
+        super().__init__()
+        self.is_deleted = is_deleted
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_deleted is None:
+            return queryset
+        return queryset.filter(is_deleted=self.is_deleted)
+
+
 class SoftDeleteModel(models.Model):
     is_deleted = models.BooleanField(default=False)
 
+    # every row, deleted or not
+    objects = SoftDeleteManager()
+    live = SoftDeleteManager(is_deleted=False)
+    deleted = SoftDeleteManager(is_deleted=True)
+
     def delete(self, using=None, keep_parents=False):
         self.is_deleted = True
         self.save()
@@ -64,3 +107,40 @@ class User(AbstractBaseUser, PermissionsMixin):
     objects = UserManager()
 
     USERNAME_FIELD = "email"
+
+
+class UserDeletionJob(TimestampedModel):
+    """Progress of the background deletion of a user and their data."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "pending"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed"),
+    ]
+    # not a foreign key, the job outlives the user it deletes
+    user_id = models.BigIntegerField(db_index=True)
+    email = models.EmailField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    step = models.CharField(max_length=50, blank=True)
+    deleted_rows = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+
+class UserShard(models.Model):
+    """Directory entry of the database holding the conversations of a user."""
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="shard",
+    )
+    shard = models.CharField(max_length=50)
+    # writes are rejected while the conversations are copied to a new shard
+    moving = models.BooleanField(default=False)
@@ -6,6 +6,8 @@ from djoser.serializers import (
 from rest_framework import serializers
 from django.contrib.auth import authenticate, get_user_model
 
+from .user_deletion import start_user_deletion
+
 
 User = get_user_model()
 
@@ -24,7 +26,7 @@ class CustomUserDeleteSerializer(BaseUserDeleteSerializer):
 
     def delete(self):
         user = self.context['request'].user
-        user.delete() 
+        return start_user_deletion(user)
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
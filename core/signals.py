@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .db_router import hashed_shard
+from .models import UserShard
+
+
+@receiver(post_save, sender=get_user_model())
+def assign_user_shard(sender, instance, created, **kwargs):
+    """Place a new user on a shard when conversations are sharded."""
+    if created and len(settings.USER_SHARDS) > 1:
+        UserShard.objects.create(user=instance, shard=hashed_shard(instance.pk))
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files import File
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# eviction frees space down to this share of the maximum size
+EVICTION_TARGET = 0.9
+
+
+class DiskCache:
+    """
+    Size-bounded read-through cache of storage objects on local disk.
+
+    Every object is kept in a file named after the hash of its bucket and
+    key, next to a JSON sidecar holding its size, ETag and fetch time.
+    Hits refresh the modification time of the file, which is what the LRU
+    eviction sorts on, so several processes can share a cache directory.
+
+    Entries are validated on every hit against the size they were fetched
+    with, and against the ETag of the object every `revalidate` seconds
+    (a HEAD request, much cheaper than reading the object again). Objects
+    whose ETag is the MD5 of their content are checked on download too.
+    """
+
+    def __init__(self, directory, max_size, revalidate=300, stats_every=100):
+        self.directory = directory
+        self.max_size = max_size
+        self.revalidate = revalidate
+        self.stats_every = stats_every
+        self._lock = threading.Lock()
+        # estimate of the size of the directory, None until scanned
+        self._size = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def open(self, storage, name):
+        """Returns a local file with the content of an object of a storage."""
+        path = self._path(storage, name)
+        meta = self._read_meta(path)
+        if meta is not None and self._is_valid(storage, name, path, meta):
+            try:
+                os.utime(path)
+                local = open(path, "rb")
+            except FileNotFoundError:
+                # evicted by another process in between
+                local = None
+            if local is not None:
+                self._count(hit=True)
+                return local
+
+        self._count(hit=False)
+        self._fetch(storage, name, path)
+        return open(path, "rb")
+
+    def discard(self, storage, name):
+        self._remove(self._path(storage, name))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self._size or 0,
+            }
+
+    # internals
+    def _path(self, storage, name):
+        bucket = getattr(storage, "bucket_name", None) or ""
+        digest = hashlib.sha256(f"{bucket}/{name}".encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _read_meta(self, path):
+        try:
+            with open(f"{path}.json") as sidecar:
+                return json.load(sidecar)
+        except (OSError, ValueError):
+            return None
+
+    def _is_valid(self, storage, name, path, meta):
+        try:
+            if os.path.getsize(path) != meta["size"]:
+                return False
+        except OSError:
+            return False
+        if time.time() - meta["fetched"] < self.revalidate:
+            return True
+        etag = object_etag(storage, name)
+        if etag is not None and etag != meta["etag"]:
+            return False
+        meta["fetched"] = time.time()
+        self._write_meta(path, meta)
+        return True
+
+    def _fetch(self, storage, name, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        md5 = hashlib.md5(usedforsecurity=False)
+        size = 0
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as local, storage.open(name, "rb") as remote:
+                etag = file_etag(remote)
+                for chunk in iter(lambda: remote.read(CHUNK_SIZE), b""):
+                    md5.update(chunk)
+                    local.write(chunk)
+                    size += len(chunk)
+            # the ETag of objects not uploaded in parts is their MD5
+            if etag and "-" not in etag and etag != md5.hexdigest():
+                raise OSError(f"Corrupted download of {name}")
+            os.replace(temporary, path)
+        except BaseException:
+            self._remove_file(temporary)
+            raise
+        self._write_meta(path, {"size": size, "etag": etag, "fetched": time.time()})
+        self._grow(size)
+
+    def _write_meta(self, path, meta):
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as sidecar:
+            json.dump(meta, sidecar)
+        os.replace(temporary, f"{path}.json")
+
+    def _grow(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            if self._size <= self.max_size:
+                return
+            entries, total = self._scan()
+            # least recently used first
+            for mtime, entry_size, path in sorted(entries):
+                if total <= self.max_size * EVICTION_TARGET:
+                    break
+                self._remove(path)
+                total -= entry_size
+                self.evictions += 1
+            self._size = total
+
+    def _scan(self):
+        """Returns the (mtime, size, path) of the cached objects and their size."""
+        entries, total = [], 0
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                if file_name.endswith((".json", ".tmp")):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def _remove(self, path):
+        self._remove_file(f"{path}.json")
+        self._remove_file(path)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        if self.stats_every and lookups % self.stats_every == 0:
+            logger.info(f"storage disk cache stats: {self.stats()}")
+
+
+def object_etag(storage, name):
+    """
+    Returns the ETag of an S3 object, "" if it cannot be read anymore and
+    None for other storages.
+    """
+    if not hasattr(storage, "bucket_name"):
+        return None
+    try:
+        head = storage.connection.meta.client.head_object(
+            Bucket=storage.bucket_name, Key=storage._normalize_name(name)
+        )
+    except ClientError:
+        return ""
+    return head["ETag"].strip('"')
+
+
+def file_etag(file):
+    # S3 files expose the boto3 object they are read from
+    obj = getattr(file, "obj", None)
+    return obj.e_tag.strip('"') if obj is not None else None
+
+
+class DiskCachedStorage:
+    """
+    Wraps a storage (ImageS3Storage, DocumentS3Storage) so that reads are
+    served from the local disk cache once an object was read. Writes and
+    deletes go to the storage and drop the cached copy.
+    """
+
+    def __init__(self, storage, cache=None):
+        self.storage = storage
+        self.cache = cache or disk_cache
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def open(self, name, mode="rb"):
+        if self.cache is None or any(flag in mode for flag in "wa+"):
+            return self.storage.open(name, mode)
+        return File(self.cache.open(self.storage, name), name=name)
+
+    def save(self, name, content, max_length=None):
+        name = self.storage.save(name, content, max_length=max_length)
+        if self.cache is not None:
+            self.cache.discard(self.storage, name)
+        return name
+
+    def delete(self, name):
+        self.storage.delete(name)
+        if self.cache is not None:
+            self.cache.discard(self.storage, name)
+
+
+disk_cache = (
+    DiskCache(
+        settings.STORAGE_CACHE_DIR,
+        settings.STORAGE_CACHE_MAX_SIZE,
+        revalidate=settings.STORAGE_CACHE_REVALIDATE,
+    )
+    if settings.STORAGE_CACHE_MAX_SIZE
+    else None
+)
@@ -0,0 +1,89 @@
+import logging
+import threading
+from collections import Counter
+
+
+logger = logging.getLogger(__name__)
+
+_storages = {}
+_sessions = {}
+_lock = threading.Lock()
+# boto3 clients built, by storage class
+client_constructions = Counter()
+
+
+def get_storage(storage_class, **options):
+    """
+    Returns the process wide instance of a storage class for `options`,
+    building it on first use.
+
+    A storage keeps its boto3 client (one per thread, boto3 resources are
+    not thread-safe) for its lifetime, so callers share its clients and
+    connection pools instead of setting up new ones on every call.
+    """
+    key = (storage_class, tuple(sorted(options.items())))
+    storage = _storages.get(key)
+    if storage is None:
+        with _lock:
+            storage = _storages.get(key)
+            if storage is None:
+                storage = _storages[key] = storage_class(**options)
+    return storage
+
+
+def storage_stats():
+    with _lock:
+        return {
+            "storages": len(_storages),
+            "sessions": len(_sessions),
+            "clients": dict(client_constructions),
+        }
+
+
+def clear_storages():
+    """Forgets the built storages and sessions, for tests."""
+    with _lock:
+        _storages.clear()
+        _sessions.clear()
+        client_constructions.clear()
+
+
+class SharedClientsMixin:
+    """
+    Mixin of S3Boto3Storage subclasses counting the boto3 clients they build
+    and building them from one boto3 session per set of credentials, which
+    loads the S3 service model once per process instead of once per client.
+    Pool sizes come from AWS_S3_CLIENT_CONFIG.
+    """
+
+    @property
+    def connection(self):
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            # sessions are not thread-safe, build clients one at a time
+            with _lock:
+                connection = super().connection
+                client_constructions[type(self).__name__] += 1
+            # rare once warm, a steady stream means storages are rebuilt
+            logger.info(
+                f"Built a boto3 client for {type(self).__name__} "
+                f"({self.bucket_name}), storage stats: {storage_stats()}"
+            )
+        return connection
+
+    @property
+    def unsigned_connection(self):
+        connection = getattr(self._unsigned_connections, "connection", None)
+        if connection is None:
+            with _lock:
+                connection = super().unsigned_connection
+                client_constructions[type(self).__name__] += 1
+        return connection
+
+    def _create_session(self):
+        # called with _lock held
+        key = (self.session_profile, self.access_key, self.secret_key, self.security_token)
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = super()._create_session()
+        return session
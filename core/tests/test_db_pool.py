@@ -0,0 +1,152 @@
+"""
+Tests for the raw connection pool.
+"""
+
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+from django.test import SimpleTestCase
+
+from core.db_pool import DatabaseConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.queries.append(query)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.autocommit = False
+        self.queries = []
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect(**connect_kwargs):
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    options = {"min_size": 0, "max_size": 2, "timeout": 0.05, "connect": connect}
+    options.update(kwargs)
+    return DatabaseConnectionPool(**options), opened
+
+
+class DatabaseConnectionPoolTests(SimpleTestCase):
+    """Test the connection pool."""
+
+    def test_connection_reused(self):
+        """Test a released connection is handed out again."""
+        pool, opened = make_pool()
+
+        with pool.connection() as conn:
+            self.assertTrue(conn.autocommit)
+        with pool.connection() as again:
+            self.assertIs(again, conn)
+
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(pool.stats()["checkouts"], 2)
+
+    def test_checkout_times_out_when_exhausted(self):
+        """Test checkout waits a bounded time when every connection is used."""
+        pool, _ = make_pool()
+        pool.get_connection()
+        pool.get_connection()
+
+        with self.assertRaises(PoolTimeout):
+            pool.get_connection()
+
+        stats = pool.stats()
+        self.assertEqual(stats["in_use"], 2)
+        self.assertEqual(stats["waits"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+
+    def test_dead_connection_replaced_on_checkout(self):
+        """Test a connection failing its pre-ping is discarded."""
+        pool, opened = make_pool()
+        with pool.connection() as conn:
+            pass
+        conn.broken = True
+
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, conn)
+
+        self.assertEqual(conn.closed, 1)
+        self.assertEqual(len(opened), 2)
+        self.assertEqual(pool.stats()["discarded"], 1)
+
+    def test_old_connection_recycled(self):
+        """Test a connection past its max lifetime is replaced."""
+        pool, opened = make_pool(max_lifetime=0.01, pre_ping=False)
+        with pool.connection():
+            pass
+        time.sleep(0.02)
+
+        with pool.connection() as conn:
+            self.assertIs(conn, opened[1])
+
+    def test_open_transaction_rolled_back_on_release(self):
+        """Test a connection is returned idle even after an error."""
+        pool, _ = make_pool()
+
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                conn.status = extensions.TRANSACTION_STATUS_INERROR
+                raise ValueError
+
+        self.assertEqual(conn.status, extensions.TRANSACTION_STATUS_IDLE)
+        self.assertEqual(pool.stats()["in_use"], 0)
+
+    def test_concurrent_checkouts_bounded(self):
+        """Test concurrent users never hold more than max_size connections."""
+        pool, opened = make_pool(max_size=3, timeout=5)
+        peak, in_use, lock = [0], [0], threading.Lock()
+
+        def work():
+            with pool.connection():
+                with lock:
+                    in_use[0] += 1
+                    peak[0] = max(peak[0], in_use[0])
+                time.sleep(0.01)
+                with lock:
+                    in_use[0] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(peak[0], 3)
+        self.assertLessEqual(len(opened), 3)
+        self.assertEqual(pool.stats()["in_use"], 0)
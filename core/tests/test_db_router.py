@@ -0,0 +1,152 @@
+"""
+Tests for the primary/replica and user shard database routers.
+"""
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from core.db_router import (
+    PrimaryReplicaRouter,
+    ReplicaReadMixin,
+    UserShardMixin,
+    UserShardRouter,
+    hashed_shard,
+    is_user_pinned,
+    read_alias,
+    user_shard,
+)
+from zbot.models import Conversation, Machine
+
+
+class FakeUser:
+    pk = 7
+    is_authenticated = True
+    is_active = True
+
+
+class RoutedView(ReplicaReadMixin, APIView):
+    permission_classes = []
+
+    def get(self, request):
+        return Response({"alias": read_alias()})
+
+    def post(self, request):
+        PrimaryReplicaRouter().db_for_write(None)
+        return Response({"alias": read_alias()})
+
+
+class ShardedView(UserShardMixin, ReplicaReadMixin, APIView):
+    permission_classes = []
+
+    def get(self, request):
+        return Response(
+            {
+                "alias": read_alias(),
+                "machine": PrimaryReplicaRouter().db_for_read(Machine),
+            }
+        )
+
+    def post(self, request):
+        return Response({"alias": read_alias()})
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=["replica1"], REPLICA_PIN_SECONDS=30)
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    """Test routing reads to the replicas."""
+
+    def setUp(self):
+        cache.clear()
+        self.view = RoutedView.as_view()
+        self.factory = APIRequestFactory()
+
+    def request(self, method, user=FakeUser()):
+        request = getattr(self.factory, method)("/")
+        force_authenticate(request, user=user)
+        return self.view(request).data["alias"]
+
+    def test_reads_outside_views_use_primary(self):
+        """Test reads default to the primary."""
+        self.assertEqual(read_alias(), DEFAULT_DB_ALIAS)
+        self.assertEqual(PrimaryReplicaRouter().db_for_read(None), DEFAULT_DB_ALIAS)
+
+    def test_safe_request_reads_from_replica(self):
+        """Test a GET request reads from a replica."""
+        self.assertEqual(self.request("get"), "replica1")
+        # the routing does not leak out of the request
+        self.assertEqual(read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_reads_after_write_stay_on_primary(self):
+        """Test a user who just wrote reads from the primary."""
+        self.assertEqual(self.request("post"), DEFAULT_DB_ALIAS)
+        self.assertTrue(is_user_pinned(FakeUser.pk))
+
+        self.assertEqual(self.request("get"), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.request("get", user=AnonymousUser()), "replica1")
+
+    @override_settings(DATABASE_REPLICA_ALIASES=[])
+    def test_no_replicas_configured(self):
+        """Test every read uses the primary without replicas."""
+        self.assertEqual(self.request("get"), DEFAULT_DB_ALIAS)
+
+
+@override_settings(
+    USER_SHARDS=["default", "shard1"],
+    SHARD_MAP_CACHE_SECONDS=60,
+    DATABASE_REPLICA_ALIASES=[],
+)
+class UserShardRouterTests(SimpleTestCase):
+    """Test routing the conversations of a user to their shard."""
+
+    def setUp(self):
+        cache.clear()
+        # the shard directory entry of FakeUser, as cached by user_shard
+        cache.set(f"zbot:user-shard:{FakeUser.pk}", ("shard1", False))
+        self.view = ShardedView.as_view()
+        self.factory = APIRequestFactory()
+
+    def request(self, method):
+        request = getattr(self.factory, method)("/")
+        force_authenticate(request, user=FakeUser())
+        return self.view(request)
+
+    def test_hashed_shard_is_stable(self):
+        """Test new users are spread over the shards deterministically."""
+        shards = {hashed_shard(user_id) for user_id in range(100)}
+        self.assertEqual(shards, {"default", "shard1"})
+        self.assertEqual(hashed_shard(42), hashed_shard(42))
+
+    @override_settings(USER_SHARDS=["default"])
+    def test_single_shard_uses_default(self):
+        """Test every user is on the default database without shards."""
+        self.assertEqual(user_shard(FakeUser.pk), (DEFAULT_DB_ALIAS, False))
+
+    def test_request_routes_to_user_shard(self):
+        """Test the reads of a request go to the shard of its user."""
+        response = self.request("get")
+        self.assertEqual(response.data["alias"], "shard1")
+        # machines live on the default database
+        self.assertEqual(response.data["machine"], DEFAULT_DB_ALIAS)
+        # the routing does not leak out of the request
+        self.assertEqual(read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_writes_rejected_while_moving(self):
+        """Test writes of a user being moved are rejected, reads are not."""
+        cache.set(f"zbot:user-shard:{FakeUser.pk}", ("shard1", True))
+        self.assertEqual(self.request("post").status_code, 503)
+        self.assertEqual(self.request("get").data["alias"], "shard1")
+
+    def test_router_uses_instance_shard(self):
+        """Test an instance is saved on the shard it was loaded from."""
+        router = UserShardRouter()
+        conversation = Conversation()
+        conversation._state.db = "shard1"
+        self.assertEqual(
+            router.db_for_write(Conversation, instance=conversation), "shard1"
+        )
+        self.assertIsNone(router.db_for_write(Machine))
+        self.assertIsNone(router.db_for_write(Conversation))
@@ -0,0 +1,83 @@
+"""
+Tests for the pooled connection decorator.
+"""
+
+import threading
+import time
+
+from django.test import SimpleTestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from core.db_pool import DatabaseConnectionPool
+from core.decorators import use_db_pool
+from core.tests.test_db_pool import make_pool
+
+
+@use_db_pool
+class PooledView(APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        conn = self.db_connection
+        # the same connection for the whole request
+        assert self.db_connection is conn
+        time.sleep(0.01)
+        if request.query_params.get("fail"):
+            raise ValueError("query failed")
+        return Response({"pooled": conn is not None})
+
+
+@override_settings(DB_POOL_ENABLED=True)
+class UseDbPoolTests(SimpleTestCase):
+    """Test the use_db_pool decorator."""
+
+    def setUp(self):
+        self.pool, self.opened = make_pool(max_size=3, timeout=5)
+        original, DatabaseConnectionPool._instance = DatabaseConnectionPool._instance, self.pool
+        self.addCleanup(setattr, DatabaseConnectionPool, "_instance", original)
+        self.view = PooledView.as_view()
+        self.factory = APIRequestFactory()
+
+    def test_connection_released_after_request(self):
+        """Test the request connection goes back to the pool."""
+        res = self.view(self.factory.get("/"))
+
+        self.assertTrue(res.data["pooled"])
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_connection_released_on_error(self):
+        """Test the connection is released when the view raises."""
+        with self.assertRaises(ValueError):
+            self.view(self.factory.get("/", {"fail": "1"}))
+
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+
+    @override_settings(DB_POOL_ENABLED=False)
+    def test_disabled_pool_not_used(self):
+        """Test no connection is checked out with the pool disabled."""
+        res = self.view(self.factory.get("/"))
+
+        self.assertFalse(res.data["pooled"])
+        self.assertEqual(self.pool.stats()["checkouts"], 0)
+
+    def test_concurrent_requests_bounded(self):
+        """Test concurrent requests never use more than the pool size."""
+        results = []
+
+        def request():
+            results.append(self.view(self.factory.get("/")).status_code)
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [200] * 20)
+        self.assertLessEqual(len(self.opened), 3)
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+        self.assertEqual(self.pool.stats()["checkouts"], 20)
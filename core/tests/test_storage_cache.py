@@ -0,0 +1,82 @@
+"""
+Tests for the local disk cache of storage objects.
+"""
+
+import os
+import time
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.test import SimpleTestCase
+
+from core.storage_cache import DiskCache, DiskCachedStorage
+
+
+class DiskCacheTests(SimpleTestCase):
+    """Test the disk cache of storage objects."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = DiskCache(directory.name, max_size=100, revalidate=300)
+        self.remote = InMemoryStorage()
+        self.storage = DiskCachedStorage(self.remote, self.cache)
+
+    def read(self, name):
+        with self.storage.open(name) as file:
+            return file.read()
+
+    def test_read_through(self):
+        """Test an object is read from the storage once."""
+        self.remote.save("a.jpg", ContentFile(b"a" * 10))
+        with mock.patch.object(self.remote, "open", wraps=self.remote.open) as remote_open:
+            self.assertEqual(self.read("a.jpg"), b"a" * 10)
+            self.assertEqual(self.read("a.jpg"), b"a" * 10)
+        remote_open.assert_called_once()
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_writes_drop_the_cached_copy(self):
+        """Test an object saved again is not served stale."""
+        self.remote.save("a.jpg", ContentFile(b"old"))
+        self.read("a.jpg")
+        self.storage.delete("a.jpg")
+        self.storage.save("a.jpg", ContentFile(b"new"))
+        self.assertEqual(self.read("a.jpg"), b"new")
+
+    def test_corrupted_entry_is_fetched_again(self):
+        """Test an entry whose size changed on disk is not served."""
+        self.remote.save("a.jpg", ContentFile(b"a" * 10))
+        self.read("a.jpg")
+        with open(self.cache._path(self.remote, "a.jpg"), "wb") as file:
+            file.write(b"a" * 5)
+        self.assertEqual(self.read("a.jpg"), b"a" * 10)
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_revalidation(self):
+        """Test entries are checked against the ETag of the object once stale."""
+        self.remote.save("a.jpg", ContentFile(b"a" * 10))
+        self.read("a.jpg")
+        self.cache.revalidate = 0
+        with mock.patch("core.storage_cache.object_etag", return_value="changed"):
+            self.read("a.jpg")
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_lru_eviction(self):
+        """Test the least recently read objects are evicted past the size."""
+        for name in ("a", "b", "c"):
+            self.remote.save(name, ContentFile(name.encode() * 40))
+        self.read("a")
+        self.read("b")
+        # a was read last, b is the least recently used
+        past = time.time() - 60
+        os.utime(self.cache._path(self.remote, "b"), (past, past))
+        self.read("a")
+        self.read("c")
+
+        self.assertTrue(os.path.exists(self.cache._path(self.remote, "a")))
+        self.assertFalse(os.path.exists(self.cache._path(self.remote, "b")))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertLessEqual(self.cache.stats()["bytes"], 100)
@@ -0,0 +1,60 @@
+"""
+Tests for the process wide storages and their boto3 clients.
+"""
+
+import threading
+
+from django.test import SimpleTestCase
+
+from core.storage_registry import clear_storages, get_storage, storage_stats
+from management.helpers.custom_filefield import DynamicStorageFileField
+from management.helpers.storage import DocumentS3Storage, document_storage
+from zbot.helpers.storage import BucketS3Storage, ImageS3Storage, image_storage
+
+
+class StorageRegistryTests(SimpleTestCase):
+    """Test storages are built once per process."""
+
+    def setUp(self):
+        clear_storages()
+        self.addCleanup(clear_storages)
+
+    def test_storages_are_shared(self):
+        """Test each storage is built once, per bucket for any bucket."""
+        self.assertIs(image_storage(), image_storage())
+        self.assertIsInstance(image_storage(), ImageS3Storage)
+        self.assertIs(document_storage(), get_storage(DocumentS3Storage))
+        self.assertIs(
+            get_storage(BucketS3Storage, bucket_name="a"),
+            get_storage(BucketS3Storage, bucket_name="a"),
+        )
+        self.assertIsNot(
+            get_storage(BucketS3Storage, bucket_name="a"),
+            get_storage(BucketS3Storage, bucket_name="b"),
+        )
+        self.assertEqual(storage_stats()["storages"], 4)
+
+    def test_one_client_per_thread(self):
+        """Test a storage builds one client per thread, from one session."""
+        storage = image_storage()
+        self.assertIs(storage.connection, storage.connection)
+        document_storage().connection
+
+        thread = threading.Thread(target=lambda: storage.connection)
+        thread.start()
+        thread.join()
+
+        stats = storage_stats()
+        self.assertEqual(stats["clients"], {"ImageS3Storage": 2, "DocumentS3Storage": 1})
+        self.assertEqual(stats["sessions"], 1)
+
+    def test_pool_size(self):
+        """Test clients use the configured connection pool size."""
+        client = image_storage().connection.meta.client
+        self.assertEqual(client.meta.config.max_pool_connections, 20)
+
+    def test_document_field(self):
+        """Test document files use the shared document storage."""
+        field = DynamicStorageFileField()
+        self.assertIs(field.storage, document_storage())
+        self.assertIs(field.get_storage(), document_storage())
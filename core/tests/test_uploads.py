@@ -0,0 +1,178 @@
+"""
+Tests for the direct-to-S3 uploads.
+"""
+
+import time
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from core.uploads import (
+    InvalidUpload,
+    complete_multipart_upload,
+    object_url,
+    presign_parts,
+    presign_upload,
+    read_upload_token,
+    record_multipart_resume,
+    start_multipart_upload,
+    upload_key,
+    upload_token,
+    uploaded_parts,
+    uploaded_size,
+)
+
+MB = 1024 * 1024
+from zbot.helpers.storage import ImageS3Storage
+
+
+@override_settings(
+    AWS_ACCESS_KEY_ID="test",
+    AWS_SECRET_ACCESS_KEY="test",
+    AWS_S3_REGION_NAME="eu-west-1",
+    AWS_S3_ENDPOINT_URL="http://localhost:9000",
+    ZAD_ASSIST_BUCKET="images",
+    UPLOAD_MAX_SIZE=1024,
+)
+class UploadTests(SimpleTestCase):
+    """Test presigned uploads and their finalize tokens."""
+
+    def test_upload_key(self):
+        """Test upload keys are unique and keep the base name only."""
+        key = upload_key("v1/static/media", "../../etc/photo.JPG", ["jpg"])
+        self.assertTrue(key.startswith("v1/static/media/"))
+        self.assertTrue(key.endswith("_photo.JPG"))
+        self.assertNotIn("..", key)
+        self.assertNotEqual(key, upload_key("v1/static/media", "photo.JPG", ["jpg"]))
+
+        with self.assertRaises(InvalidUpload):
+            upload_key("v1/static/media", "script.exe", ["jpg"])
+        with self.assertRaises(InvalidUpload):
+            upload_key("v1/static/media", None, ["jpg"])
+
+    def test_presign_upload(self):
+        """Test a presigned POST targets the bucket with its limits."""
+        upload = presign_upload(ImageS3Storage(), "v1/a.png", "image/png")
+
+        self.assertEqual(upload["url"], "http://localhost:9000/images")
+        self.assertEqual(upload["fields"]["key"], "v1/a.png")
+        self.assertEqual(upload["fields"]["Content-Type"], "image/png")
+        self.assertIn("policy", upload["fields"])
+
+    def test_upload_token(self):
+        """Test tokens only finalize the upload they were issued for."""
+        token = upload_token(key="v1/a.png", user=7, conversation="c1")
+
+        claims = read_upload_token(token, user=7, conversation="c1")
+        self.assertEqual(claims["key"], "v1/a.png")
+        with self.assertRaises(InvalidUpload):
+            read_upload_token(token, user=8, conversation="c1")
+        with self.assertRaises(InvalidUpload):
+            read_upload_token(token + "x", user=7, conversation="c1")
+        with self.assertRaises(InvalidUpload):
+            read_upload_token(None)
+
+    def test_uploaded_size(self):
+        """Test missing and oversized uploads are rejected."""
+        storage = ImageS3Storage()
+        client = storage.connection.meta.client
+
+        with patch.object(client, "head_object", return_value={"ContentLength": 10}):
+            self.assertEqual(uploaded_size(storage, "v1/a.png"), 10)
+
+        missing = ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        with patch.object(client, "head_object", side_effect=missing):
+            with self.assertRaises(InvalidUpload):
+                uploaded_size(storage, "v1/a.png")
+
+        with patch.object(client, "head_object", return_value={"ContentLength": 2048}):
+            with patch.object(storage, "delete") as delete:
+                with self.assertRaises(InvalidUpload):
+                    uploaded_size(storage, "v1/a.png")
+        delete.assert_called_once_with("v1/a.png")
+
+    def test_object_url(self):
+        """Test object URLs point to the configured endpoint."""
+        self.assertEqual(
+            object_url(ImageS3Storage(), "v1/a.png"),
+            "http://localhost:9000/images/v1/a.png",
+        )
+
+
+@override_settings(
+    AWS_ACCESS_KEY_ID="test",
+    AWS_SECRET_ACCESS_KEY="test",
+    AWS_S3_REGION_NAME="eu-west-1",
+    AWS_S3_ENDPOINT_URL="http://localhost:9000",
+    ZAD_ASSIST_BUCKET="images",
+    MULTIPART_PART_SIZE=8 * MB,
+)
+class MultipartUploadTests(SimpleTestCase):
+    """Test resumable multipart uploads."""
+
+    def setUp(self):
+        cache.clear()
+        self.storage = ImageS3Storage()
+        self.client = self.storage.connection.meta.client
+
+    def test_start_splits_into_parts(self):
+        """Test the part size respects the S3 part count and size limits."""
+        with patch.object(
+            self.client, "create_multipart_upload", return_value={"UploadId": "u1"}
+        ):
+            upload = start_multipart_upload(self.storage, "v1/a.pdf", 20 * MB, "application/pdf")
+            huge = start_multipart_upload(self.storage, "v1/b.pdf", 100_000 * MB, "application/pdf")
+
+        self.assertEqual((upload["upload_id"], upload["part_size"], upload["parts"]), ("u1", 8 * MB, 3))
+        self.assertLessEqual(huge["parts"], 10000)
+
+    def test_presign_parts(self):
+        """Test every missing part gets its own presigned URL."""
+        urls = presign_parts(self.storage, "v1/a.pdf", "u1", [2, 3])
+
+        self.assertEqual(set(urls), {2, 3})
+        self.assertIn("partNumber=2", urls[2])
+        self.assertIn("uploadId=u1", urls[2])
+
+    def test_uploaded_parts_paginates(self):
+        """Test the confirmed parts are listed across pages."""
+        pages = [
+            {
+                "Parts": [{"PartNumber": 1, "ETag": '"a"', "Size": 8 * MB}],
+                "IsTruncated": True,
+                "NextPartNumberMarker": 1,
+            },
+            {"Parts": [{"PartNumber": 2, "ETag": '"b"', "Size": MB}], "IsTruncated": False},
+        ]
+        with patch.object(self.client, "list_parts", side_effect=pages):
+            parts = uploaded_parts(self.storage, "v1/a.pdf", "u1")
+
+        self.assertEqual([part["PartNumber"] for part in parts], [1, 2])
+
+    def test_complete_checks_parts(self):
+        """Test an upload completes only with all of its bytes, with stats."""
+        parts = {
+            "Parts": [
+                {"PartNumber": 2, "ETag": '"b"', "Size": MB},
+                {"PartNumber": 1, "ETag": '"a"', "Size": 8 * MB},
+            ]
+        }
+        with patch.object(self.client, "list_parts", return_value=parts):
+            with patch.object(self.client, "complete_multipart_upload") as complete:
+                with self.assertRaises(InvalidUpload):
+                    complete_multipart_upload(self.storage, "v1/a.pdf", "u1", 9 * MB, 3, time.time())
+                with self.assertRaises(InvalidUpload):
+                    complete_multipart_upload(self.storage, "v1/a.pdf", "u1", 10 * MB, 2, time.time())
+                complete.assert_not_called()
+
+                record_multipart_resume("u1")
+                stats = complete_multipart_upload(
+                    self.storage, "v1/a.pdf", "u1", 9 * MB, 2, time.time() - 3
+                )
+
+        sent = complete.call_args.kwargs["MultipartUpload"]["Parts"]
+        self.assertEqual([part["PartNumber"] for part in sent], [1, 2])
+        self.assertEqual((stats["bytes"], stats["parts"], stats["resumes"]), (9 * MB, 2, 1))
+        self.assertAlmostEqual(stats["mb_per_second"], 3.0, delta=0.2)
@@ -0,0 +1,100 @@
+"""
+Tests for the presigned GET URLs handed to clients.
+"""
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from core.url_signer import s3_location, sign_fields, sign_url, sign_urls
+
+
+def presigned(operation, Params, ExpiresIn):
+    return f"https://signed/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+@override_settings(
+    SIGNED_URLS=True,
+    SIGNED_URL_EXPIRES=3600,
+    SIGNED_URL_REFRESH_MARGIN=300,
+    AWS_S3_ENDPOINT_URL=None,
+)
+class UrlSignerTests(SimpleTestCase):
+    """Test URL signing."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("zbot.helpers.storage.bucket_storage")
+        bucket_storage = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = bucket_storage.return_value.connection.meta.client
+        self.client.generate_presigned_url.side_effect = presigned
+
+    def test_s3_location(self):
+        """Test the bucket and key of S3 object URLs."""
+        self.assertEqual(
+            s3_location("https://images.s3.amazonaws.com/v1/a%20b.png"),
+            ("images", "v1/a b.png"),
+        )
+        self.assertEqual(
+            s3_location("https://data-upsertions.s3.eu-west-1.amazonaws.com/v1/a.pdf"),
+            ("data-upsertions", "v1/a.pdf"),
+        )
+        self.assertIsNone(s3_location("https://example.com/a.png"))
+        self.assertIsNone(s3_location(None))
+        with self.settings(AWS_S3_ENDPOINT_URL="http://localhost:9000"):
+            self.assertEqual(
+                s3_location("http://localhost:9000/images/v1/a.png"), ("images", "v1/a.png")
+            )
+
+    def test_sign_urls(self):
+        """Test S3 URLs are signed, others are passed through."""
+        self.assertEqual(
+            sign_urls(
+                ["https://images.s3.amazonaws.com/v1/a.png", "https://example.com/b.png", None]
+            ),
+            ["https://signed/images/v1/a.png?expires=3600", "https://example.com/b.png", None],
+        )
+
+    def test_signatures_are_cached(self):
+        """Test an object is signed once until its signature nears expiry."""
+        urls = [f"https://images.s3.amazonaws.com/v1/{i}.png" for i in range(3)]
+        with mock.patch("core.url_signer.cache.set_many", wraps=cache.set_many) as set_many:
+            first = sign_urls(urls)
+            self.assertEqual(sign_urls(urls + urls), first + first)
+        self.assertEqual(self.client.generate_presigned_url.call_count, 3)
+        set_many.assert_called_once()
+        self.assertEqual(set_many.call_args.args[1], 3300)
+
+    def test_disabled(self):
+        """Test URLs of public buckets are not signed."""
+        with self.settings(SIGNED_URLS=False):
+            url = "https://images.s3.amazonaws.com/v1/a.png"
+            self.assertEqual(sign_url(url), url)
+        self.client.generate_presigned_url.assert_not_called()
+
+    def test_sign_fields(self):
+        """Test the URL fields of serialized items are signed in place."""
+        items = [{"image_url": "https://images.s3.amazonaws.com/v1/a.png"}, {"image_url": None}]
+        sign_fields(items, ["image_url"])
+        self.assertEqual(
+            items,
+            [{"image_url": "https://signed/images/v1/a.png?expires=3600"}, {"image_url": None}],
+        )
+
+    def test_serializer_lists_are_signed_in_one_batch(self):
+        """Test a list of image messages signs its URLs with one call."""
+        from zbot.models import ImageMessage
+        from zbot.serializers import ConversationImageMessageSerializer
+
+        images = [
+            ImageMessage(image_url=f"https://images.s3.amazonaws.com/v1/{i}.png")
+            for i in range(3)
+        ]
+        with mock.patch("core.url_signer.sign_urls", side_effect=sign_urls) as signer:
+            data = ConversationImageMessageSerializer(images, many=True).data
+            single = ConversationImageMessageSerializer(images[0]).data
+        self.assertEqual(signer.call_count, 2)
+        self.assertEqual(data[2]["image_url"], "https://signed/images/v1/2.png?expires=3600")
+        self.assertEqual(single["image_url"], data[0]["image_url"])
@@ -0,0 +1,87 @@
+"""
+Tests for the background user deletion.
+"""
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import UserDeletionJob
+from core.user_deletion import run_user_deletion
+from management.models import Document
+from zbot import models
+
+
+def create_synthetic_user(conversations=30, messages=20):
+    """Create a user with many conversations, messages and parameters."""
+    user = get_user_model().objects.create_user(
+        email="heavy@example.com", password="testpass123"
+    )
+    for i in range(conversations):
+        conversation = models.Conversation.objects.create(
+            name=f"conversation {i}", title="title", user=user
+        )
+        models.TextMessage.objects.bulk_create(
+            models.TextMessage(conversation=conversation, text=f"message {j}")
+            for j in range(messages)
+        )
+        models.ImageMessage.objects.bulk_create(
+            models.ImageMessage(conversation=conversation, metadata="a.jpg")
+            for _ in range(messages // 4)
+        )
+        models.MachineParameter.objects.create(conversation=conversation)
+    Document.objects.create(
+        owner=user,
+        document_name="manual",
+        document_tag="tag",
+        image_status="done",
+        text_status="done",
+        table_status="done",
+    )
+    return user
+
+
+class UserDeletionTests(TestCase):
+    """Test deleting a user and their data in batches."""
+
+    def test_delete_endpoint_disables_user(self):
+        """Test the endpoint disables the user and queues a deletion job."""
+        user = get_user_model().objects.create_user(
+            email="user@example.com", password="testpass123"
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            res = client.delete(
+                reverse("delete-user-delete-user"),
+                {"current_password": "testpass123"},
+                format="json",
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertEqual(len(callbacks), 1)
+        job = UserDeletionJob.objects.get(pk=res.data["job_id"])
+        self.assertEqual(job.status, UserDeletionJob.PENDING)
+
+    def test_batched_deletion_of_synthetic_user(self):
+        """Test every row of a large user is deleted in small batches."""
+        user = create_synthetic_user()
+        job = UserDeletionJob.objects.create(user_id=user.pk, email=user.email)
+
+        run_user_deletion(job.pk, batch_size=50, sleep=0)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UserDeletionJob.DONE)
+        self.assertEqual(job.step, "user")
+        self.assertFalse(get_user_model().objects.filter(pk=user.pk).exists())
+        self.assertFalse(models.Conversation.objects.filter(user_id=user.pk).exists())
+        self.assertEqual(models.TextMessage.objects.count(), 0)
+        self.assertEqual(models.ImageMessage.objects.count(), 0)
+        self.assertEqual(models.MachineParameter.objects.count(), 0)
+        self.assertEqual(Document.objects.count(), 0)
+        self.assertGreater(job.deleted_rows, 30 * 20)
@@ -0,0 +1,268 @@
+import os
+import math
+import time
+import uuid
+import logging
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_TOKEN_SALT = "core.uploads"
+# S3 multipart limits: parts of at least 5 MB (but the last), 10000 parts
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_MAX_PARTS = 10000
+
+
+class InvalidUpload(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "The upload is invalid or has expired."
+    default_code = "invalid_upload"
+
+
+def upload_key(prefix, filename, allowed_extensions):
+    """
+    Returns a unique object key for a file a client is about to upload.
+
+    Raises:
+    InvalidUpload: If the extension of the file is not allowed.
+    """
+    # the client picks the name, keep its last component only
+    filename = os.path.basename(filename or "")
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    if not filename or extension not in allowed_extensions:
+        raise InvalidUpload(
+            f"Allowed file extensions are: {', '.join(allowed_extensions)}."
+        )
+    return f"{prefix}/{uuid.uuid4()}_{filename}"
+
+
+def presign_upload(storage, key, content_type, max_size=None):
+    """
+    Returns a presigned POST letting a client upload a file straight to the
+    bucket of a storage, so the bytes never go through a worker. The bucket
+    rejects files larger than `max_size` or of another content type.
+
+    Returns:
+    dict: The URL to POST to and the form fields to send with the file.
+    """
+    max_size = max_size or settings.UPLOAD_MAX_SIZE
+    return storage.connection.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=storage._normalize_name(key),
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, max_size],
+        ],
+        ExpiresIn=settings.UPLOAD_URL_EXPIRES,
+    )
+
+
+def upload_token(**claims):
+    """Signs what the finalize call of an upload needs to trust."""
+    return signing.dumps(claims, salt=UPLOAD_TOKEN_SALT)
+
+
+def read_upload_token(token, **expected):
+    """
+    Returns the claims of an upload token, checking they match `expected`.
+
+    Raises:
+    InvalidUpload: If the token is forged, expired or issued for another
+        user or target.
+    """
+    try:
+        claims = signing.loads(
+            token or "", salt=UPLOAD_TOKEN_SALT, max_age=settings.UPLOAD_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        raise InvalidUpload()
+    for name, value in expected.items():
+        if str(claims.get(name)) != str(value):
+            raise InvalidUpload()
+    return claims
+
+
+def uploaded_size(storage, key, max_size=None):
+    """
+    Returns the size of an uploaded object.
+
+    Raises:
+    InvalidUpload: If the object was not uploaded or is too large.
+    """
+    max_size = max_size or settings.UPLOAD_MAX_SIZE
+    try:
+        head = storage.connection.meta.client.head_object(
+            Bucket=storage.bucket_name, Key=storage._normalize_name(key)
+        )
+    except ClientError:
+        raise InvalidUpload("The file was not uploaded.")
+    if head["ContentLength"] > max_size:
+        storage.delete(key)
+        raise InvalidUpload(
+            f"File too large. Size should not exceed {max_size // (1024 * 1024)} MB."
+        )
+    return head["ContentLength"]
+
+
+def object_url(storage, key):
+    """Returns the unsigned URL of an object of a storage bucket."""
+    name = storage._normalize_name(key)
+    if settings.AWS_S3_ENDPOINT_URL:
+        return f"{settings.AWS_S3_ENDPOINT_URL.rstrip('/')}/{storage.bucket_name}/{name}"
+    return f"https://{storage.bucket_name}.s3.amazonaws.com/{name}"
+
+
+def _resumes_key(upload_id):
+    return f"core:multipart-resumes:{upload_id}"
+
+
+def start_multipart_upload(storage, key, size, content_type):
+    """
+    Starts an S3 multipart upload of a file of `size` bytes. The client
+    uploads the parts, in parallel, with the URLs of presign_parts.
+
+    Incomplete uploads keep their parts in the bucket until they are
+    aborted, the bucket should expire them with an
+    AbortIncompleteMultipartUpload lifecycle rule.
+
+    Returns:
+    dict: The upload ID, the part size, the number of parts and the start
+    time.
+    """
+    part_size = max(
+        settings.MULTIPART_PART_SIZE,
+        MULTIPART_MIN_PART_SIZE,
+        math.ceil(size / MULTIPART_MAX_PARTS),
+    )
+    upload = storage.connection.meta.client.create_multipart_upload(
+        Bucket=storage.bucket_name,
+        Key=storage._normalize_name(key),
+        ContentType=content_type,
+    )
+    return {
+        "upload_id": upload["UploadId"],
+        "part_size": part_size,
+        "parts": max(math.ceil(size / part_size), 1),
+        "started": time.time(),
+    }
+
+
+def presign_parts(storage, key, upload_id, part_numbers):
+    """Returns presigned PUT URLs of the parts of a multipart upload."""
+    client = storage.connection.meta.client
+    return {
+        number: client.generate_presigned_url(
+            "upload_part",
+            Params={
+                "Bucket": storage.bucket_name,
+                "Key": storage._normalize_name(key),
+                "UploadId": upload_id,
+                "PartNumber": number,
+            },
+            ExpiresIn=settings.UPLOAD_URL_EXPIRES,
+        )
+        for number in part_numbers
+    }
+
+
+def uploaded_parts(storage, key, upload_id):
+    """
+    Returns the parts of a multipart upload the bucket confirmed, which is
+    where an interrupted upload resumes from.
+
+    Raises:
+    InvalidUpload: If the upload was completed or aborted.
+    """
+    client = storage.connection.meta.client
+    parts, marker = [], 0
+    while True:
+        try:
+            page = client.list_parts(
+                Bucket=storage.bucket_name,
+                Key=storage._normalize_name(key),
+                UploadId=upload_id,
+                PartNumberMarker=marker,
+            )
+        except ClientError:
+            raise InvalidUpload("The upload does not exist anymore.")
+        parts += [
+            {"PartNumber": part["PartNumber"], "ETag": part["ETag"], "Size": part["Size"]}
+            for part in page.get("Parts", [])
+        ]
+        if not page.get("IsTruncated"):
+            return parts
+        marker = page["NextPartNumberMarker"]
+
+
+def record_multipart_resume(upload_id):
+    """Counts the resumes of a multipart upload, reported on completion."""
+    key = _resumes_key(upload_id)
+    cache.add(key, 0, settings.UPLOAD_TOKEN_MAX_AGE)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired in between, the count is best effort
+        pass
+
+
+def complete_multipart_upload(storage, key, upload_id, size, parts, started):
+    """
+    Assembles the parts of a multipart upload into the object.
+
+    Raises:
+    InvalidUpload: If parts are missing or their sizes do not add up.
+
+    Returns:
+    dict: Upload stats: bytes, parts, seconds, MB/s and resumes.
+    """
+    uploaded = uploaded_parts(storage, key, upload_id)
+    numbers = {part["PartNumber"] for part in uploaded}
+    missing = sorted(set(range(1, parts + 1)) - numbers)
+    if missing:
+        raise InvalidUpload(f"Parts {missing} were not uploaded.")
+    total = sum(part["Size"] for part in uploaded)
+    if total != size:
+        raise InvalidUpload(f"Uploaded {total} bytes, {size} were announced.")
+
+    storage.connection.meta.client.complete_multipart_upload(
+        Bucket=storage.bucket_name,
+        Key=storage._normalize_name(key),
+        UploadId=upload_id,
+        MultipartUpload={
+            "Parts": [
+                {"PartNumber": part["PartNumber"], "ETag": part["ETag"]}
+                for part in sorted(uploaded, key=lambda part: part["PartNumber"])
+            ]
+        },
+    )
+    resumes = cache.get(_resumes_key(upload_id), 0)
+    cache.delete(_resumes_key(upload_id))
+    seconds = max(time.time() - started, 0.001)
+    return {
+        "bytes": total,
+        "parts": len(uploaded),
+        "seconds": round(seconds, 1),
+        "mb_per_second": round(total / seconds / (1024 * 1024), 2),
+        "resumes": resumes,
+    }
+
+
+def abort_multipart_upload(storage, key, upload_id):
+    """Aborts a multipart upload, deleting its parts."""
+    try:
+        storage.connection.meta.client.abort_multipart_upload(
+            Bucket=storage.bucket_name,
+            Key=storage._normalize_name(key),
+            UploadId=upload_id,
+        )
+    except ClientError as e:
+        logger.warning(f"Failed to abort multipart upload {upload_id}: {e}")
+    cache.delete(_resumes_key(upload_id))
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+
+logger = logging.getLogger(__name__)
+
+
+def _signature_key(bucket, key):
+    digest = hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()
+    return f"core:signed-url:{digest}"
+
+
+def s3_location(url):
+    """
+    Returns the bucket and key of an unsigned S3 object URL, virtual-hosted
+    (https://<bucket>.s3[.<region>].amazonaws.com/<key>) or path-style on
+    AWS_S3_ENDPOINT_URL, None for other URLs.
+    """
+    if not url:
+        return None
+    parts = urlsplit(url)
+    endpoint = settings.AWS_S3_ENDPOINT_URL
+    if endpoint and url.startswith(endpoint.rstrip("/") + "/"):
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+    elif parts.hostname and parts.hostname.endswith(".amazonaws.com") and ".s3" in parts.hostname:
+        bucket, key = parts.hostname.split(".s3")[0], parts.path.lstrip("/")
+    else:
+        return None
+    if not bucket or not key:
+        return None
+    return bucket, unquote(key)
+
+
+def sign_urls(urls):
+    """
+    Returns presigned GET URLs of S3 object URLs, in the order given.
+
+    Signatures are cached until SIGNED_URL_REFRESH_MARGIN seconds before they
+    expire, read and written with one cache round trip per batch, so a
+    response signs each object at most once an hour. URLs that are not S3
+    object URLs, and all URLs while SIGNED_URLS is off (public buckets),
+    are returned as they are.
+
+    Args:
+    urls (list): URLs, None entries allowed.
+
+    Returns:
+    list: The URLs to hand to clients.
+    """
+    if not settings.SIGNED_URLS:
+        return list(urls)
+    from zbot.helpers.storage import bucket_storage
+
+    locations = [s3_location(url) for url in urls]
+    keys = {
+        location: _signature_key(*location) for location in locations if location
+    }
+    cached = cache.get_many(keys.values())
+    signed = {}
+    for location, cache_key in keys.items():
+        if cache_key in cached:
+            signed[location] = cached[cache_key]
+            continue
+        bucket, key = location
+        signed[location] = bucket_storage(bucket).connection.meta.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": key},
+            ExpiresIn=settings.SIGNED_URL_EXPIRES,
+        )
+
+    missing = {
+        keys[location]: url
+        for location, url in signed.items()
+        if keys[location] not in cached
+    }
+    if missing:
+        cache.set_many(
+            missing, settings.SIGNED_URL_EXPIRES - settings.SIGNED_URL_REFRESH_MARGIN
+        )
+        logger.debug(f"Signed {len(missing)} URLs, {len(cached)} cached")
+    return [
+        signed[location] if location else url for url, location in zip(urls, locations)
+    ]
+
+
+def sign_url(url):
+    return sign_urls([url])[0]
+
+
+def sign_fields(items, fields):
+    """Signs the URL `fields` of a list of dictionaries in place, in one batch."""
+    slots = [(item, field) for item in items for field in fields if item.get(field)]
+    for (item, field), url in zip(
+        slots, sign_urls([item[field] for item, field in slots])
+    ):
+        item[field] = url
+    return items
+
+
+class SignedURLListSerializer(serializers.ListSerializer):
+    """Signs the Meta.signed_url_fields of a whole list at once."""
+
+    def to_representation(self, data):
+        items = super().to_representation(data)
+        return sign_fields(items, self.child.Meta.signed_url_fields)
+
+
+class SignedURLSerializerMixin:
+    """
+    Signs the URL fields listed in Meta.signed_url_fields of a model
+    serializer, in one batch for lists (set Meta.list_serializer_class to
+    SignedURLListSerializer).
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if isinstance(self.parent, SignedURLListSerializer):
+            return data
+        return sign_fields([data], self.Meta.signed_url_fields)[0]
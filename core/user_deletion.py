@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+
+from management.helpers.storage import document_storage
+from management.models import Document
+from zbot.helpers.purge import delete_files, purge_conversations, purge_rows
+from zbot.helpers.storage import image_storage
+from zbot.models import Conversation
+from .db_router import shard_for_user
+from .models import UserDeletionJob
+
+
+logger = logging.getLogger(__name__)
+
+# rows deleted per transaction, keeps locks short and WAL bursts small
+USER_DELETION_BATCH_SIZE = getattr(settings, "USER_DELETION_BATCH_SIZE", 500)
+# conversations purged together, each with all of its messages
+USER_DELETION_CONVERSATIONS = 20
+# seconds to wait between batches, lets replication and vacuum keep up
+USER_DELETION_SLEEP = getattr(settings, "USER_DELETION_SLEEP", 0.05)
+
+
+def _delete_conversations(user_id, batch_size):
+    using = shard_for_user(user_id)
+    conversations = Conversation.objects.using(using).filter(user_id=user_id)
+    while True:
+        ids = list(conversations.values_list("id", flat=True)[:USER_DELETION_CONVERSATIONS])
+        if not ids:
+            return
+        deleted, keys = purge_conversations(ids, batch_size, using)
+        yield deleted, image_storage, keys
+
+
+def _delete_documents(user_id, batch_size):
+    while True:
+        ids = list(
+            Document.objects.filter(owner_id=user_id).values_list("id", flat=True)[
+                :batch_size
+            ]
+        )
+        if not ids:
+            return
+        deleted, keys = purge_rows(Document, ids)
+        yield deleted, document_storage, keys
+
+
+def _delete_user(user_id, batch_size):
+    # what is left (profiles, tokens, permissions) is small, let the ORM
+    # cascade it
+    deleted, _ = get_user_model().objects.filter(pk=user_id).delete()
+    yield deleted, None, []
+
+
+USER_DELETION_STEPS = [
+    ("conversations", _delete_conversations),
+    ("documents", _delete_documents),
+    ("user", _delete_user),
+]
+
+
+def start_user_deletion(user):
+    """
+    Disables a user right away and deletes their data in the background.
+
+    Returns:
+    UserDeletionJob: The job tracking the deletion.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        job = UserDeletionJob.objects.create(user_id=user.pk, email=user.email)
+        transaction.on_commit(
+            lambda: threading.Thread(
+                target=run_user_deletion, args=(job.pk,), daemon=True
+            ).start()
+        )
+    return job
+
+
+def run_user_deletion(job_id, batch_size=None, sleep=None):
+    """
+    Runs a user deletion job in batches, one short transaction per batch.
+    Steps are idempotent, so a failed or interrupted job can be run again
+    (see the resume_user_deletions command).
+
+    Args:
+    job_id (int): The ID of the UserDeletionJob.
+    batch_size (int): Rows deleted per transaction.
+    sleep (float): Seconds to wait between batches.
+    """
+    batch_size = batch_size or USER_DELETION_BATCH_SIZE
+    sleep = USER_DELETION_SLEEP if sleep is None else sleep
+    job = UserDeletionJob.objects.get(pk=job_id)
+    started = time.monotonic()
+    UserDeletionJob.objects.filter(pk=job_id).update(
+        status=UserDeletionJob.RUNNING, error="", updated_at=timezone.now()
+    )
+
+    try:
+        deleted_rows = job.deleted_rows
+        for step, delete in USER_DELETION_STEPS:
+            for deleted, storage, keys in delete(job.user_id, batch_size):
+                deleted_rows += deleted
+                if keys:
+                    try:
+                        delete_files(storage(), keys)
+                    except Exception as e:
+                        # orphaned files do not block the deletion
+                        logger.error(f"Failed to delete files of user {job.user_id}: {e}")
+                UserDeletionJob.objects.filter(pk=job_id).update(
+                    step=step, deleted_rows=deleted_rows, updated_at=timezone.now()
+                )
+                if sleep:
+                    time.sleep(sleep)
+        UserDeletionJob.objects.filter(pk=job_id).update(
+            status=UserDeletionJob.DONE,
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+        logger.info(
+            f"Deleted user {job.user_id}: {deleted_rows} rows in "
+            f"{time.monotonic() - started:.1f} seconds"
+        )
+    except Exception as e:
+        logger.error(f"User deletion job {job_id} failed: {e}")
+        UserDeletionJob.objects.filter(pk=job_id).update(
+            status=UserDeletionJob.FAILED, error=str(e), updated_at=timezone.now()
+        )
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            # connections are per thread, do not leak this one
+            connection.close()
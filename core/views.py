@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.contrib.auth import get_user_model
 from .serializers import CustomUserDeleteSerializer  # Import your serializer
+from .user_deletion import start_user_deletion
 from rest_framework_simplejwt.tokens import RefreshToken
 import logging
 logger = logging.getLogger(__name__)
@@ -39,9 +40,12 @@ class UserViewSet(viewsets.ViewSet):
             # Delete tokens or perform any necessary clean-up
             delete_tokens_for_user(user)
             
-            # Perform the deletion action
-            user.delete()  # Ensure the user instance is deleted correctly
+            # Disable the account now, its data is deleted in the background
+            job = start_user_deletion(user)
             
-            return Response({"message": "User deleted successfully."}, status=status.HTTP_204_NO_CONTENT)
+            return Response(
+                {"message": "User deletion started.", "job_id": job.id},
+                status=status.HTTP_202_ACCEPTED,
+            )
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
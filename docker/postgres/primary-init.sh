@@ -0,0 +1,5 @@
+#!/bin/bash
+# Lets the replica service stream WAL from the primary. Runs on the first
+# start of an empty data volume only.
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
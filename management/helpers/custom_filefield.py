@@ -1,11 +1,13 @@
 # app/management/helpers/custom_filefield.py
 from django.db.models import FileField
-from .storage import DocumentS3Storage
+from .storage import document_storage
 
 class DynamicStorageFileField(FileField):
+    def __init__(self, *args, **kwargs):
+        # a callable keeps the storage out of migrations, and the instance
+        # (with its boto3 clients) is shared by the process
+        kwargs.setdefault("storage", document_storage)
+        super().__init__(*args, **kwargs)
+
     def get_storage(self, instance=None):
-        storage = DocumentS3Storage()
-        # Optionally log here to confirm it's called
-        import logging
-        logging.getLogger(__name__).info(f"DynamicStorageFileField using storage: {storage}")
-        return storage
\ No newline at end of file
+        return document_storage()
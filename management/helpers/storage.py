@@ -1,11 +1,19 @@
 from storages.backends.s3boto3 import S3Boto3Storage
 from django.conf import settings
 import logging
+
+from core.storage_registry import SharedClientsMixin, get_storage
+
 logger = logging.getLogger(__name__)
-class DocumentS3Storage(S3Boto3Storage):
+class DocumentS3Storage(SharedClientsMixin, S3Boto3Storage):
     default_acl = None
 
     def __init__(self, *args, **kwargs):
         kwargs['bucket_name'] = getattr(settings, 'DATA_UPSERTION_BUCKET', "data-upsertions")
         # logger.info(f"DocumentS3Storage initialized with bucket: {kwargs['bucket_name']}")
-        super().__init__(*args, **kwargs)
\ No newline at end of file
+        super().__init__(*args, **kwargs)
+
+
+def document_storage():
+    """Returns the process wide DocumentS3Storage."""
+    return get_storage(DocumentS3Storage)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from core.serializers import CustomUserSerializer
+from core.url_signer import SignedURLListSerializer, SignedURLSerializerMixin
 from .models import (
     Customer,
     Company,
@@ -69,7 +70,7 @@ class SimpleOperatorSerializer(serializers.ModelSerializer):
         fields = ["id", "user__first_name", "user__last_name"]
 
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DocumentSerializer(SignedURLSerializerMixin, serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(read_only=True)
     
     class Meta:
@@ -95,4 +96,6 @@ class DocumentSerializer(serializers.ModelSerializer):
             "is_deleted",
         ]
         read_only_fields = ['id', 'owner', 'created_at', 'updated_at',   'document_url','progress','image_status','text_status','table_status',
-            'job_id', 'job_created_at', "is_deleted"]
\ No newline at end of file
+            'job_id', 'job_created_at', "is_deleted"]
+        list_serializer_class = SignedURLListSerializer
+        signed_url_fields = ['document_url']
\ No newline at end of file
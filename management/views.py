@@ -11,8 +11,22 @@ from .models import Customer, Company, Document, Operator
 from .serializers import CustomerSerializer, CompanySerializer, DocumentSerializer, OperatorSerializer
 from .paginations import CustomLimitOffsetPagination
 from .filters import OperatorFilter, CompanyFilter, CustomerFilter, DocumentFilter
-from .helpers.storage import DocumentS3Storage 
+from .helpers.storage import document_storage
 from .helpers.utils import document_upload_path
+from core.uploads import (
+    abort_multipart_upload,
+    complete_multipart_upload,
+    object_url,
+    presign_parts,
+    presign_upload,
+    read_upload_token,
+    record_multipart_resume,
+    start_multipart_upload,
+    upload_key,
+    upload_token,
+    uploaded_parts,
+    uploaded_size,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -61,7 +75,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.is_staff or user.is_superuser:
             return Document.objects.all().select_related("owner").order_by("-created_at")
-        return Document.objects.filter(owner=user, is_deleted=False).select_related("owner") .order_by("-created_at")
+        return Document.live.filter(owner=user).select_related("owner") .order_by("-created_at")
     
     @action(detail=False, methods=['post'], url_path='upload')
     def upload(self, request, *args, **kwargs):
@@ -70,7 +84,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
             return Response({'error': 'No file provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Use dynamic storage directly
-        storage = DocumentS3Storage()
+        storage = document_storage()
         updated_name = f"v1/dataset/{uuid.uuid4()}_{file_obj.name}"
         file_obj.name = updated_name  # Set the upload path
         logger.info(f"Uploading file: {file_obj.name} to bucket: {storage.bucket_name}")
@@ -78,10 +92,125 @@ class DocumentViewSet(viewsets.ModelViewSet):
         # Build public URL
         public_url = f"https://data-upsertions.s3.eu-west-1.amazonaws.com/{file_name}"
         logger.info(f"document url: {public_url}")
+        return self._create_document(request, file_name, public_url)
+
+    @action(detail=False, methods=['post'], url_path='upload-url')
+    def upload_url(self, request, *args, **kwargs):
+        """
+        Issue a presigned POST uploading a document straight to S3, then
+        create the document with finalize-upload.
+        """
+        key = upload_key("v1/dataset", request.data.get('filename'), ["pdf"])
+        return Response(
+            {
+                "upload": presign_upload(document_storage(), key, "application/pdf"),
+                "upload_token": upload_token(key=key, user=request.user.pk),
+                "expires_in": settings.UPLOAD_URL_EXPIRES,
+            }
+        )
+
+    @action(detail=False, methods=['post'], url_path='finalize-upload')
+    def finalize_upload(self, request, *args, **kwargs):
+        """Create the document of a file uploaded with upload-url."""
+        claims = read_upload_token(request.data.get('upload_token'), user=request.user.pk)
+        storage = document_storage()
+        # a retried finalize returns the document of the first one
+        document = Document.objects.filter(owner=request.user, document_file=claims["key"]).first()
+        if document:
+            return Response({"document": DocumentSerializer(document).data})
+        uploaded_size(storage, claims["key"])
+        return self._create_document(
+            request, claims["key"], object_url(storage, claims["key"]), document_file=claims["key"]
+        )
+
+    def _multipart_claims(self, request):
+        return read_upload_token(
+            request.data.get('upload_token'), user=request.user.pk, kind="multipart"
+        )
+
+    @action(detail=False, methods=['post'], url_path='multipart-upload')
+    def multipart_upload(self, request, *args, **kwargs):
+        """
+        Start a resumable upload of a large document: the client PUTs the
+        parts to their presigned URLs in parallel, asks multipart-upload/resume
+        for the missing ones after an interruption, then calls
+        multipart-upload/complete.
+        """
+        key = upload_key("v1/dataset", request.data.get('filename'), ["pdf"])
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            size = 0
+        if not 0 < size <= settings.MULTIPART_UPLOAD_MAX_SIZE:
+            return Response(
+                {"error": f"size must be between 1 and {settings.MULTIPART_UPLOAD_MAX_SIZE} bytes."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        storage = document_storage()
+        upload = start_multipart_upload(storage, key, size, "application/pdf")
+        return Response(
+            {
+                "upload_token": upload_token(kind="multipart", key=key, user=request.user.pk, size=size, **upload),
+                "part_size": upload["part_size"],
+                "parts": upload["parts"],
+                "urls": presign_parts(storage, key, upload["upload_id"], range(1, upload["parts"] + 1)),
+                "expires_in": settings.UPLOAD_URL_EXPIRES,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(detail=False, methods=['post'], url_path='multipart-upload/resume')
+    def multipart_upload_resume(self, request, *args, **kwargs):
+        """Return the confirmed parts of an upload and new URLs for the others."""
+        claims = self._multipart_claims(request)
+        storage = document_storage()
+        uploaded = uploaded_parts(storage, claims["key"], claims["upload_id"])
+        confirmed = sorted(part["PartNumber"] for part in uploaded)
+        missing = sorted(set(range(1, claims["parts"] + 1)) - set(confirmed))
+        record_multipart_resume(claims["upload_id"])
+        return Response(
+            {
+                "uploaded_parts": confirmed,
+                "urls": presign_parts(storage, claims["key"], claims["upload_id"], missing),
+                "expires_in": settings.UPLOAD_URL_EXPIRES,
+            }
+        )
+
+    @action(detail=False, methods=['post'], url_path='multipart-upload/complete')
+    def multipart_upload_complete(self, request, *args, **kwargs):
+        """Assemble the parts of an upload and create its document."""
+        claims = self._multipart_claims(request)
+        storage = document_storage()
+        document = Document.objects.filter(owner=request.user, document_file=claims["key"]).first()
+        if document:
+            return Response({"document": DocumentSerializer(document).data})
+        stats = complete_multipart_upload(
+            storage, claims["key"], claims["upload_id"], claims["size"], claims["parts"], claims["started"]
+        )
+        logger.info(
+            f"Multipart upload of {claims['key']}: {stats['bytes']} bytes in {stats['parts']} parts, "
+            f"{stats['seconds']} seconds ({stats['mb_per_second']} MB/s), {stats['resumes']} resumes"
+        )
+        response = self._create_document(
+            request, claims["key"], object_url(storage, claims["key"]), document_file=claims["key"]
+        )
+        response.data["upload"] = stats
+        return response
+
+    @action(detail=False, methods=['post'], url_path='multipart-upload/abort')
+    def multipart_upload_abort(self, request, *args, **kwargs):
+        """Abort an upload and delete its parts."""
+        claims = self._multipart_claims(request)
+        abort_multipart_upload(document_storage(), claims["key"], claims["upload_id"])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def _create_document(self, request, file_name, document_url, document_file=None):
+        """Create the document of an uploaded file and start its upsertion."""
         # Create Document instance manually
         document = Document.objects.create(
             owner=request.user,
-            document_url=public_url,
+            document_url=document_url,
+            document_file=document_file,
             document_name=request.data.get('document_name'),
             document_tag=request.data.get('document_tag', ''),
             document_description=request.data.get('document_description', ''),
@@ -0,0 +1,234 @@
+import json
+import zlib
+import logging
+from datetime import datetime
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from psycopg2.extras import execute_values
+
+from core.db_router import read_alias, write_alias
+from zbot.models import ConversationArchive, TextMessage, ImageMessage
+from .history_cache import history_cache
+from .utils import parse_legacy_metadata
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    # keep microseconds, DjangoJSONEncoder rounds datetimes to milliseconds
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+ARCHIVED_MODELS = {"text": TextMessage, "image": ImageMessage}
+
+# conversations idle since `cutoff` that still have messages in the hot tables
+IDLE_CONVERSATIONS_QUERY = """
+    SELECT
+        c.id
+    FROM
+        zbot_conversation c
+    WHERE
+        c.id > %(after)s
+        AND c.updated_at < %(cutoff)s
+        AND NOT EXISTS (
+            SELECT 1 FROM zbot_conversationarchive a WHERE a.conversation_id = c.id
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM zbot_textmessage tm
+            WHERE tm.conversation_id = c.id AND tm.updated_at >= %(cutoff)s
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM zbot_imagemessage im
+            WHERE im.conversation_id = c.id AND im.updated_at >= %(cutoff)s
+        )
+        AND (
+            EXISTS (SELECT 1 FROM zbot_textmessage tm WHERE tm.conversation_id = c.id)
+            OR EXISTS (SELECT 1 FROM zbot_imagemessage im WHERE im.conversation_id = c.id)
+        )
+    ORDER BY c.id
+    LIMIT %(limit)s;
+"""
+
+
+def _columns(model):
+    return [field.column for field in model._meta.concrete_fields]
+
+
+def find_idle_conversations(
+    cutoff, limit, after="00000000-0000-0000-0000-000000000000", using=None
+):
+    """Returns the IDs of up to `limit` idle conversations after `after`."""
+    with connections[using or write_alias()].cursor() as cursor:
+        cursor.execute(
+            IDLE_CONVERSATIONS_QUERY,
+            {"cutoff": cutoff, "limit": limit, "after": after},
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def archive_conversation(conversation_id, using=None):
+    """
+    Moves the text and image messages of a conversation into its archive
+    row, as zlib-compressed JSON rows.
+
+    Args:
+    conversation_id (uuid): The ID of the conversation.
+    using (str): The database (shard) of the conversation.
+
+    Returns:
+    ConversationArchive: The archive, or None if there was nothing to move.
+    """
+    using = using or write_alias()
+    archives = ConversationArchive.objects.using(using)
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        # blocks message inserts (they take a key share lock on the
+        # conversation) until the rows are moved
+        cursor.execute(
+            "SELECT id FROM zbot_conversation WHERE id = %s FOR UPDATE;",
+            [conversation_id],
+        )
+        if archives.filter(conversation_id=conversation_id).exists():
+            return None
+
+        timeline = {"columns": {}, "rows": {}}
+        for kind, model in ARCHIVED_MODELS.items():
+            columns = _columns(model)
+            cursor.execute(
+                f"SELECT {', '.join(columns)} FROM {model._meta.db_table} "
+                "WHERE conversation_id = %s ORDER BY created_at;",
+                [conversation_id],
+            )
+            timeline["columns"][kind] = columns
+            timeline["rows"][kind] = cursor.fetchall()
+        if not any(timeline["rows"].values()):
+            return None
+
+        payload = zlib.compress(
+            json.dumps(timeline, cls=ArchiveJSONEncoder).encode("utf-8"), 9
+        )
+        archive = archives.create(
+            conversation_id=conversation_id,
+            payload=payload,
+            text_count=len(timeline["rows"]["text"]),
+            image_count=len(timeline["rows"]["image"]),
+        )
+        for model in ARCHIVED_MODELS.values():
+            cursor.execute(
+                f"DELETE FROM {model._meta.db_table} WHERE conversation_id = %s;",
+                [conversation_id],
+            )
+        transaction.on_commit(
+            lambda: history_cache.invalidate(conversation_id), using=using
+        )
+
+    return archive
+
+
+def _missing_value(field, row, connection):
+    # fields added since the archive was written take their default, the
+    # attributes of older image rows are parsed from their metadata
+    if field.column == "attributes" and row.get("metadata"):
+        value = parse_legacy_metadata(row["metadata"])
+    else:
+        value = field.get_default()
+    return field.get_db_prep_save(value, connection)
+
+
+def rehydrate_conversation(conversation_id, using=None):
+    """
+    Moves the archived messages of a conversation back into the hot tables,
+    with their original IDs and timestamps.
+
+    Args:
+    conversation_id (uuid): The ID of the conversation.
+    using (str): The database (shard) of the conversation.
+
+    Returns:
+    bool: Whether the conversation was archived.
+    """
+    using = using or write_alias()
+    archives = ConversationArchive.objects.using(using)
+    if not archives.filter(conversation_id=conversation_id).exists():
+        return False
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        archive = (
+            archives.select_for_update()
+            .filter(conversation_id=conversation_id)
+            .first()
+        )
+        if archive is None:
+            # rehydrated by a concurrent request
+            return False
+
+        timeline = json.loads(zlib.decompress(bytes(archive.payload)))
+        for kind, model in ARCHIVED_MODELS.items():
+            columns = list(timeline["columns"][kind])
+            rows = timeline["rows"][kind]
+            if not rows:
+                continue
+            missing = [
+                field for field in model._meta.concrete_fields if field.column not in columns
+            ]
+            # JSON columns come back decoded, adapt them again
+            json_fields = {
+                field.column: field
+                for field in model._meta.concrete_fields
+                if field.get_internal_type() == "JSONField"
+            }
+            rows = [
+                [
+                    json_fields[column].get_db_prep_save(value, connections[using])
+                    if column in json_fields
+                    else value
+                    for column, value in zip(columns, row)
+                ]
+                + [
+                    _missing_value(field, dict(zip(columns, row)), connections[using])
+                    for field in missing
+                ]
+                for row in rows
+            ]
+            columns += [field.column for field in missing]
+            execute_values(
+                cursor.cursor,
+                f"INSERT INTO {model._meta.db_table} ({', '.join(columns)}) VALUES %s",
+                rows,
+                page_size=500,
+            )
+        archive.delete()
+        transaction.on_commit(
+            lambda: history_cache.invalidate(conversation_id), using=using
+        )
+
+    logger.info(
+        f"Rehydrated conversation {conversation_id}: {archive.text_count} text "
+        f"and {archive.image_count} image messages"
+    )
+    return True
+
+
+def rehydrate_for_read(conversation_id, using=None):
+    """
+    Rehydrates a conversation about to be read, if it is archived. The
+    archive is looked up on the database reads go to, so reads routed to a
+    replica do not query the primary for every conversation.
+
+    Args:
+    conversation_id (uuid): The ID of the conversation.
+    using (str): The database (shard) of the conversation.
+
+    Returns:
+    str: The database to read the conversation from, replicas may not have
+        the rehydrated rows yet; None if it was not archived.
+    """
+    archives = ConversationArchive.objects.using(read_alias())
+    if not archives.filter(conversation_id=conversation_id).exists():
+        return None
+    rehydrate_conversation(conversation_id, using)
+    return using or write_alias()
@@ -0,0 +1,55 @@
+import json
+import zlib
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.url_signer import sign_fields
+
+
+# flush the output once this many bytes are buffered
+EXPORT_CHUNK_SIZE = 64 * 1024
+# entries whose image URLs are signed together
+EXPORT_SIGN_BATCH = 500
+
+
+def ndjson_chunks(entries, chunk_size=EXPORT_CHUNK_SIZE, sign_batch=EXPORT_SIGN_BATCH):
+    """
+    Serialize entries as newline-delimited JSON, yielding bytes chunks.
+    The image URLs of image entries are signed, `sign_batch` entries at a
+    time, so exported links work on private buckets.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    entries = iter(entries)
+    buffer = []
+    buffered = 0
+    while True:
+        batch = list(islice(entries, sign_batch))
+        if not batch:
+            break
+        sign_fields([entry for entry in batch if entry.get("type") == "image"], ["data"])
+        for entry in batch:
+            line = (encoder.encode(entry) + "\n").encode("utf-8")
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= chunk_size:
+                yield b"".join(buffer)
+                buffer = []
+                buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of bytes chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def accepts_gzip(request):
+    accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    return "gzip" in [part.split(";")[0].strip() for part in accept_encoding.split(",")]
@@ -0,0 +1,277 @@
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+# rough per-turn bookkeeping overhead (dicts, ids, datetimes) used for the
+# memory estimate reported by stats()
+TURN_OVERHEAD_BYTES = 400
+# average number of characters per token of the agent's model
+CHARS_PER_TOKEN = 4
+
+
+def _version_key(conversation_id):
+    return f"zbot:history-version:{conversation_id}"
+
+
+def shared_version(conversation_id):
+    """
+    Returns the version of a conversation's history in the shared cache,
+    bumped by every process writing to the conversation.
+    """
+    key = _version_key(conversation_id)
+    version = cache.get(key)
+    if version is None:
+        # never restart from a fixed value, an evicted version must not
+        # match entries cached before it
+        version = time.time_ns()
+        cache.add(key, version, timeout=None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_shared_version(conversation_id):
+    """Returns the shared version before and after a write."""
+    key = _version_key(conversation_id)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        # evicted, no entry can be brought up to date in place
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return None, version
+    return version - 1, version
+
+
+class HistoryCache:
+    """
+    Bounded, thread-safe LRU cache of the chat history sent to the AI agent.
+
+    Entries are keyed by (conversation_id, mode) and hold the latest turns of
+    the conversation, oldest first. Each turn is a dict with the text message
+    id, sender, creation window and the image descriptions attached to it.
+    Writes to messages update the cached turns in place (see zbot/signals.py),
+    so a warm conversation never goes back to the database.
+
+    Every conversation has a generation counter that is bumped on each write.
+    A cold build only gets stored when the generation did not move while the
+    build was running, so a concurrent write can never be lost.
+
+    Other processes write too: entries remember the shared version of their
+    conversation (see shared_version) and are dropped once it moved on
+    without them, so the cache is only right across processes when the
+    Django cache is shared (SHARED_CACHE).
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, max_turns=13, stats_every=100):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.stats_every = stats_every
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._modes = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+
+    # lookups
+    def get(self, conversation_id, mode):
+        key = (str(conversation_id), mode)
+        version = shared_version(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry["expires_at"] < time.monotonic() or entry["version"] != version
+            ):
+                self._drop(key)
+                entry = None
+            turns = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # writes update the cached turns in place, under the lock
+                turns = [
+                    dict(turn, images=dict(turn["images"])) for turn in entry["turns"]
+                ]
+            lookups = self.hits + self.misses
+        if self.stats_every and lookups % self.stats_every == 0:
+            logger.info(f"history cache stats: {self.stats()}")
+        return turns
+
+    def generation(self, conversation_id):
+        version = shared_version(str(conversation_id))
+        with self._lock:
+            return (self._epoch, self._generations.get(str(conversation_id), 0), version)
+
+    def put(self, conversation_id, mode, turns, generation):
+        """Store a cold build unless the conversation was written meanwhile."""
+        conversation_id = str(conversation_id)
+        key = (conversation_id, mode)
+        with self._lock:
+            current = (self._epoch, self._generations.get(conversation_id, 0))
+            if current != generation[:2]:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            turns = turns[-self.max_turns :]
+            size = sum(turn_size(turn) for turn in turns)
+            self._modes.add(mode)
+            self._entries[key] = {
+                "turns": turns,
+                "size": size,
+                "expires_at": time.monotonic() + self.ttl,
+                # a build racing writes of other processes is dropped on get
+                "version": generation[2],
+            }
+            self.bytes += size
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return True
+
+    # write-driven updates
+    def append_turn(self, conversation_id, turn):
+        """Append a new turn to every cached mode of the conversation."""
+        def apply(turns):
+            turns.append(dict(turn, images=dict(turn["images"])))
+            del turns[: -self.max_turns]
+
+        self._update(conversation_id, apply)
+
+    def update_text(self, conversation_id, text_id, message):
+        def apply(turns):
+            for turn in turns:
+                if turn["id"] == text_id:
+                    turn["message"] = message
+
+        self._update(conversation_id, apply)
+
+    def set_image(self, conversation_id, image_id, sender, created_at, description):
+        """Attach (or refresh) an image description on the matching turns."""
+        def apply(turns):
+            for turn in turns:
+                if turn_matches_image(turn, sender, created_at):
+                    turn["images"][image_id] = description
+                else:
+                    turn["images"].pop(image_id, None)
+
+        self._update(conversation_id, apply)
+
+    def remove_image(self, conversation_id, image_id):
+        def apply(turns):
+            for turn in turns:
+                turn["images"].pop(image_id, None)
+
+        self._update(conversation_id, apply)
+
+    def invalidate(self, conversation_id):
+        conversation_id = str(conversation_id)
+        bump_shared_version(conversation_id)
+        with self._lock:
+            self._bump(conversation_id)
+            for key in self._keys(conversation_id):
+                self._drop(key)
+
+    def is_cached(self, conversation_id):
+        with self._lock:
+            return bool(self._keys(str(conversation_id)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+            self.hits = self.misses = self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+            }
+
+    # internals
+    def _update(self, conversation_id, apply):
+        conversation_id = str(conversation_id)
+        previous, version = bump_shared_version(conversation_id)
+        with self._lock:
+            self._bump(conversation_id)
+            for key in self._keys(conversation_id):
+                entry = self._entries[key]
+                if entry["version"] != previous:
+                    # another process wrote since, rebuild on next use
+                    self._drop(key)
+                    continue
+                entry["version"] = version
+                apply(entry["turns"])
+                for turn in entry["turns"]:
+                    measure_turn(turn)
+                size = sum(turn_size(turn) for turn in entry["turns"])
+                self.bytes += size - entry["size"]
+                entry["size"] = size
+
+    def _keys(self, conversation_id):
+        keys = ((conversation_id, mode) for mode in self._modes)
+        return [key for key in keys if key in self._entries]
+
+    def _bump(self, conversation_id):
+        # called with the lock held; the counters are forgotten in bulk once
+        # they outgrow the cache, and the epoch keeps in-flight builds honest
+        if len(self._generations) > 10 * self.max_entries:
+            self._generations.clear()
+            self._epoch += 1
+        self._generations[conversation_id] = (
+            self._generations.get(conversation_id, 0) + 1
+        )
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry["size"]
+
+
+def turn_matches_image(turn, sender, created_at):
+    window_start, window_end = turn["window"]
+    return turn["sender"] == sender and window_start <= created_at < window_end
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def measure_turn(turn):
+    """Cache the estimated token cost of a turn's message and images."""
+    turn["message_tokens"] = estimate_tokens(turn["message"])
+    turn["image_tokens"] = sum(
+        estimate_tokens(description) for description in turn["images"].values()
+    )
+    return turn
+
+
+def turn_size(turn):
+    return (
+        TURN_OVERHEAD_BYTES
+        + len(turn["message"] or "")
+        + sum(len(description or "") for description in turn["images"].values())
+    )
+
+
+history_cache = HistoryCache(
+    max_entries=getattr(settings, "AI_HISTORY_CACHE_MAX_ENTRIES", 1024),
+    ttl=getattr(settings, "AI_HISTORY_CACHE_TTL", 300),
+    max_turns=getattr(settings, "AI_HISTORY_LIMIT", 12) + 1,
+)
@@ -0,0 +1,120 @@
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .archive import rehydrate_for_read
+from .utils import get_timeline_range, get_latest_timeline_entry
+
+
+# width of the chronological buckets the history is paged by
+HISTORY_BUCKET_SECONDS = getattr(settings, "HISTORY_BUCKET_SECONDS", 3600)
+# a historical bucket only changes when one of its messages is edited or
+# soft-deleted, the current one changes with every new message
+HISTORICAL_PAGE_TTL = 24 * 3600
+CURRENT_PAGE_TTL = 60
+# versions outlive the pages keyed by them, an expired one only costs a rebuild
+PAGE_VERSION_TTL = 2 * HISTORICAL_PAGE_TTL
+
+
+def bucket_of(created_at):
+    return int(created_at.timestamp()) // HISTORY_BUCKET_SECONDS
+
+
+def bucket_bounds(bucket):
+    start = datetime.fromtimestamp(bucket * HISTORY_BUCKET_SECONDS, tz=dt_timezone.utc)
+    return start, start + timedelta(seconds=HISTORY_BUCKET_SECONDS)
+
+
+def _version_key(conversation_id, bucket):
+    return f"zbot:history-page-version:{conversation_id}:{bucket}"
+
+
+def _page_version(conversation_id, bucket):
+    key = _version_key(conversation_id, bucket)
+    version = cache.get(key)
+    if version is None:
+        # never restart from a fixed value, an evicted version must not
+        # resurrect pages cached before it
+        version = time.time_ns()
+        cache.add(key, version, timeout=PAGE_VERSION_TTL)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_history_page(conversation_id, created_at):
+    """Invalidate the cached page of the bucket an entry was created in."""
+    key = _version_key(conversation_id, bucket_of(created_at))
+    cache.set(key, time.time_ns(), timeout=PAGE_VERSION_TTL)
+
+
+def invalidate_history_pages(conversation_id):
+    """Invalidate every cached page of a conversation, e.g. after bulk updates."""
+    key = _version_key(conversation_id, "all")
+    cache.set(key, time.time_ns(), timeout=PAGE_VERSION_TTL)
+
+
+def get_history_page(conversation_id, bucket=None):
+    """
+    Retrieves the history entries of one chronological bucket, newest first.
+
+    Buckets are fixed time ranges, so new messages only ever land in the
+    current one and older pages stay byte-identical. Pages are cached as
+    serialized JSON with a strong ETag, in the shared cache only (see
+    SHARED_CACHE); writes bump the version of the bucket they fall in (see
+    zbot/signals.py).
+
+    Args:
+    conversation_id (uuid): The ID of the conversation.
+    bucket (int): The bucket number, the latest non-empty bucket if None.
+
+    Returns:
+    tuple: (JSON body, ETag, whether the bucket is fully historical).
+    """
+    # the shard once archived messages were moved back, the replica may lag
+    using = None
+    if bucket is None:
+        using = rehydrate_for_read(conversation_id)
+        latest = get_latest_timeline_entry(conversation_id, using=using)
+        bucket = bucket_of(latest or timezone.now())
+
+    start, end = bucket_bounds(bucket)
+    immutable = end <= timezone.now()
+    key = page = None
+    # versions bumped in one process are not seen by the others unless the
+    # cache is shared, pages are built every time rather than served stale
+    if settings.SHARED_CACHE:
+        version = _page_version(conversation_id, bucket)
+        conversation_version = _page_version(conversation_id, "all")
+        key = (
+            f"zbot:history-page:{conversation_id}:{bucket}:"
+            f"{conversation_version}:{version}"
+        )
+        page = cache.get(key)
+
+    if page is None:
+        using = rehydrate_for_read(conversation_id) or using
+        results = get_timeline_range(conversation_id, start, end, using=using)
+        older = get_latest_timeline_entry(conversation_id, until=start, using=using)
+        body = json.dumps(
+            {
+                "bucket": bucket,
+                "start": start,
+                "end": end,
+                # the older bucket to fetch next, if any
+                "next_bucket": bucket_of(older) if older else None,
+                "count": len(results),
+                "results": results,
+            },
+            cls=DjangoJSONEncoder,
+        ).encode("utf-8")
+        page = (body, f'"{hashlib.sha256(body).hexdigest()}"')
+        if key is not None:
+            cache.set(key, page, HISTORICAL_PAGE_TTL if immutable else CURRENT_PAGE_TTL)
+
+    return page[0], page[1], immutable
@@ -0,0 +1,110 @@
+import os
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .image_variants import analysis_image_location
+
+
+# uploaded images are stored under the hash of their content, so the same
+# photo uploaded again reuses its object
+HASHED_IMAGES_PREFIX = "v1/static/media/sha256"
+
+
+def _description_key(content_hash, user_id):
+    return f"zbot:image-description:{user_id}:{content_hash}"
+
+
+def hash_file(file):
+    """Returns the SHA-256 hex digest of an uploaded file, left rewound."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hashed_image_key(content_hash, filename):
+    """Returns the object key of an image, from its content hash."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return f"{HASHED_IMAGES_PREFIX}/{content_hash}{extension}"
+
+
+def reusable_image(content_hash, user_id, using=None):
+    """
+    Returns an earlier image message of the same content in a conversation
+    of the user, if any. `content_hash` must be a hash of bytes the server
+    received, never one claimed by a client: images are only shared within
+    the conversations of one user. Outside of requests, pass the database
+    (shard) of the user as `using`.
+    """
+    from zbot.models import ImageMessage
+
+    if not content_hash:
+        return None
+    return (
+        ImageMessage.objects.using(using).filter(
+            content_hash=content_hash, conversation__user_id=user_id
+        )
+        .exclude(variants={})
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def remember_description(content_hash, description, user_id):
+    """Caches the description the agent gave of an image content of a user."""
+    if content_hash and description:
+        cache.set(
+            _description_key(content_hash, user_id),
+            description,
+            settings.IMAGE_DESCRIPTION_CACHE_SECONDS,
+        )
+
+
+def cached_description(content_hash, user_id, using=None):
+    """
+    Returns the description the agent gave of an image of the same content
+    sent by the user, from the cache or from an earlier image message (read
+    from `using`, see reusable_image).
+    """
+    from zbot.models import ImageMessage
+
+    if not content_hash:
+        return None
+    description = cache.get(_description_key(content_hash, user_id))
+    if description is None:
+        description = (
+            ImageMessage.objects.using(using).filter(
+                content_hash=content_hash,
+                conversation__user_id=user_id,
+                sender="user",
+                attributes__has_key="description",
+            )
+            .exclude(attributes__description="")
+            .order_by("-created_at")
+            .values_list("attributes__description", flat=True)
+            .first()
+        )
+        remember_description(content_hash, description, user_id)
+    return description
+
+
+def agent_image_query(image_message, image_url, user_id):
+    """
+    Returns the imageQuery sent to the agent: where to read the image from,
+    and its description when the user sent an image of the same content
+    before, so the agent can skip analyzing it again.
+    """
+    image_query = analysis_image_location(image_message, image_url)
+    if image_query is not None and image_message is not None:
+        description = cached_description(image_message.content_hash, user_id)
+        if description:
+            image_query["imageDescription"] = description
+    return image_query
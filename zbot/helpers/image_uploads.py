@@ -0,0 +1,270 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from core.db_router import write_alias
+
+from .history_pages import invalidate_history_page
+from .image_variants import create_variants, variant_storage
+from .utils import split_s3_url
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between two reads of the status of a pending image
+READY_POLL_INTERVAL = 0.2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """Returns the process wide pool writing asynchronous uploads."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_UPLOAD_WORKERS,
+                    thread_name_prefix="image-upload",
+                )
+    return _executor
+
+
+def _update(messages, **fields):
+    messages.update(**fields)
+    # update() sends no post_save, pages cached while the image was pending
+    # would keep its old status and variants
+    rows = messages.values_list("conversation_id", "created_at")
+    for conversation_id, created_at in rows:
+        invalidate_history_page(conversation_id, created_at)
+
+
+def store_image(image_id, using, storage, key, data, variants=None):
+    """
+    Writes the file of a pending image message to storage, renders its
+    variants (unless reused from an earlier upload) and marks it ready, or
+    failed.
+
+    Args:
+    image_id (int): The ID of the ImageMessage.
+    using (str): The database alias holding the message.
+    storage: The storage to write the file to.
+    key (str): The name of the file in the storage.
+    data (bytes): The file.
+    variants (dict): Variants of the same content, rendered before.
+    """
+    from zbot.models import ImageMessage
+
+    messages = ImageMessage.objects.using(using).filter(pk=image_id)
+    started = time.monotonic()
+    try:
+        if not storage.exists(key):
+            storage.save(key, ContentFile(data))
+        if variants is None:
+            variants = create_variants(storage, key, data)
+        _update(
+            messages,
+            upload_status=ImageMessage.READY,
+            variants=variants,
+            updated_at=timezone.now(),
+        )
+        logger.info(
+            f"Stored image {image_id} in {time.monotonic() - started:.2f} seconds"
+        )
+    except Exception as e:
+        logger.error(f"Failed to store image {image_id}: {e}")
+        _update(messages, upload_status=ImageMessage.FAILED, updated_at=timezone.now())
+    finally:
+        # connections are per thread, do not leak this one
+        connections[using].close()
+
+
+def process_upload(image_id, using, storage, key, user_id, describe=False):
+    """
+    Hashes the file of a pending image message uploaded straight to storage,
+    renders its variants (unless an earlier upload of the user with the same
+    content has them) and marks it ready, or failed.
+
+    Args:
+    image_id (int): The ID of the ImageMessage.
+    using (str): The database alias holding the message.
+    storage: The storage holding the file.
+    key (str): The name of the file in the storage.
+    user_id (int): The ID of the user who uploaded the file.
+    describe (bool): Whether to fill in the metadata of the message, and
+        its attributes if empty, from an earlier description of the content.
+    """
+    from zbot.models import ImageMessage
+    from .image_hashes import cached_description, hash_bytes, reusable_image
+    from .utils import parse_legacy_metadata
+
+    messages = ImageMessage.objects.using(using).filter(pk=image_id)
+    started = time.monotonic()
+    try:
+        with storage.open(key, "rb") as uploaded:
+            data = uploaded.read()
+        # hashed from the bytes received, an earlier upload of the user with
+        # the same content lends its variants
+        content_hash = hash_bytes(data)
+        source = reusable_image(content_hash, user_id, using)
+        if source is not None:
+            variants = source.variants
+        else:
+            variants = create_variants(storage, key, data)
+
+        fields = {}
+        description = describe and cached_description(content_hash, user_id, using)
+        if description:
+            fields["metadata"] = description
+            # attributes sent with the message are kept
+            messages.filter(attributes={}).update(
+                attributes=parse_legacy_metadata(description)
+            )
+        _update(
+            messages,
+            upload_status=ImageMessage.READY,
+            variants=variants,
+            content_hash=content_hash,
+            updated_at=timezone.now(),
+            **fields,
+        )
+        logger.info(
+            f"Processed upload {image_id} in {time.monotonic() - started:.2f} seconds"
+        )
+    except Exception as e:
+        logger.error(f"Failed to process upload {image_id}: {e}")
+        _update(messages, upload_status=ImageMessage.FAILED, updated_at=timezone.now())
+    finally:
+        connections[using].close()
+
+
+def start_upload_processing(image_message, storage, key, describe=False):
+    """
+    Hands a pending image message uploaded straight to storage over to the
+    upload pool (see process_upload), once the message is committed.
+    """
+    using = image_message._state.db
+    user_id = image_message.conversation.user_id
+    transaction.on_commit(
+        lambda: executor().submit(
+            process_upload, image_message.pk, using, storage, key, user_id, describe
+        ),
+        using=using,
+    )
+
+
+def start_image_upload(image_message, storage, key, data, variants=None):
+    """
+    Hands the file of a pending image message over to the upload pool, once
+    the message is committed.
+    """
+    using = image_message._state.db
+    transaction.on_commit(
+        lambda: executor().submit(
+            store_image, image_message.pk, using, storage, key, data, variants
+        ),
+        using=using,
+    )
+
+
+def _stored(image_message):
+    """Whether the original file of an image message is in storage."""
+    location = split_s3_url((image_message.image_url or "").split("?")[0])
+    if location is None:
+        return False
+    try:
+        return variant_storage(location["bucket"]).exists(location["key"])
+    except Exception as e:
+        logger.warning(f"Could not check the file of image {image_message.pk}: {e}")
+        return False
+
+
+def ready_image(image_message, timeout=None):
+    """
+    Waits for a pending image message to be stored, for the agent to read it.
+
+    Args:
+    image_message (ImageMessage): The message, None is passed through.
+    timeout (float): Seconds to wait, settings.IMAGE_UPLOAD_READY_TIMEOUT
+        if None.
+
+    Returns:
+    ImageMessage: The message, with its status and variants refreshed.
+    """
+    if image_message is None or image_message.upload_status != image_message.PENDING:
+        return image_message
+    timeout = settings.IMAGE_UPLOAD_READY_TIMEOUT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        # from the primary, a replica may lag behind the upload pool
+        image_message.refresh_from_db(
+            using=write_alias(), fields=["upload_status", "variants"]
+        )
+        if image_message.upload_status != image_message.PENDING:
+            break
+        if time.monotonic() >= deadline:
+            logger.warning(
+                f"Image {image_message.pk} still pending after {timeout} seconds"
+            )
+            # the pool may be rendering the variants of a file written already
+            if _stored(image_message):
+                image_message.upload_status = image_message.READY
+            break
+        time.sleep(READY_POLL_INTERVAL)
+    if image_message.upload_status == image_message.FAILED:
+        logger.warning(f"Image {image_message.pk} failed to upload")
+    return image_message
+
+
+def settle_stale_uploads(cutoff, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Settles the image messages left pending since before `cutoff`, by a
+    process that stopped before its upload pool got to them: ready if their
+    file is in storage (variants are rendered on display, see
+    ensure_variants), failed otherwise.
+
+    Args:
+    cutoff (datetime): Messages not updated since are stale.
+    batch_size (int): Messages read per query.
+    using (str): The database (shard) holding the messages.
+
+    Returns:
+    tuple: (messages marked ready, messages marked failed).
+    """
+    from zbot.models import ImageMessage
+
+    stale = ImageMessage.objects.using(using).filter(
+        upload_status=ImageMessage.PENDING, updated_at__lt=cutoff
+    )
+    ready = failed = 0
+    after = 0
+    while True:
+        batch = list(stale.filter(pk__gt=after).order_by("pk")[:batch_size])
+        if not batch:
+            return ready, failed
+        after = batch[-1].pk
+
+        stored = [message.pk for message in batch if _stored(message)]
+        lost = [message.pk for message in batch if message.pk not in stored]
+        now = timezone.now()
+        if stored:
+            _update(
+                stale.filter(pk__in=stored),
+                upload_status=ImageMessage.READY,
+                updated_at=now,
+            )
+        if lost:
+            _update(
+                stale.filter(pk__in=lost),
+                upload_status=ImageMessage.FAILED,
+                updated_at=now,
+            )
+        ready += len(stored)
+        failed += len(lost)
@@ -0,0 +1,198 @@
+import io
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from core.storage_cache import DiskCachedStorage
+
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:
+    # HEIC originals then get no variants, the agent uses the original
+    register_heif_opener = None
+else:
+    register_heif_opener()
+
+from .storage import bucket_storage
+from .utils import split_s3_url
+
+
+logger = logging.getLogger(__name__)
+
+# variant name: (setting holding its longest side, JPEG quality)
+VARIANTS = {
+    "analysis": ("IMAGE_ANALYSIS_MAX_SIDE", 85),
+    "medium": ("IMAGE_MEDIUM_MAX_SIDE", 80),
+    "thumbnail": ("IMAGE_THUMBNAIL_MAX_SIDE", 75),
+}
+# variants clients display, the analysis one is for the agent
+DISPLAY_VARIANTS = ("thumbnail", "medium")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_key(key, name):
+    """Returns the key of a variant, stored next to the original."""
+    return f"{os.path.splitext(key)[0]}.{name}.jpg"
+
+
+def render_variants(data, sizes):
+    """
+    Renders the variants of an image: orientation normalized from its EXIF
+    tag, converted to RGB and shrunk to fit the longest side of the
+    variant, as JPEG. Runs in the worker processes, keep it free of Django.
+
+    Args:
+    data (bytes): The original image file.
+    sizes (dict): Variant name: (longest side, JPEG quality).
+
+    Returns:
+    dict: Variant name: JPEG bytes.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+    variants = {}
+    for name, (max_side, quality) in sizes.items():
+        variant = image.copy()
+        variant.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, "JPEG", quality=quality, optimize=True)
+        variants[name] = buffer.getvalue()
+    return variants
+
+
+def executor():
+    """Returns the process wide pool rendering the variants."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, forking a threaded server process is not safe
+                _executor = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_PIPELINE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def create_variants(storage, key, data=None, names=None):
+    """
+    Renders the variants of an uploaded image and stores them next to it.
+
+    Args:
+    storage: The storage holding the original.
+    key (str): The name of the original in the storage.
+    data (bytes): The original, read from the storage if None.
+    names (list): The variants to render, all of VARIANTS if None.
+
+    Returns:
+    dict: The bucket of the storage (None if not an S3 storage) and the
+    keys of the variants, empty if the image could not be decoded.
+    """
+    if data is None:
+        with storage.open(key, "rb") as original:
+            data = original.read()
+    sizes = {
+        name: (getattr(settings, setting), quality)
+        for name, (setting, quality) in VARIANTS.items()
+        if names is None or name in names
+    }
+    try:
+        if settings.IMAGE_PIPELINE_WORKERS:
+            rendered = executor().submit(render_variants, data, sizes).result(
+                timeout=settings.IMAGE_PIPELINE_TIMEOUT
+            )
+        else:
+            rendered = render_variants(data, sizes)
+    except Exception as e:
+        logger.error(f"Failed to render the variants of {key}: {e}")
+        return {}
+
+    variants = {"bucket": getattr(storage, "bucket_name", None)}
+    for name, content in rendered.items():
+        variants[name] = storage.save(variant_key(key, name), ContentFile(content))
+    return variants
+
+
+def analysis_image_location(image_message, image_url):
+    """
+    Returns the bucket and key the agent reads an image from: its analysis
+    variant when it has one, the original otherwise.
+    """
+    variants = image_message.variants if image_message is not None else {}
+    if variants.get("analysis") and variants.get("bucket"):
+        return {"bucket": variants["bucket"], "key": variants["analysis"]}
+    return split_s3_url(image_url)
+
+
+def variant_storage(bucket):
+    """Returns a storage of the bucket holding the variants of an image."""
+    if bucket is None or bucket == getattr(default_storage, "bucket_name", None):
+        return default_storage
+    return bucket_storage(bucket)
+
+
+def variant_source(image_message):
+    """
+    Returns the bucket and key missing variants are rendered from: the
+    analysis variant, smaller than the original and normalized already,
+    or the original when it is an S3 object.
+    """
+    variants = image_message.variants or {}
+    if variants.get("analysis"):
+        return variants.get("bucket"), variants["analysis"]
+    # presigned URLs carry their signature in the query string
+    location = split_s3_url((image_message.image_url or "").split("?")[0])
+    if location is None:
+        return None
+    return location["bucket"], location["key"]
+
+
+def ensure_variants(image_message, names=DISPLAY_VARIANTS, using=None):
+    """
+    Renders the variants an image message is missing, for images uploaded
+    before they existed, and stores their keys on the message so they are
+    rendered once.
+
+    Args:
+    image_message (ImageMessage): The message.
+    names (list): The variants it should have.
+    using (str): The database alias to save the message to, the shard of
+        the request if None.
+
+    Returns:
+    dict: The variants of the message, without the ones that could not be
+    rendered.
+    """
+    from core.db_router import write_alias
+    from zbot.models import ImageMessage
+
+    variants = dict(image_message.variants or {})
+    missing = [name for name in names if not variants.get(name)]
+    source = variant_source(image_message)
+    if not missing or source is None:
+        return variants
+
+    bucket, key = source
+    # sources like machine reference images are shared by many messages
+    storage = DiskCachedStorage(variant_storage(bucket))
+    rendered = create_variants(storage, key, names=missing)
+    if not rendered:
+        return variants
+    variants.update(rendered)
+    ImageMessage.objects.using(using or write_alias()).filter(
+        pk=image_message.pk
+    ).update(variants=variants)
+    image_message.variants = variants
+    return variants
@@ -0,0 +1,227 @@
+import re
+import logging
+from datetime import datetime, timezone
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from zbot.models import TextMessage, ImageMessage, MachineParameter
+
+
+logger = logging.getLogger(__name__)
+
+# message tables that can be range partitioned by created_at
+PARTITIONED_MODELS = [TextMessage, ImageMessage, MachineParameter]
+
+PARTITIONS_QUERY = """
+    SELECT
+        c.relname,
+        pg_get_expr(c.relpartbound, c.oid),
+        c.reltuples::BIGINT
+    FROM
+        pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE
+        i.inhparent = %s::REGCLASS
+    ORDER BY c.relname;
+"""
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(value):
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def partition_name(table, start):
+    return f"{table}_y{start.year}m{start.month:02d}"
+
+
+def legacy_name(table):
+    return f"{table}_legacy"
+
+
+def is_partitioned(table, using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::REGCLASS;", [table]
+        )
+        return cursor.fetchone()[0]
+
+
+def list_partitions(table, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the partitions of a table.
+
+    Returns:
+    list: (name, bound expression, upper bound or None, estimated rows) tuples.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(PARTITIONS_QUERY, [table])
+        partitions = []
+        for name, bound, rows in cursor.fetchall():
+            match = UPPER_BOUND.search(bound)
+            until = datetime.fromisoformat(match.group(1)) if match else None
+            partitions.append((name, bound, until, rows))
+    return partitions
+
+
+def convert_table(model, using=DEFAULT_DB_ALIAS, months_ahead=3):
+    """
+    Turns the table of a model into a table range partitioned by created_at.
+
+    The existing table is attached as is, as the partition of every row
+    created before the month after its latest row, so no rows are
+    rewritten. The monthly partitions following it are created in the same
+    transaction as the default partition, so no row lands in the default
+    partition in between. The primary key of the partitioned table becomes
+    (id, created_at), as Postgres requires the partition key in unique
+    constraints.
+
+    Args:
+    model: One of PARTITIONED_MODELS.
+    using (str): The database (shard) holding the table.
+    months_ahead (int): Monthly partitions created after the legacy one.
+
+    Returns:
+    datetime: The upper bound of the legacy partition, a month start.
+    """
+    table = model._meta.db_table
+    legacy = legacy_name(table)
+    pk = model._meta.pk
+    auto_id = pk.get_internal_type() in ("AutoField", "BigAutoField")
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;")
+        cursor.execute(
+            "SELECT attidentity <> '' FROM pg_attribute "
+            "WHERE attrelid = %s::REGCLASS AND attname = %s;",
+            [table, pk.column],
+        )
+        identity = cursor.fetchone()[0]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s);", [table, pk.column])
+        sequence = cursor.fetchone()[0]
+
+        # the table is locked, no row can be written past its latest one
+        cursor.execute(f"SELECT MAX(created_at) FROM {table};")
+        latest = cursor.fetchone()[0] or datetime.now(timezone.utc)
+        until = next_month(month_start(latest))
+
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy};")
+        cursor.execute(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING STORAGE) "
+            "PARTITION BY RANGE (created_at);"
+        )
+
+        if auto_id and identity:
+            # partitioned tables cannot have identity columns before Postgres
+            # 17, move the id sequence to a plain one owned by the new table
+            cursor.execute(f"SELECT COALESCE(MAX({pk.column}), 0) + 1 FROM {legacy};")
+            next_id = cursor.fetchone()[0]
+            cursor.execute(f"ALTER TABLE {legacy} ALTER COLUMN {pk.column} DROP IDENTITY;")
+            sequence = f"{table}_{pk.column}_seq"
+            cursor.execute(f"CREATE SEQUENCE {sequence} START WITH {next_id};")
+            cursor.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {pk.column} "
+                f"SET DEFAULT nextval('{sequence}');"
+            )
+        if auto_id and sequence:
+            # dropping an old partition must not drop the sequence with it
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{pk.column};")
+
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_part_pkey "
+            f"PRIMARY KEY ({pk.column}, created_at);"
+        )
+        for field in model._meta.concrete_fields:
+            # users, machines and materials are referenced without a
+            # constraint, shards do not hold them
+            if not field.is_relation or not field.db_constraint:
+                continue
+            target = field.target_field
+            cursor.execute(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_{field.column}_part_fk "
+                f"FOREIGN KEY ({field.column}) "
+                f"REFERENCES {target.model._meta.db_table} ({target.column}) "
+                "DEFERRABLE INITIALLY DEFERRED;"
+            )
+        cursor.execute(
+            f"CREATE INDEX {table}_conversation_created_part_idx "
+            f"ON {table} (conversation_id, created_at);"
+        )
+        # the model indexes of the legacy table are attached to these
+        with connections[using].schema_editor(atomic=False) as schema_editor:
+            for index in model._meta.indexes:
+                part_index = index.clone()
+                part_index.name = f"{index.name}_part"
+                cursor.execute(str(part_index.create_sql(model, schema_editor)))
+
+        # validated once here so that attaching does not scan the table again
+        cursor.execute(
+            f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_bounds "
+            "CHECK (created_at IS NOT NULL AND created_at < %s);",
+            [until],
+        )
+        cursor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+            "FOR VALUES FROM (MINVALUE) TO (%s);",
+            [until],
+        )
+        start = until
+        for _ in range(months_ahead):
+            _create_partition(cursor, table, start)
+            start = next_month(start)
+        cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;")
+
+    logger.info(f"Partitioned {table} on {using}, rows before {until} kept in {legacy}")
+    return until
+
+
+def _create_partition(cursor, table, start):
+    cursor.execute(
+        f"CREATE TABLE {partition_name(table, start)} PARTITION OF {table} "
+        "FOR VALUES FROM (%s) TO (%s);",
+        [start, next_month(start)],
+    )
+
+
+def create_partition(model, start, using=DEFAULT_DB_ALIAS):
+    """
+    Creates the monthly partition of a model table starting at `start`,
+    unless the month is already covered by it or by the legacy partition.
+
+    Returns:
+    bool: Whether the partition was created.
+    """
+    table = model._meta.db_table
+    partitions = {name: until for name, _, until, _ in list_partitions(table, using)}
+    if partition_name(table, start) in partitions:
+        return False
+    legacy_until = partitions.get(legacy_name(table))
+    if legacy_until is not None and start < legacy_until:
+        return False
+
+    with connections[using].cursor() as cursor:
+        # fails if rows of that month already landed in the default partition
+        _create_partition(cursor, table, start)
+    return True
+
+
+def detach_partition(model, name, drop=False, using=DEFAULT_DB_ALIAS):
+    """
+    Detaches a partition from a model table. The detached table keeps its
+    rows until it is dropped, so it can be dumped to cold storage first.
+    """
+    table = model._meta.db_table
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name};")
+        if drop:
+            cursor.execute(f"DROP TABLE {name};")
+    logger.info(
+        f"{'Dropped' if drop else 'Detached'} partition {name} of {table} on {using}"
+    )
@@ -0,0 +1,287 @@
+import time
+import logging
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+from management.helpers.storage import document_storage
+from management.models import Document
+from zbot.models import (
+    Conversation,
+    ConversationArchive,
+    ImageMessage,
+    MachineParameter,
+    TextMessage,
+)
+from .history_pages import invalidate_history_pages
+from .storage import image_storage
+from .utils import decode_json, split_s3_url
+
+
+logger = logging.getLogger(__name__)
+
+# a batch gives up instead of queueing behind long running transactions
+PURGE_LOCK_TIMEOUT = "2s"
+PURGE_MAX_RETRIES = 5
+# S3 DeleteObjects accepts up to 1000 keys per request
+S3_DELETE_BATCH = 1000
+
+# rows depending on a purged conversation, deleted before it
+CONVERSATION_DEPENDENTS = [ImageMessage, TextMessage, MachineParameter, ConversationArchive]
+
+# image messages sharing the content, and so maybe the objects, of others
+SHARED_IMAGES_QUERY = """
+    SELECT image, image_url, variants FROM zbot_imagemessage
+    WHERE content_hash = ANY(%s) AND sender = 'user';
+"""
+
+EXPIRED_ROWS_QUERY = """
+    SELECT {pk} FROM {table}
+    WHERE is_deleted = TRUE AND updated_at < %(cutoff)s {after}
+    ORDER BY {pk}
+    LIMIT %(limit)s;
+"""
+
+
+def expired_ids(model, cutoff, limit, after=None, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the primary keys of up to `limit` rows soft-deleted before
+    `cutoff`, in key order after `after`.
+    """
+    pk = model._meta.pk.column
+    query = EXPIRED_ROWS_QUERY.format(
+        pk=pk,
+        table=model._meta.db_table,
+        after=f"AND {pk} > %(after)s" if after is not None else "",
+    )
+    with connections[using].cursor() as cursor:
+        cursor.execute(query, {"cutoff": cutoff, "limit": limit, "after": after})
+        return [row[0] for row in cursor.fetchall()]
+
+
+def message_keys(image, image_url, variants):
+    """
+    Returns the S3 keys of the original and the variants of an image
+    message. upload_image keeps only the client's file name in `image`, the
+    object key is read from `image_url`; finalized direct uploads store the
+    key in `image`.
+    """
+    keys = set()
+    # presigned URLs carry their signature in the query string
+    location = split_s3_url((image_url or "").split("?")[0])
+    if location is not None:
+        keys.add(unquote(location["key"]))
+    elif image and "/" in image:
+        keys.add(image)
+    for name, key in (decode_json(variants) or {}).items():
+        if name != "bucket" and key:
+            keys.add(key)
+    return keys
+
+
+def image_keys(cursor, column, ids):
+    """
+    Returns the S3 keys and the content hashes of image messages. Images
+    sent by the AI point at objects of the agent, not ours to delete.
+    """
+    cursor.execute(
+        "SELECT image, image_url, variants, content_hash FROM zbot_imagemessage "
+        f"WHERE {column} = ANY(%s) AND sender = 'user';",
+        [ids],
+    )
+    keys, hashes = set(), set()
+    for image, image_url, variants, content_hash in cursor.fetchall():
+        keys |= message_keys(image, image_url, variants)
+        if content_hash:
+            hashes.add(content_hash)
+    return keys, hashes
+
+
+def unshared_keys(cursor, keys, hashes, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the keys no remaining image message uses, to be called once the
+    purged rows are deleted. Messages of the same content share the object
+    stored under its hash and their variants, across users and so across
+    shards, and only they share objects.
+    """
+    in_use = set()
+    if keys and hashes:
+        for alias in dict.fromkeys([using, *settings.USER_SHARDS]):
+            if alias == using:
+                cursor.execute(SHARED_IMAGES_QUERY, [sorted(hashes)])
+                rows = cursor.fetchall()
+            else:
+                with connections[alias].cursor() as shard_cursor:
+                    shard_cursor.execute(SHARED_IMAGES_QUERY, [sorted(hashes)])
+                    rows = shard_cursor.fetchall()
+            for row in rows:
+                in_use |= message_keys(*row)
+    return sorted(keys - in_use)
+
+
+def document_keys(cursor, ids):
+    cursor.execute(
+        "SELECT document_file, document_url FROM management_document WHERE id = ANY(%s);",
+        [ids],
+    )
+    keys = []
+    for name, url in cursor.fetchall():
+        if name:
+            keys.append(name)
+        elif url:
+            # uploaded straight to the bucket, only the public URL is stored
+            keys.append(urlparse(url).path.lstrip("/"))
+    return keys
+
+
+def _delete(cursor, model, column, ids):
+    cursor.execute(
+        f"DELETE FROM {model._meta.db_table} WHERE {column} = ANY(%s);", [ids]
+    )
+    return cursor.rowcount
+
+
+def purge_rows(model, ids, using=DEFAULT_DB_ALIAS):
+    """
+    Hard deletes a batch of soft-deleted rows in one short transaction.
+
+    Returns:
+    tuple: (deleted rows, S3 keys of the files of the deleted rows no
+    remaining row uses).
+    """
+    pk = model._meta.pk.column
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"SET LOCAL lock_timeout = '{PURGE_LOCK_TIMEOUT}';")
+        if model is ImageMessage:
+            keys, hashes = image_keys(cursor, pk, ids)
+        elif model is Document:
+            keys = document_keys(cursor, ids)
+        else:
+            keys = []
+        deleted = _delete(cursor, model, pk, ids)
+        if model is ImageMessage:
+            keys = unshared_keys(cursor, keys, hashes, using)
+    return deleted, keys
+
+
+def purge_conversation_dependents(conversation_ids, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Hard deletes the messages, parameters and archives of conversations,
+    `batch_size` rows per transaction.
+
+    Returns:
+    tuple: (deleted rows, S3 keys of the deleted images no remaining
+    message uses).
+    """
+    deleted, keys, hashes = 0, set(), set()
+    for model in CONVERSATION_DEPENDENTS:
+        pk = model._meta.pk.column
+        while True:
+            with transaction.atomic(using=using), connections[using].cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{PURGE_LOCK_TIMEOUT}';")
+                cursor.execute(
+                    f"SELECT {pk} FROM {model._meta.db_table} "
+                    "WHERE conversation_id = ANY(%s) LIMIT %s;",
+                    [conversation_ids, batch_size],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                if model is ImageMessage:
+                    batch_keys, batch_hashes = image_keys(cursor, pk, ids)
+                    keys |= batch_keys
+                    hashes |= batch_hashes
+                deleted += _delete(cursor, model, pk, ids)
+    with connections[using].cursor() as cursor:
+        return deleted, unshared_keys(cursor, keys, hashes, using)
+
+
+def purge_conversations(conversation_ids, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Hard deletes soft-deleted conversations with every row depending on them.
+
+    Returns:
+    tuple: (deleted rows, S3 keys of the deleted images no remaining
+    message uses).
+    """
+    deleted, keys = purge_conversation_dependents(conversation_ids, batch_size, using)
+    conversations, _ = purge_rows(Conversation, conversation_ids, using)
+    for conversation_id in conversation_ids:
+        invalidate_history_pages(conversation_id)
+    return deleted + conversations, keys
+
+
+def delete_files(storage, keys):
+    """
+    Deletes files from an S3 storage with DeleteObjects requests.
+
+    Returns:
+    int: The number of files deleted.
+    """
+    deleted = 0
+    for start in range(0, len(keys), S3_DELETE_BATCH):
+        batch = keys[start:start + S3_DELETE_BATCH]
+        response = storage.bucket.delete_objects(
+            Delete={
+                "Objects": [{"Key": storage._normalize_name(key)} for key in batch],
+                "Quiet": True,
+            }
+        )
+        errors = response.get("Errors", [])
+        for error in errors:
+            logger.error(f"Failed to delete {error['Key']}: {error['Message']}")
+        deleted += len(batch) - len(errors)
+    return deleted
+
+
+def purge_model(
+    model, cutoff, batch_size, sleep=0.0, delete_from_s3=False, using=DEFAULT_DB_ALIAS
+):
+    """
+    Hard deletes the rows of a model soft-deleted before `cutoff`, in keyset
+    batches. Every batch commits on its own, so an interrupted purge resumes
+    where it stopped when run again.
+
+    Args:
+    model: Conversation, TextMessage, ImageMessage or Document.
+    cutoff (datetime): Rows soft-deleted before it are purged.
+    batch_size (int): Rows deleted per transaction.
+    sleep (float): Seconds to wait between batches.
+    delete_from_s3 (bool): Whether to delete the files of the purged rows.
+    using (str): The database (shard) to purge.
+
+    Yields:
+    tuple: (deleted rows, deleted files, elapsed seconds) per batch.
+    """
+    if model is Document:
+        storage = document_storage()
+    else:
+        storage = image_storage()
+
+    after, retries = None, 0
+    while True:
+        ids = expired_ids(model, cutoff, batch_size, after=after, using=using)
+        if not ids:
+            return
+
+        started = time.monotonic()
+        try:
+            if model is Conversation:
+                deleted, keys = purge_conversations(ids, batch_size, using)
+            else:
+                deleted, keys = purge_rows(model, ids, using)
+        except OperationalError as e:
+            # lock timeout, retry the same batch a bit later
+            retries += 1
+            if retries > PURGE_MAX_RETRIES:
+                raise
+            logger.warning(f"Purge batch of {model.__name__} failed, retrying: {e}")
+            time.sleep(max(sleep, 1.0) * retries)
+            continue
+        after, retries = ids[-1], 0
+        files = delete_files(storage, keys) if delete_from_s3 and keys else 0
+        yield deleted, files, time.monotonic() - started
+
+        if sleep:
+            time.sleep(sleep)
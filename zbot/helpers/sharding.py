@@ -0,0 +1,170 @@
+import time
+import logging
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from psycopg2.extras import Json, execute_values
+
+from core.db_router import forget_user_shard, shard_for_user
+from core.models import UserShard
+from zbot.models import (
+    Conversation,
+    ConversationArchive,
+    ImageMessage,
+    MachineParameter,
+    TextMessage,
+)
+from .history_cache import history_cache
+from .history_pages import invalidate_history_pages
+from .purge import purge_conversations
+
+
+logger = logging.getLogger(__name__)
+
+# rows moved with the conversations of a user, parents first
+MOVED_MODELS = [Conversation, ConversationArchive, TextMessage, ImageMessage, MachineParameter]
+
+# conversations copied or deleted together
+MOVE_CONVERSATIONS = 50
+
+
+def _copied_fields(model):
+    fields = model._meta.concrete_fields
+    if model._meta.pk.get_internal_type() in ("AutoField", "BigAutoField"):
+        # serial ids are not unique across shards, the target assigns new ones
+        fields = [field for field in fields if not field.primary_key]
+    return fields
+
+
+def copy_rows(model, conversation_ids, source, target, batch_size):
+    """
+    Copies the rows of a model belonging to conversations from one database
+    to another, in keyset batches of `batch_size` rows.
+
+    Returns:
+    int: The number of rows copied.
+    """
+    table = model._meta.db_table
+    pk = model._meta.pk.column
+    key = "id" if model is Conversation else "conversation_id"
+    fields = _copied_fields(model)
+    columns = ", ".join(field.column for field in fields)
+    json_columns = [
+        index for index, field in enumerate(fields)
+        if field.get_internal_type() == "JSONField"
+    ]
+
+    copied, after = 0, None
+    while True:
+        with connections[source].cursor() as cursor:
+            cursor.execute(
+                f"SELECT {pk}, {columns} FROM {table} "
+                f"WHERE {key} = ANY(%s) {f'AND {pk} > %s' if after is not None else ''} "
+                f"ORDER BY {pk} LIMIT %s;",
+                [conversation_ids, after, batch_size]
+                if after is not None
+                else [conversation_ids, batch_size],
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return copied
+        after = rows[-1][0]
+
+        values = []
+        for row in rows:
+            row = list(row[1:])
+            for index in json_columns:
+                if row[index] is not None:
+                    row[index] = Json(row[index])
+            values.append(row)
+        with transaction.atomic(using=target), connections[target].cursor() as cursor:
+            execute_values(
+                cursor, f"INSERT INTO {table} ({columns}) VALUES %s", values
+            )
+        copied += len(values)
+
+
+def _conversation_ids(user_id, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM zbot_conversation WHERE user_id = %s ORDER BY id;",
+            [user_id],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _batches(ids):
+    for start in range(0, len(ids), MOVE_CONVERSATIONS):
+        yield ids[start:start + MOVE_CONVERSATIONS]
+
+
+def _set_shard(user_id, shard, moving):
+    UserShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user_id=user_id, defaults={"shard": shard, "moving": moving}
+    )
+    forget_user_shard(user_id)
+
+
+def _invalidate_history(conversation_ids):
+    # the copies got new message ids, cached history must not serve the old ones
+    for conversation_id in conversation_ids:
+        invalidate_history_pages(conversation_id)
+        history_cache.invalidate(conversation_id)
+
+
+def move_user(user_id, target, batch_size=1000, wait=None):
+    """
+    Moves the conversations of a user, with their messages, parameters and
+    archives, to another shard.
+
+    Writes of the user are rejected while the rows are copied (see
+    UserShardMixin), reads keep going to the old shard until the directory
+    points to the new one. The copied messages get new IDs, so the cached
+    history of the conversations is invalidated. The old rows are deleted
+    once every process stopped using the shard it cached. Leftovers of an interrupted move are
+    deleted from the target first, so a failed move can be run again.
+
+    Args:
+    user_id (int): The ID of the user.
+    target (str): The database alias of the new shard.
+    batch_size (int): Rows copied or deleted per transaction.
+    wait (float): Seconds to wait for the cached shard of the user to expire
+        in every process, settings.SHARD_MAP_CACHE_SECONDS if None.
+
+    Returns:
+    int: The number of rows moved.
+    """
+    wait = settings.SHARD_MAP_CACHE_SECONDS if wait is None else wait
+    forget_user_shard(user_id)
+    source = shard_for_user(user_id)
+    if source == target:
+        return 0
+
+    _set_shard(user_id, source, moving=True)
+    # requests that read the shard before the flag was set finish their writes
+    time.sleep(wait)
+
+    conversation_ids = _conversation_ids(user_id, source)
+    moved = 0
+    try:
+        for ids in _batches(_conversation_ids(user_id, target)):
+            purge_conversations(ids, batch_size, using=target)
+        for ids in _batches(conversation_ids):
+            for model in MOVED_MODELS:
+                moved += copy_rows(model, ids, source, target, batch_size)
+    except Exception:
+        _set_shard(user_id, source, moving=False)
+        raise
+
+    _set_shard(user_id, target, moving=False)
+    _invalidate_history(conversation_ids)
+    logger.info(f"Moved {moved} rows of user {user_id} from {source} to {target}")
+
+    # reads of processes that still cached the old shard keep working, and
+    # may cache history of the old rows meanwhile
+    time.sleep(wait)
+    _invalidate_history(conversation_ids)
+    for ids in _batches(conversation_ids):
+        # the images stay in the bucket, they are referenced by the copies
+        purge_conversations(ids, batch_size, using=source)
+    return moved
@@ -1,9 +1,27 @@
 from storages.backends.s3boto3 import S3Boto3Storage
 from django.conf import settings
 
-class ImageS3Storage(S3Boto3Storage):
+from core.storage_registry import SharedClientsMixin, get_storage
+
+
+class ImageS3Storage(SharedClientsMixin, S3Boto3Storage):
     default_acl = None
 
     def __init__(self, *args, **kwargs):
         kwargs['bucket_name'] = getattr(settings, 'ZAD_ASSIST_BUCKET', None)
-        super().__init__(*args, **kwargs)
\ No newline at end of file
+        super().__init__(*args, **kwargs)
+
+
+class BucketS3Storage(SharedClientsMixin, S3Boto3Storage):
+    """Storage of any bucket, e.g. the one of AI reference images."""
+
+    default_acl = None
+
+
+def image_storage():
+    """Returns the process wide ImageS3Storage."""
+    return get_storage(ImageS3Storage)
+
+
+def bucket_storage(bucket_name):
+    return get_storage(BucketS3Storage, bucket_name=bucket_name)
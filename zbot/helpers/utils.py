@@ -1,15 +1,32 @@
 from datetime import datetime, timedelta
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import connection
+from django.db import connection, connections
+from django.urls import reverse
 import psycopg2
 import logging
 import time
 import json
 import uuid
 
+from core.db_router import read_alias, write_alias
+from .history_cache import (
+    history_cache,
+    turn_matches_image,
+    measure_turn,
+    estimate_tokens,
+    CHARS_PER_TOKEN,
+)
+
 
 MAX_RETRIES = 3
 RETRY_DELAY = 1
+# number of text messages sent to the AI agent as chat history
+AI_HISTORY_LIMIT = getattr(settings, "AI_HISTORY_LIMIT", 12)
+# estimated token budget of the chat history, by mode (None: no budget)
+AI_HISTORY_BUDGETS = getattr(settings, "AI_HISTORY_BUDGETS", {})
+# a turn is dropped rather than truncated below this many tokens
+AI_HISTORY_MIN_TRUNCATED_TOKENS = 64
 
 # Set up the logger
 logger = logging.getLogger(__name__)
@@ -98,265 +115,262 @@ def image_file_size(value):
 def image_upload_path(instance, filename):
     return f"v1/static/media/{uuid.uuid4()}_{filename}"
 
-def get_conversation_history(conversation_id, limit, offset):
+# Messages are never older than their conversation. Bounding created_at by it
+# lets Postgres skip the older partitions of the message tables at execution
+# time once they are partitioned (see the partition_messages command); the
+# margin absorbs clock skew between app servers.
+CONVERSATION_START = """
+    (
+        SELECT c.created_at - INTERVAL '1 day' FROM zbot_conversation c
+        WHERE c.id = %(conversation_id)s
+    )
+"""
+
+# Merged timeline of a conversation: text messages, image messages and
+# machine parameter sets. Parameter sets are encoded as JSON by the database,
+# so array fields arrive as native lists with their full float precision.
+TIMELINE_QUERY = f"""
+    WITH
+        text_messages AS (
+            SELECT
+                tm.id::TEXT AS id,
+                'text' AS type,
+                tm.text AS data,
+                NULL AS image_description,
+                NULL::JSON AS fine_tuning,
+                tm.sender AS sender,
+                tm.created_at AS created_at,
+                NULL::JSONB AS attributes
+            FROM
+                zbot_textmessage tm
+            WHERE
+                tm.conversation_id = %(conversation_id)s
+                AND tm.created_at >= {CONVERSATION_START}
+                AND tm.is_deleted = FALSE
+        ),
+        image_messages AS (
+            SELECT
+                im.id::TEXT AS id,
+                'image' AS type,
+                im.image_url AS data,
+                im.metadata AS image_description,
+                NULL::JSON AS fine_tuning,
+                im.sender AS sender,
+                im.created_at AS created_at,
+                im.attributes AS attributes
+            FROM
+                zbot_imagemessage im
+            WHERE
+                im.conversation_id = %(conversation_id)s
+                AND im.created_at >= {CONVERSATION_START}
+                AND im.is_deleted = FALSE
+        ),
+        machine_parameters AS (
+            SELECT
+                mp.id::TEXT AS id,
+                'parameter' AS type,
+                mp.title AS data,
+                NULL AS image_description,
+                JSON_BUILD_OBJECT(
+                    'injection_temperature', COALESCE(mp.injection_temperature, '{{}}'),
+                    'position', COALESCE(mp.position, '{{}}'),
+                    'injection_pressure', COALESCE(mp.injection_pressure, '{{}}'),
+                    'velocity', COALESCE(mp.velocity, '{{}}'),
+                    'mold_temperature', COALESCE(mp.mold_temperature, 0.0),
+                    'cooling_time', COALESCE(mp.cooling_time, 0.0),
+                    'hot_runner_temperature', COALESCE(mp.hot_runner_temperature, 0.0),
+                    'decompression', COALESCE(mp.decompression, 0.0),
+                    'hold_pressure', COALESCE(mp.hold_pressure, '{{}}'),
+                    'hold_velocity', COALESCE(mp.hold_velocity, '{{}}'),
+                    'hold_time', COALESCE(mp.hold_time, '{{}}'),
+                    'back_pressure', COALESCE(mp.back_pressure, '{{}}'),
+                    'clamping_force', COALESCE(mp.clamping_force, 0.0),
+                    'injection_weight', COALESCE(mp.injection_weight, 0.0),
+                    'num_of_cavities', COALESCE(mp.num_cavities, 0.0),
+                    'prod_wieght', COALESCE(mp.single_prod_wieght, 0.0),
+                    'nozzle_weight', COALESCE(mp.nozzle_weight, 0.0),
+                    'clamping_pressure', COALESCE(mp.clamping_pressure, 0.0),
+                    'machine_id', COALESCE(mp.machine_id::TEXT, ''),
+                    'material_id', COALESCE(mp.material_id::TEXT, '')
+                ) AS fine_tuning,
+                'user' AS sender,
+                mp.created_at AS created_at,
+                NULL::JSONB AS attributes
+            FROM
+                zbot_machineparameter mp
+            WHERE
+                mp.conversation_id = %(conversation_id)s
+                AND mp.created_at >= {CONVERSATION_START}
+        )
+    SELECT * FROM text_messages
+    UNION ALL
+    SELECT * FROM image_messages
+    UNION ALL
+    SELECT * FROM machine_parameters
+"""
+
+# Timeline entries created within [since, until); the range is pushed down
+# into every branch of the union.
+TIMELINE_RANGE_QUERY = f"""
+    SELECT * FROM ({TIMELINE_QUERY}) AS timeline
+    WHERE created_at >= %(since)s AND created_at < %(until)s
+"""
+
+# Creation time of the latest timeline entry before `until`
+TIMELINE_LATEST_QUERY = f"""
+    SELECT GREATEST(
+        (
+            SELECT MAX(tm.created_at) FROM zbot_textmessage tm
+            WHERE tm.conversation_id = %(conversation_id)s AND tm.is_deleted = FALSE
+                AND tm.created_at >= {CONVERSATION_START} AND tm.created_at < %(until)s
+        ),
+        (
+            SELECT MAX(im.created_at) FROM zbot_imagemessage im
+            WHERE im.conversation_id = %(conversation_id)s AND im.is_deleted = FALSE
+                AND im.created_at >= {CONVERSATION_START} AND im.created_at < %(until)s
+        ),
+        (
+            SELECT MAX(mp.created_at) FROM zbot_machineparameter mp
+            WHERE mp.conversation_id = %(conversation_id)s
+                AND mp.created_at >= {CONVERSATION_START} AND mp.created_at < %(until)s
+        )
+    );
+"""
+
+TIMELINE_COUNT_QUERY = f"""
+    SELECT
+        (
+            SELECT COUNT(*) FROM zbot_textmessage tm
+            WHERE tm.conversation_id = %(conversation_id)s AND tm.is_deleted = FALSE
+                AND tm.created_at >= {CONVERSATION_START}
+        ) + (
+            SELECT COUNT(*) FROM zbot_imagemessage im
+            WHERE im.conversation_id = %(conversation_id)s AND im.is_deleted = FALSE
+                AND im.created_at >= {CONVERSATION_START}
+        ) + (
+            SELECT COUNT(*) FROM zbot_machineparameter mp
+            WHERE mp.conversation_id = %(conversation_id)s
+                AND mp.created_at >= {CONVERSATION_START}
+        );
+"""
+
+
+def decode_json(value):
+    # psycopg2 decodes JSON columns natively, other drivers hand back text
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+# Row decoders of the timeline query, by row type. Rows are
+# (id, type, data, image_description, fine_tuning, sender, created_at,
+# attributes).
+TIMELINE_ROW_DECODERS = {
+    "text": lambda row: {
+        "id": row[0],
+        "type": row[1],
+        "data": row[2],
+        "sender": row[5],
+        "created_at": row[6],
+    },
+    "image": lambda row: {
+        "id": row[0],
+        "type": row[1],
+        "data": row[2],
+        "image_utility": row[3],
+        "attributes": decode_json(row[7]) or {},
+        "sender": row[5],
+        "created_at": row[6],
+    },
+    "parameter": lambda row: {
+        "id": row[0],
+        "type": row[1],
+        "data": row[2],
+        "fineTunning": decode_json(row[4]),
+        "sender": row[5],
+        "created_at": row[6],
+    },
+}
+
+
+def image_variant_urls(conversation_id, image_id):
+    """
+    Returns the URLs of the display variants of an image message, which
+    render them on first request, and of its original, signed on request
+    for private buckets (see ImageMessageViewSet.variant).
+    """
+    from .image_variants import DISPLAY_VARIANTS
+
+    return {
+        name: reverse(
+            "conversation-imageMessages-variant",
+            kwargs={"conversation_pk": conversation_id, "pk": image_id, "name": name},
+        )
+        for name in (*DISPLAY_VARIANTS, "original")
+    }
+
+
+def decode_timeline_row(row, conversation_id=None):
+    """
+    Convert a row of the timeline query into its history dictionary. Image
+    entries get the URLs of their variants when the conversation is given.
+    """
+    entry = TIMELINE_ROW_DECODERS[row[1]](row)
+    if conversation_id is not None and row[1] == "image":
+        entry["variants"] = image_variant_urls(conversation_id, row[0])
+    return entry
+
+
+def raw_cursor(conn=None, using=None):
+    """
+    Opens a cursor on a pooled psycopg2 connection (see core/db_pool.py) if
+    one is given, on a Django connection otherwise: the `using` database, or
+    the one the router picks for reads (a replica in read-only requests,
+    see core/db_router.py).
+    """
+    if conn is not None:
+        return conn.cursor()
+    return connections[using or read_alias()].cursor()
+
+
+def get_conversation_history(conversation_id, limit, offset, conn=None, using=None):
     """
     Retrieves the conversation history for a given conversation ID.
 
     Args:
-    conversation_id (int): The ID of the conversation to retrieve history for.
+    conversation_id (uuid): The ID of the conversation to retrieve history for.
+    limit (int): The page size.
+    offset (int): The number of entries to skip, newest first.
+    conn: An optional pooled connection to run the queries on.
+    using (str): An optional database alias to run the queries on.
 
     Returns:
-    list: A list of dictionaries representing the conversation history.
+    list: [history entries of the page, total number of entries].
     """
 
+    from .archive import rehydrate_for_read
+
     try:
-        count_query = """
-            WITH
-                text_messages AS (
-                    SELECT
-                        tm.id::TEXT AS id
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_textmessage tm ON c.id = tm.conversation_id
-                    WHERE
-                        c.id = %s
-                        AND tm.is_deleted = FALSE
-                ),
-                image_messages AS (
-                    SELECT
-                        im.id::TEXT AS id
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_imagemessage im ON c.id = im.conversation_id
-                    WHERE
-                        im.is_deleted = FALSE
-                        AND c.id = %s
-                ),
-                machine_parameters AS (
-                    SELECT
-                        mp.id::TEXT AS id
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_machineparameter mp ON c.id = mp.conversation_id
-                    WHERE
-                        c.id = %s
-                )
-            SELECT COUNT(*)
-            FROM (
-                SELECT id FROM text_messages
-                UNION ALL
-                SELECT id FROM image_messages
-                UNION ALL
-                SELECT id FROM machine_parameters
-            ) AS combined_messages;
-        """
-
-        with connection.cursor() as cursor:
-            cursor.execute(
-                count_query, [conversation_id, conversation_id, conversation_id]
-            )
+        rehydrated = rehydrate_for_read(conversation_id)
+        if rehydrated:
+            conn, using = None, rehydrated
+        params = {"conversation_id": conversation_id, "limit": limit, "offset": offset}
+        with raw_cursor(conn, using) as cursor:
+            cursor.execute(TIMELINE_COUNT_QUERY, params)
             total_count = cursor.fetchone()[0]
 
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            WITH
-                text_messages AS (
-                    SELECT
-                        tm.id::TEXT AS id,
-                        'text' AS type,
-                        tm.text AS data,
-                        NULL AS image_description,
-                        tm.sender AS sender,
-                        tm.created_at AS created_at
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_textmessage tm ON c.id = tm.conversation_id
-                    WHERE
-                        c.id = %s
-                        AND tm.is_deleted = FALSE
-                ),
-                image_messages AS (
-                    SELECT
-                        im.id::TEXT AS id,
-                        'image' AS type,
-                        im.image_url AS data,
-                        im.metadata AS image_description,
-                        im.sender AS sender,
-                        im.created_at AS created_at
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_imagemessage im ON c.id = im.conversation_id
-                    WHERE
-                        im.is_deleted = FALSE
-                        AND c.id = %s
-                ),
-                machine_parameters AS (
-                    SELECT
-                        mp.id::TEXT AS id,
-                        'parameter' AS type,
-                        mp.title AS data,
-                        CONCAT(
-                            COALESCE(ARRAY_TO_STRING(mp.injection_temperature, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.position, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.injection_pressure, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.velocity, ','), ''),
-                            '|',
-                            COALESCE(mp.mold_temperature, 0.0),
-                            '|',
-                            COALESCE(mp.cooling_time, 0.0),
-                            '|',
-                            COALESCE(mp.hot_runner_temperature, 0.0),
-                            '|',
-                            COALESCE(mp.decompression, 0.0),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.hold_pressure, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.hold_velocity, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.hold_time, ','), ''),
-                            '|',
-                            COALESCE(ARRAY_TO_STRING(mp.back_pressure, ','), ''),
-                            '|',
-                            COALESCE(mp.clamping_force, 0.0),
-                            '|',
-                            COALESCE(mp.injection_weight, 0.0),
-                            '|',
-                            COALESCE(mp.num_cavities, 0.0),
-                            '|',
-                            COALESCE(mp.single_prod_wieght, 0.0),
-                            '|',
-                            COALESCE(mp.nozzle_weight, 0.0),
-                            '|',
-                            COALESCE(mp.clamping_pressure, 0.0),
-                            '|',
-                            COALESCE(m.id::TEXT,''),  
-                            '|',
-                            COALESCE(mat.id::TEXT,'')  
-                        ) AS fineTunning,
-                        'user' AS sender,
-                        mp.created_at AS created_at
-                    FROM
-                        zbot_conversation c
-                    LEFT JOIN zbot_machineparameter mp ON c.id = mp.conversation_id
-                    LEFT JOIN zbot_machine m ON mp.machine_id = m.id  
-                    LEFT JOIN zbot_material mat ON mp.material_id = mat.id  
-                    WHERE
-                        c.id = %s
-                )
-            SELECT
-                *
-            FROM 
-                text_messages
-            UNION 
-            SELECT
-                *
-            FROM
-                image_messages
-            UNION 
-            SELECT
-                *
-            FROM
-                machine_parameters
-            ORDER BY
-                created_at DESC
-            LIMIT %s OFFSET %s;
-            """,
-            [conversation_id, conversation_id, conversation_id, limit, offset],
-        )
-        rows = cursor.fetchall()
-        json_rows = []
-        for row in rows:
-            if row[0] is None:
-                continue
-            row_dict = {}
-            if row[1] == "text":
-                row_dict = {
-                    "id": row[0],
-                    "type": row[1],
-                    "data": row[2],
-                    "sender": row[4],
-                    "created_at": row[5],
-                }
-            if row[1] == "image":
-                image_utility = ""
-                if row[3] is not None:
-                    if row[3].startswith("description"):
-                        parts = row[3].split("|")
-                        image_utility = parts[1].split(":")[1]
-                row_dict = {
-                    "id": row[0],
-                    "type": row[1],
-                    "data": row[2],
-                    "image_utility": row[3],  # image_utility,
-                    "sender": row[4],
-                    "created_at": row[5],
-                }
-            # Check if the row is a machine parameter and convert data to JSON
-            if row[1] == "parameter":
-                data_parts = row[3].split("|")
-                # logger.info(
-                #     f" data parts : {data_parts} machine_id:  {data_parts[18]} ,material_id :  {data_parts[19]}"
-                # )
-                data_json = {
-                    "injection_temperature": (
-                        json.loads(f"[{data_parts[0]}]") if data_parts[0] else []
-                    ),
-                    "position": (
-                        json.loads(f"[{data_parts[1]}]") if data_parts[1] else []
-                    ),
-                    "injection_pressure": (
-                        json.loads(f"[{data_parts[2]}]") if data_parts[2] else []
-                    ),
-                    "velocity": (
-                        json.loads(f"[{data_parts[3]}]") if data_parts[3] else []
-                    ),
-                    "mold_temperature": float(data_parts[4]) if data_parts[4] else 0.0,
-                    "cooling_time": float(data_parts[5]) if data_parts[5] else 0.0,
-                    "hot_runner_temperature": (
-                        float(data_parts[6]) if data_parts[6] else 0.0
-                    ),
-                    "decompression": float(data_parts[7]) if data_parts[7] else 0.0,
-                    "hold_pressure": (
-                        json.loads(f"[{data_parts[8]}]") if data_parts[8] else []
-                    ),
-                    "hold_velocity": (
-                        json.loads(f"[{data_parts[9]}]") if data_parts[9] else []
-                    ),
-                    "hold_time": (
-                        json.loads(f"[{data_parts[10]}]") if data_parts[10] else []
-                    ),
-                    "back_pressure": (
-                        json.loads(f"[{data_parts[11]}]") if data_parts[11] else []
-                    ),
-                    "clamping_force": float(data_parts[12]) if data_parts[12] else 0.0,
-                    "injection_weight": (
-                        float(data_parts[13]) if data_parts[13] else 0.0
-                    ),
-                    "num_of_cavities": (
-                        float(data_parts[14]) if data_parts[14] else 0.0
-                    ),
-                    "prod_wieght": (float(data_parts[15]) if data_parts[15] else 0.0),
-                    "nozzle_weight": (float(data_parts[16]) if data_parts[16] else 0.0),
-                    "clamping_pressure": (
-                        float(data_parts[17]) if data_parts[17] else 0.0
-                    ),
-                    "machine_id": (str(data_parts[18]) if data_parts[18] else ""),
-                    "material_id": (str(data_parts[19]) if data_parts[19] else ""),
-                }
-                row_dict = {
-                    "id": row[0],
-                    "type": row[1],
-                    "data": row[2],
-                    "fineTunning": data_json,
-                    "sender": row[4],
-                    "created_at": row[5],
-                }
-            if row_dict:  # Only append if row_dict is not empty
-                json_rows.append(row_dict)
+            cursor.execute(
+                TIMELINE_QUERY
+                + """
+                ORDER BY
+                    created_at DESC
+                LIMIT %(limit)s OFFSET %(offset)s;
+                """,
+                params,
+            )
+            json_rows = [
+                decode_timeline_row(row, conversation_id) for row in cursor.fetchall()
+            ]
 
         return [json_rows, total_count]
 
@@ -437,190 +451,293 @@ def get_conversation_history(conversation_id, limit, offset):
     # return conversation_history
 
 
-def get_history_for_ai(text_query_id, conversation_id, type):
+def get_timeline_range(conversation_id, since, until, conn=None, using=None):
+    """
+    Retrieves the history entries of a conversation created within
+    [since, until), newest first.
+    """
+    with raw_cursor(conn, using) as cursor:
+        cursor.execute(
+            TIMELINE_RANGE_QUERY + " ORDER BY created_at DESC, id DESC;",
+            {"conversation_id": conversation_id, "since": since, "until": until},
+        )
+        return [decode_timeline_row(row, conversation_id) for row in cursor.fetchall()]
+
+
+def get_latest_timeline_entry(conversation_id, until="infinity", conn=None, using=None):
+    """Returns the creation time of the latest history entry before `until`."""
+    with raw_cursor(conn, using) as cursor:
+        cursor.execute(
+            TIMELINE_LATEST_QUERY,
+            {"conversation_id": conversation_id, "until": until},
+        )
+        return cursor.fetchone()[0]
+
+
+def iter_conversation_timeline(conversation_id, using=None, shard=None):
     """
-    Retrieves the conversation history for a given conversation ID,
-    including the latest 10 text messages and related image messages.
+    Yields every history entry of a conversation, oldest first.
+
+    Rows are read through a server-side cursor in chunks of
+    connection.chunked_cursor_size, so memory stays flat whatever the
+    length of the conversation. Streamed responses consume the generator
+    after the request reset its shard, pass the aliases resolved in the
+    view.
 
     Args:
-    conversation_id (int): The ID of the conversation to retrieve history for.
+    conversation_id (uuid): The ID of the conversation to export.
+    using (str): An optional database alias to read from.
+    shard (str): An optional database (shard) of the conversation, where
+        archived messages are rehydrated.
+    """
+    from .archive import rehydrate_conversation
+
+    if rehydrate_conversation(conversation_id, shard):
+        # replicas may not have the rehydrated rows yet
+        using = shard or write_alias()
+    with connections[using or read_alias()].chunked_cursor() as cursor:
+        cursor.execute(
+            TIMELINE_QUERY + " ORDER BY created_at ASC, id ASC;",
+            {"conversation_id": conversation_id},
+        )
+        for row in cursor:
+            yield decode_timeline_row(row, conversation_id)
+
+
+def image_description(attributes):
+    """Returns the description of an image message's attributes."""
+    return (attributes or {}).get("description") or ""
+
+
+def parse_legacy_metadata(metadata):
+    """
+    Returns the attributes of a legacy metadata string, for the conversion
+    of older rows (see the migrate_image_metadata command): AI images have
+    "description:...|utility:...", similarity search results "### key" /
+    value sections and user images the plain description. Descriptions may
+    contain colons and pipes, only the last "|utility:" separates.
+    """
+    if not metadata:
+        return {}
+    if metadata.startswith("description:"):
+        description, separator, utility = metadata[len("description:"):].rpartition(
+            "|utility:"
+        )
+        if not separator:
+            return {"description": utility}
+        return {"description": description, "utility": utility}
+    if metadata.startswith("### "):
+        attributes = {}
+        for section in metadata[len("### "):].split("\n### "):
+            key, _, value = section.partition("\n")
+            attributes[key] = value.rstrip("\n")
+        return attributes
+    return {"description": metadata}
+
+
+# Latest text messages of a conversation, the turns of the AI history
+HISTORY_TURNS_QUERY = f"""
+    SELECT
+        tm.id AS id,
+        tm.text AS data,
+        tm.sender AS sender,
+        tm.created_at AS created_at
+    FROM
+        zbot_textmessage tm
+    WHERE
+        tm.conversation_id = %(conversation_id)s
+        AND tm.is_deleted = FALSE
+        AND tm.created_at >= {CONVERSATION_START}
+    ORDER BY created_at DESC
+    LIMIT %(limit)s;
+"""
+
+# Image messages created within the windows of the AI history turns
+HISTORY_IMAGES_QUERY = """
+    SELECT
+        im.id AS id,
+        im.sender AS sender,
+        im.created_at AS created_at,
+        COALESCE(im.attributes ->> 'description', '') AS image_description
+    FROM
+        zbot_imagemessage im
+    WHERE
+        im.conversation_id = %(conversation_id)s
+        AND im.is_deleted = FALSE
+        AND im.created_at >= %(since)s
+        AND im.created_at < %(until)s
+    ORDER BY created_at;
+"""
+
+
+def history_turn(text_id, text_data, sender, created_at):
+    """Build the history turn of a text message, without its images yet."""
+    # images sent along a message land within two minutes of it
+    window_start = created_at.replace(second=0, microsecond=0)
+    return {
+        "id": text_id,
+        "message": text_data,
+        "sender": sender,
+        "window": (window_start, window_start + timedelta(minutes=2)),
+        "images": {},
+    }
+
+
+def fetch_history_turns(conversation_id, limit, conn=None, using=None):
+    """
+    Loads the latest text messages of a conversation as history turns,
+    oldest first, with the descriptions of their related image messages.
+
+    Args:
+    conversation_id (uuid): The ID of the conversation.
+    limit (int): The maximum number of turns to load.
+    conn: An optional pooled connection to run the queries on.
+    using (str): An optional database alias to run the queries on.
 
     Returns:
-    list: A list of dictionaries representing the conversation history.
+    list: A list of turn dictionaries (see history_turn).
     """
+    with raw_cursor(conn, using) as cursor:
+        cursor.execute(
+            HISTORY_TURNS_QUERY, {"conversation_id": conversation_id, "limit": limit}
+        )
+        text_messages = cursor.fetchall()
+        if not text_messages:
+            return []
 
-    if not connection.is_usable():
-        reconnect_database(connection, logger)
-        return []
+        turns = [history_turn(*tm) for tm in reversed(text_messages)]
 
-    try:
-        with connection.cursor() as cursor:
-            # Get the latest 2 text messages
-            query = """
-                SELECT
-                    tm.id AS id,
-                    tm.text AS data,
-                    tm.sender AS sender,
-                    tm.created_at AS created_at
-                FROM
-                    zbot_conversation c
-                LEFT JOIN
-                    zbot_textmessage tm ON c.id = tm.conversation_id
-                WHERE
-                    tm.id <> %s
-                    AND c.id = %s
-                    AND tm.is_deleted = FALSE
-                ORDER BY created_at DESC
-                LIMIT 12;
-            """
-            cursor.execute(query, [text_query_id, conversation_id])
-            text_messages = cursor.fetchall()
-
-            # logger.info(f"list of text messages {text_messages}")
-            if not text_messages:
-                return []  # Return an empty array if no text messages
-
-            conversation_history = []
-
-            # For each text message, find related image messages
-            for tm in reversed(text_messages):
-                text_id, text_data, sender, created_at = tm
-                minute_start = created_at.replace(
-                    second=0, microsecond=0
-                )  # Start of the minute
-                minute_end = minute_start + timedelta(minutes=2)  # End of the minute
-
-                # Fetch related image messages created within the same minute and with the same sender
-                image_query = """
-                    SELECT
-                        im.id AS id,
-                        im.image_url AS data,
-                        im.metadata AS image_description
-                    FROM
-                        zbot_imagemessage im
-                    WHERE
-                        im.conversation_id = %s
-                        AND im.is_deleted = FALSE
-                        AND im.sender = %s
-                        AND im.created_at >= %s
-                        AND im.created_at < %s
-                """
-                cursor.execute(
-                    image_query, [conversation_id, sender, minute_start, minute_end]
-                )
-                image_messages = cursor.fetchall()
-
-                # Structure the result
-                image_descriptions = []
-                for img in image_messages:
-                    image_desc = ""
-                    if img[2] is not None:
-                        if img[2].startswith("description"):
-                            parts = img[2].split("|")
-                            image_desc = parts[0].split(":")[1]
-                    image_descriptions.append(image_desc)
-
-                machine_params_list = []
-                #
-                machine_param_query = """
-                    SELECT
-                        mp.id AS id,
-                        mp.title AS title,
-                        mp.injection_temperature AS injection_temperature,
-                        mp.position AS position,
-                        mp.injection_pressure AS injection_pressure,
-                        mp.velocity AS velocity,
-                        mp.mold_temperature AS mold_temperature,
-                        mp.cooling_time AS cooling_time,
-                        mp.hot_runner_temperature AS hot_runner_temperature,
-                        mp.decompression AS decompression,
-                        mp.hold_pressure AS hold_pressure,
-                        mp.hold_velocity AS hold_velocity,
-                        mp.hold_time AS hold_time,
-                        mp.back_pressure AS back_pressure,
-                        mp.clamping_force AS clamping_force,
-                        mp.injection_weight AS injection_weight
-                    FROM
-                        zbot_machineparameter mp
-                    WHERE
-                        mp.conversation_id = %s
-                        AND mp.created_at >= %s
-                        AND mp.created_at < %s
-                """
-                cursor.execute(
-                    machine_param_query, [conversation_id, minute_start, minute_end]
-                )
-                machine_parameters = cursor.fetchall()
-
-                # Structure the machine parameters
-
-                for param in machine_parameters:
-                    machine_params_list.append(
-                        {
-                            "injection_temperature": param[2],
-                            "position": param[3],
-                            "injection_pressure": param[4],
-                            "velocity": param[5],
-                            "mold_temperature": param[6],
-                            "cooling_time": param[7],
-                            "hot_runner_temperature": param[8],
-                            "decompression": param[9],
-                            "hold_pressure": param[10],
-                            "hold_velocity": param[11],
-                            "hold_time": param[12],
-                            "back_pressure": param[13],
-                            "clamping_force": param[14],
-                            "injection_weight": param[15],
-                        }
-                    )
-                if len(machine_parameters) == 0:
-                    from zbot.models import MachineParameter
-
-                    param = (
-                        MachineParameter.objects.filter(
-                            conversation_id=conversation_id, created_at__lt=minute_start
-                        )
-                        .order_by("-created_at")
-                        .first()
-                    )
-                    if param is not None:
-                        latest_current_param = {
-                            "injection_temperature": param.injection_temperature,
-                            "position": param.position,
-                            "injection_pressure": param.injection_pressure,
-                            "velocity": param.velocity,
-                            "mold_temperature": param.mold_temperature,
-                            "cooling_time": param.cooling_time,
-                            "hot_runner_temperature": param.hot_runner_temperature,
-                            "decompression": param.decompression,
-                            "hold_pressure": param.hold_pressure,
-                            "hold_velocity": param.hold_velocity,
-                            "hold_time": param.hold_time,
-                            "back_pressure": param.back_pressure,
-                            "clamping_force": param.clamping_force,
-                            "injection_weight": param.injection_weight,
-                        }
-                        machine_params_list.append(latest_current_param)
-
-                history_data = {
-                    "role": sender,
-                    "message": text_data,
-                }
+        # Fetch the images of every turn at once, then match them by sender
+        # and creation window
+        cursor.execute(
+            HISTORY_IMAGES_QUERY,
+            {
+                "conversation_id": conversation_id,
+                "since": turns[0]["window"][0],
+                "until": turns[-1]["window"][1],
+            },
+        )
+        for image_id, sender, created_at, description in cursor.fetchall():
+            for turn in turns:
+                if turn_matches_image(turn, sender, created_at):
+                    turn["images"][image_id] = description
 
-                if type == "ops":
-                    pass
-                #                    history_data["updatedParameters"] = machine_params_list
-                else:
-                    history_data["imageDescription"] = image_descriptions
+    return [measure_turn(turn) for turn in turns]
 
-                # Append the structured object to the conversation history
-                conversation_history.append(history_data)
 
-    except psycopg2.Error as e:
-        logger.error(f"Database query failed: {e}")
-        return []
+def build_history_window(turns, text_query_id, type):
+    """
+    Selects the turns sent to the AI agent within the token budget of the
+    mode, walking from the most recent turn backwards. Older turns are
+    dropped first; the turn crossing the budget is truncated when enough
+    budget is left, and the most recent turn is always sent. Machine
+    parameters are not part of the window, ops requests carry them in
+    their own fields.
+
+    Costs come from the estimates cached on each turn (see measure_turn).
+
+    Returns:
+    tuple: (history list, window metrics).
+    """
+    candidates = [turn for turn in turns if str(turn["id"]) != str(text_query_id)]
+    candidates = candidates[-AI_HISTORY_LIMIT:]
+    budget = AI_HISTORY_BUDGETS.get(type)
+    with_images = type != "ops"
+
+    window = []
+    used_tokens = 0
+    truncated = False
+    for turn in reversed(candidates):
+        history_data = {
+            "role": turn["sender"],
+            "message": turn["message"],
+        }
+        if with_images:
+            history_data["imageDescription"] = list(turn["images"].values())
+        cost = turn["message_tokens"] + (turn["image_tokens"] if with_images else 0)
+
+        if budget is not None and used_tokens + cost > budget:
+            remaining = budget - used_tokens
+            if window and remaining < AI_HISTORY_MIN_TRUNCATED_TOKENS:
+                break
+            # keep the beginning of the message, without its images
+            remaining = max(remaining, AI_HISTORY_MIN_TRUNCATED_TOKENS)
+            history_data["message"] = (
+                turn["message"][: remaining * CHARS_PER_TOKEN].rstrip() + "..."
+            )
+            if with_images:
+                history_data["imageDescription"] = []
+            cost = estimate_tokens(history_data["message"])
+            truncated = True
+
+        window.append(history_data)
+        used_tokens += cost
+        if truncated:
+            break
+
+    window.reverse()
+    metrics = {
+        "budget": budget,
+        "estimated_tokens": used_tokens,
+        "turns_available": len(candidates),
+        "turns_sent": len(window),
+        "truncated": truncated,
+    }
+    return window, metrics
+
+
+def get_history_window_for_ai(text_query_id, conversation_id, type):
+    """
+    Retrieves the conversation history sent to the AI agent: the latest
+    AI_HISTORY_LIMIT text messages (the current query excluded) with the
+    descriptions of their related image messages, cut to the token budget
+    of the mode.
+
+    Turns are served from the in-process history cache, which is kept up to
+    date by the message signals and checked against the writes of other
+    processes in the shared cache; the database is only hit on a cold
+    conversation. Without a shared cache (SHARED_CACHE) the turns are read
+    every time.
+
+    Args:
+    text_query_id (int): The ID of the text message being answered.
+    conversation_id (uuid): The ID of the conversation to retrieve history for.
+    type (str): "chat" or "ops".
 
-    return conversation_history
+    Returns:
+    tuple: (history list, window metrics, see build_history_window).
+    """
+    use_cache = settings.SHARED_CACHE
+    turns = history_cache.get(conversation_id, type) if use_cache else None
+    if turns is None:
+        if not connection.is_usable():
+            reconnect_database(connection, logger)
+            return [], {}
+
+        from .archive import rehydrate_for_read
+
+        generation = history_cache.generation(conversation_id) if use_cache else None
+        try:
+            using = rehydrate_for_read(conversation_id)
+            turns = fetch_history_turns(conversation_id, AI_HISTORY_LIMIT + 1, using=using)
+        except psycopg2.Error as e:
+            logger.error(f"Database query failed: {e}")
+            return [], {}
+        if use_cache:
+            history_cache.put(conversation_id, type, turns, generation)
+
+    return build_history_window(turns, text_query_id, type)
+
+
+def get_history_for_ai(text_query_id, conversation_id, type):
+    """
+    Retrieves the conversation history sent to the AI agent, see
+    get_history_window_for_ai.
+
+    Returns:
+    list: A list of dictionaries representing the conversation history.
+    """
+    return get_history_window_for_ai(text_query_id, conversation_id, type)[0]
 
 
 def conversation_image_path(instance, filename):
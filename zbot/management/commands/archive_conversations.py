@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from zbot.helpers.archive import archive_conversation, find_idle_conversations
+
+
+class Command(BaseCommand):
+    help = "Moves the messages of long idle conversations into compressed archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--idle-days",
+            type=int,
+            default=180,
+            help="Archive conversations without activity for this many days.",
+        )
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the conversations that would be archived.",
+        )
+        parser.add_argument(
+            "--database",
+            choices=settings.USER_SHARDS,
+            default=DEFAULT_DB_ALIAS,
+            help="The database (shard) whose conversations are archived.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["idle_days"])
+        using = options["database"]
+        after = "00000000-0000-0000-0000-000000000000"
+        conversations = messages = compressed = 0
+
+        while True:
+            batch = find_idle_conversations(
+                cutoff, options["batch_size"], after=after, using=using
+            )
+            if not batch:
+                break
+            after = batch[-1]
+
+            for conversation_id in batch:
+                if options["dry_run"]:
+                    conversations += 1
+                    continue
+                archive = archive_conversation(conversation_id, using=using)
+                if archive is None:
+                    continue
+                conversations += 1
+                messages += archive.text_count + archive.image_count
+                compressed += len(archive.payload)
+
+            self.stdout.write(
+                f"{conversations} conversations, {messages} messages archived "
+                f"({compressed} compressed bytes)"
+            )
+
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {conversations} idle conversations.")
+        )
@@ -0,0 +1,63 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from zbot.helpers.image_variants import DISPLAY_VARIANTS, ensure_variants
+from zbot.models import ImageMessage
+
+
+class Command(BaseCommand):
+    help = "Renders the display variants of images uploaded before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to wait between batches.",
+        )
+        parser.add_argument(
+            "--database",
+            choices=settings.USER_SHARDS,
+            default=DEFAULT_DB_ALIAS,
+            help="The database (shard) whose images are backfilled.",
+        )
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        missing = Q()
+        for name in DISPLAY_VARIANTS:
+            missing |= ~Q(variants__has_key=name)
+        images = (
+            ImageMessage.live.using(using)
+            .filter(missing, upload_status=ImageMessage.READY)
+            .order_by("pk")
+        )
+        after = 0
+        done = failed = 0
+
+        while True:
+            # keyset pagination, images that cannot be rendered are skipped
+            batch = list(images.filter(pk__gt=after)[: options["batch_size"]])
+            if not batch:
+                break
+            after = batch[-1].pk
+
+            for image_message in batch:
+                variants = ensure_variants(image_message, using=using)
+                if all(variants.get(name) for name in DISPLAY_VARIANTS):
+                    done += 1
+                else:
+                    failed += 1
+
+            self.stdout.write(f"{done} images backfilled, {failed} without a source")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Backfilled the variants of {done} images.")
+        )
@@ -0,0 +1,110 @@
+import json
+import random
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from zbot.helpers.utils import decode_timeline_row
+
+
+ARRAY_FIELDS = [
+    "injection_temperature",
+    "position",
+    "injection_pressure",
+    "velocity",
+]
+FLOAT_FIELDS = ["mold_temperature", "cooling_time", "hot_runner_temperature", "decompression"]
+HOLD_FIELDS = ["hold_pressure", "hold_velocity", "hold_time", "back_pressure"]
+TAIL_FIELDS = [
+    "clamping_force",
+    "injection_weight",
+    "num_of_cavities",
+    "prod_wieght",
+    "nozzle_weight",
+    "clamping_pressure",
+]
+
+
+def legacy_decode(row):
+    """The former string-packed decoding of a parameter row, kept as baseline."""
+    data_parts = row[3].split("|")
+    data_json = {}
+    for i, field in enumerate(ARRAY_FIELDS):
+        data_json[field] = json.loads(f"[{data_parts[i]}]") if data_parts[i] else []
+    for i, field in enumerate(FLOAT_FIELDS, start=4):
+        data_json[field] = float(data_parts[i]) if data_parts[i] else 0.0
+    for i, field in enumerate(HOLD_FIELDS, start=8):
+        data_json[field] = json.loads(f"[{data_parts[i]}]") if data_parts[i] else []
+    for i, field in enumerate(TAIL_FIELDS, start=12):
+        data_json[field] = float(data_parts[i]) if data_parts[i] else 0.0
+    data_json["machine_id"] = str(data_parts[18]) if data_parts[18] else ""
+    data_json["material_id"] = str(data_parts[19]) if data_parts[19] else ""
+    return {
+        "id": row[0],
+        "type": row[1],
+        "data": row[2],
+        "fineTunning": data_json,
+        "sender": row[4],
+        "created_at": row[5],
+    }
+
+
+def sample_parameters():
+    parameters = {}
+    for field in ARRAY_FIELDS + HOLD_FIELDS:
+        parameters[field] = [random.uniform(0, 500) for _ in range(8)]
+    for field in FLOAT_FIELDS + TAIL_FIELDS:
+        parameters[field] = random.uniform(0, 500)
+    parameters["machine_id"] = str(uuid.uuid4())
+    parameters["material_id"] = str(uuid.uuid4())
+    return parameters
+
+
+def pack_legacy(parameters):
+    parts = []
+    for field in ARRAY_FIELDS + FLOAT_FIELDS + HOLD_FIELDS + TAIL_FIELDS:
+        value = parameters[field]
+        parts.append(",".join(map(repr, value)) if isinstance(value, list) else repr(value))
+    parts += [parameters["machine_id"], parameters["material_id"]]
+    return "|".join(parts)
+
+
+class Command(BaseCommand):
+    help = "Compares the decode time per history page of parameter rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--page-size", type=int, default=30)
+        parser.add_argument("--pages", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        page_size = options["page_size"]
+        pages = options["pages"]
+        created_at = datetime.now(timezone.utc)
+
+        legacy_page, json_page, native_page = [], [], []
+        for _ in range(page_size):
+            parameters = sample_parameters()
+            row_id = str(uuid.uuid4())
+            legacy_page.append(
+                (row_id, "parameter", "title", pack_legacy(parameters), "user", created_at)
+            )
+            json_page.append(
+                (row_id, "parameter", "title", None, json.dumps(parameters), "user", created_at)
+            )
+            native_page.append(
+                (row_id, "parameter", "title", None, parameters, "user", created_at)
+            )
+
+        results = {
+            "legacy string packing": lambda: [legacy_decode(row) for row in legacy_page],
+            "json text": lambda: [decode_timeline_row(row) for row in json_page],
+            "json decoded by driver": lambda: [
+                decode_timeline_row(row) for row in native_page
+            ],
+        }
+        self.stdout.write(f"Decoding {pages} pages of {page_size} parameter rows")
+        for name, decode in results.items():
+            elapsed = timeit.timeit(decode, number=pages)
+            self.stdout.write(f"{name:>24}: {elapsed / pages * 1e6:9.1f} us/page")
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from zbot.helpers.utils import parse_legacy_metadata
+from zbot.models import ImageMessage
+
+
+class Command(BaseCommand):
+    help = "Copies the legacy metadata string of image messages into their attributes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to wait between batches.",
+        )
+        parser.add_argument(
+            "--database",
+            choices=settings.USER_SHARDS,
+            default=DEFAULT_DB_ALIAS,
+            help="The database (shard) whose image messages are migrated.",
+        )
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        images = (
+            ImageMessage.objects.using(using)
+            .filter(attributes={}, metadata__gt="")
+            .only("pk", "metadata", "attributes")
+            .order_by("pk")
+        )
+        after = 0
+        migrated = 0
+
+        while True:
+            # keyset pagination, rows written since the dual writes already
+            # carry their attributes and are not matched
+            batch = list(images.filter(pk__gt=after)[: options["batch_size"]])
+            if not batch:
+                break
+            after = batch[-1].pk
+
+            for image_message in batch:
+                image_message.attributes = parse_legacy_metadata(image_message.metadata)
+            ImageMessage.objects.using(using).bulk_update(batch, ["attributes"])
+            migrated += len(batch)
+
+            self.stdout.write(f"{migrated} image messages migrated")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Migrated the metadata of {migrated} image messages.")
+        )
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+
+from zbot.helpers.partitions import (
+    PARTITIONED_MODELS,
+    convert_table,
+    create_partition,
+    detach_partition,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    next_month,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Manages the monthly created_at range partitions of the message tables "
+        "(text messages, image messages and machine parameters)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            choices=["convert", "create", "detach", "list"],
+            help=(
+                "convert: partition the existing tables, create: add the upcoming "
+                "monthly partitions, detach: detach the partitions older than "
+                "--before, list: show the partitions"
+            ),
+        )
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=3,
+            help="Number of upcoming monthly partitions to keep created.",
+        )
+        parser.add_argument(
+            "--before",
+            type=datetime.fromisoformat,
+            help="Detach the partitions holding only rows created before this date.",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop the detached partitions instead of keeping them as tables.",
+        )
+        parser.add_argument(
+            "--database",
+            choices=settings.USER_SHARDS,
+            default=DEFAULT_DB_ALIAS,
+            help="The database (shard) whose tables are managed.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            getattr(self, options["action"])(options)
+        except DatabaseError as e:
+            raise CommandError(str(e))
+
+    def convert(self, options):
+        using = options["database"]
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            if is_partitioned(table, using):
+                self.stdout.write(f"{table} is already partitioned")
+                continue
+            until = convert_table(model, using, options["months_ahead"] + 1)
+            self.stdout.write(f"{table}: rows before {until:%Y-%m-%d} kept in {table}_legacy")
+        self.create(options)
+
+    def create(self, options):
+        using = options["database"]
+        start = month_start(datetime.now(timezone.utc))
+        created = 0
+        for _ in range(options["months_ahead"] + 1):
+            for model in PARTITIONED_MODELS:
+                if not is_partitioned(model._meta.db_table, using):
+                    raise CommandError(
+                        f"{model._meta.db_table} is not partitioned, run convert first"
+                    )
+                created += create_partition(model, start, using)
+            start = next_month(start)
+        self.stdout.write(self.style.SUCCESS(f"Created {created} partitions."))
+
+    def detach(self, options):
+        if options["before"] is None:
+            raise CommandError("detach requires --before")
+        before = options["before"]
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+
+        using = options["database"]
+        detached = 0
+        for model in PARTITIONED_MODELS:
+            for name, _, until, rows in list_partitions(model._meta.db_table, using):
+                if until is None or until > before:
+                    continue
+                detach_partition(model, name, drop=options["drop"], using=using)
+                detached += 1
+                self.stdout.write(f"{name}: ~{max(rows, 0)} rows")
+
+        verb = "Dropped" if options["drop"] else "Detached"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {detached} partitions."))
+
+    def list(self, options):
+        using = options["database"]
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            if not is_partitioned(table, using):
+                self.stdout.write(f"{table}: not partitioned")
+                continue
+            self.stdout.write(table)
+            for name, bound, _, rows in list_partitions(table, using):
+                self.stdout.write(f"  {name} {bound} ~{max(rows, 0)} rows")
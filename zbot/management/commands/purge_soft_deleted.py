@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from core.db_router import SHARDED_MODELS
+from management.models import Document
+from zbot.helpers.purge import purge_model
+from zbot.models import Conversation, ImageMessage, TextMessage
+
+
+# messages go first so that purging a conversation finds fewer of them left
+PURGED_MODELS = [TextMessage, ImageMessage, Conversation, Document]
+
+
+class Command(BaseCommand):
+    help = (
+        "Hard deletes conversations, messages and documents soft-deleted "
+        "longer than the retention period"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=30,
+            help="Keep soft-deleted rows for this many days.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.1,
+            help="Seconds to wait between batches.",
+        )
+        parser.add_argument(
+            "--delete-files",
+            action="store_true",
+            help="Also delete the S3 objects of purged images and documents.",
+        )
+
+    def targets(self):
+        # conversations and messages are on every shard, documents are not
+        for model in PURGED_MODELS:
+            if model._meta.label_lower in SHARDED_MODELS:
+                for using in settings.USER_SHARDS:
+                    yield model, using
+            else:
+                yield model, DEFAULT_DB_ALIAS
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["retention_days"])
+
+        for model, using in self.targets():
+            rows = files = 0
+            elapsed = 0.0
+            for deleted, deleted_files, seconds in purge_model(
+                model,
+                cutoff,
+                options["batch_size"],
+                sleep=options["sleep"],
+                delete_from_s3=options["delete_files"],
+                using=using,
+            ):
+                rows += deleted
+                files += deleted_files
+                elapsed += seconds
+                self.stdout.write(
+                    f"{model.__name__} ({using}): {rows} rows, {files} files purged "
+                    f"({rows / elapsed if elapsed else 0:.0f} rows/s)"
+                )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Purged {rows} {model.__name__} rows and {files} files on {using}."
+                )
+            )
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from core.db_router import hashed_shard
+from zbot.helpers.sharding import move_user
+
+
+class Command(BaseCommand):
+    help = "Moves the conversations of a user to another database shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, required=True, help="The user ID.")
+        parser.add_argument(
+            "--to",
+            choices=settings.USER_SHARDS,
+            help="The target shard, the hashed shard of the user if not given.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_id = options["user"]
+        if not get_user_model().objects.filter(pk=user_id).exists():
+            raise CommandError(f"User {user_id} does not exist")
+        target = options["to"] or hashed_shard(user_id)
+
+        try:
+            moved = move_user(user_id, target, batch_size=options["batch_size"])
+        except DatabaseError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved {moved} rows of user {user_id} to {target}.")
+        )
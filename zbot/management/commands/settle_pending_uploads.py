@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from zbot.helpers.image_uploads import settle_stale_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Marks image messages left pending by a stopped upload pool as ready "
+        "when their file was stored, as failed otherwise"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            default=30,
+            help="Settle the messages pending for longer than this many minutes.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--database",
+            choices=settings.USER_SHARDS,
+            default=DEFAULT_DB_ALIAS,
+            help="The database (shard) whose messages are settled.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options["minutes"])
+        ready, failed = settle_stale_uploads(
+            cutoff, options["batch_size"], using=options["database"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Marked {ready} pending images ready and {failed} failed."
+            )
+        )
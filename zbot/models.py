@@ -1,14 +1,15 @@
 from django.conf import settings
 
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import FileExtensionValidator
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 
 from core.models import TimestampedModel, SoftDeleteModel
 from management.models import Company, Customer, Operator
 from .helpers.utils import image_file_size , image_upload_path
-from .helpers.storage import ImageS3Storage
+from .helpers.storage import image_storage
 
 
 class Conversation(TimestampedModel, SoftDeleteModel):
@@ -16,11 +17,60 @@ class Conversation(TimestampedModel, SoftDeleteModel):
     name = models.CharField(max_length=255, unique=True)
     title = models.CharField(max_length=255)
     type = models.CharField(max_length=100)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # users live on the default database, conversations may be on another
+    # shard (see core/db_router.py)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_constraint=False
+    )
+
+    class Meta:
+        indexes = [
+            # conversation list of a user
+            models.Index(
+                fields=["user", "-created_at"],
+                condition=models.Q(is_deleted=False),
+                name="zbot_conv_live_user_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_deleted=True),
+                name="zbot_conv_deleted_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def delete(self, using=None, keep_parents=False):
+        # soft delete the conversation and its messages with one UPDATE per
+        # table instead of a save() per message
+        from .helpers.history_cache import history_cache
+        from .helpers.history_pages import invalidate_history_pages
+
+        conversation_id = self.pk
+        with transaction.atomic():
+            Conversation.objects.filter(pk=conversation_id).soft_delete()
+            TextMessage.objects.filter(conversation_id=conversation_id).soft_delete()
+            ImageMessage.objects.filter(conversation_id=conversation_id).soft_delete()
+            # bulk updates send no signals, invalidate the cached history here
+            transaction.on_commit(lambda: history_cache.invalidate(conversation_id))
+            transaction.on_commit(lambda: invalidate_history_pages(conversation_id))
+        self.is_deleted = True
+
+
+# compressed timeline of a conversation idle for a long time, its text and
+# image messages are moved here out of the hot tables (see helpers/archive.py)
+class ConversationArchive(TimestampedModel):
+    conversation = models.OneToOneField(
+        Conversation,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="archive",
+    )
+    payload = models.BinaryField()
+    text_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+
 
 # text_message mode for a conversation with text
 class TextMessage(TimestampedModel, SoftDeleteModel):
@@ -35,6 +85,21 @@ class TextMessage(TimestampedModel, SoftDeleteModel):
     machine_model = models.CharField(max_length=255)
     sender = models.CharField(max_length=9, choices=MESSAGE_SENDERS, default="user")
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "created_at"],
+                condition=models.Q(is_deleted=False),
+                name="zbot_text_live_conv_idx",
+            ),
+            # keyset scan of the purge_soft_deleted command
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_deleted=True),
+                name="zbot_text_deleted_idx",
+            ),
+        ]
+
 
 class CustomImageField(models.ImageField):
     def __init__(self, *args, **kwargs):
@@ -51,15 +116,29 @@ class ImageMessage(TimestampedModel, SoftDeleteModel):
         (USER, "user"),
         (AI_AGENT, "ai"),
     ]
+    # images uploaded asynchronously are pending until stored, see
+    # helpers/image_uploads.py
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+    UPLOAD_STATUSES = [
+        (PENDING, "pending"),
+        (READY, "ready"),
+        (FAILED, "failed"),
+    ]
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    # legacy "description:...|utility:..." string, still written for clients
     metadata = models.TextField(null=True, blank=True)
+    # structured metadata ("description", "utility", ...) read by the history
+    # and AI paths; older rows are converted by migrate_image_metadata
+    attributes = models.JSONField(default=dict, blank=True)
     # set specific  extensions for the image
     image_url = models.CharField(max_length=255, null=True)
     image = CustomImageField(
         # define maximum size of the image validator
         null=True,
         blank=True,
-        storage=ImageS3Storage(),
+        storage=image_storage,
         validators=[
             FileExtensionValidator(allowed_extensions=["jpg", "jpeg", "png", "heic"]),
             image_file_size,
@@ -69,13 +148,51 @@ class ImageMessage(TimestampedModel, SoftDeleteModel):
     top_k = models.PositiveIntegerField(default=1, blank=True, null=True)
     machine_model = models.CharField(max_length=255, blank= True, null=True)
     sender = models.CharField(max_length=9, choices=MESSAGE_SENDERS, default="user")
+    # bucket and keys of the downscaled copies of the image, see
+    # helpers/image_variants.py
+    variants = models.JSONField(default=dict, blank=True)
+    # SHA-256 of the uploaded file, see helpers/image_hashes.py
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    upload_status = models.CharField(
+        max_length=10, choices=UPLOAD_STATUSES, default=READY
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["conversation", "created_at"],
+                condition=models.Q(is_deleted=False),
+                name="zbot_image_live_conv_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_deleted=True),
+                name="zbot_image_deleted_idx",
+            ),
+            # earlier uploads of the same content
+            models.Index(
+                fields=["content_hash", "-created_at"],
+                condition=~models.Q(content_hash=""),
+                name="zbot_image_hash_idx",
+            ),
+            # containment lookups, e.g. attributes__contains={"utility": ...}
+            GinIndex(
+                fields=["attributes"],
+                opclasses=["jsonb_path_ops"],
+                name="zbot_image_attrs_gin",
+            ),
+        ]
 
     def save(self, *args, **kwargs):
-        # Save the object first to ensure the file is uploaded and has a name
         is_new = self._state.adding
+        # a file given by name is stored already, insert its URL with the row
+        precomputed = is_new and self.image and self.image._committed
+        if precomputed:
+            self.image_url = self.image.url
+        # Save the object first to ensure the file is uploaded and has a name
         super().save(*args, **kwargs)
         # Only update image_url after the initial save and if image_file exists
-        if is_new and self.image and self.image.name:
+        if is_new and not precomputed and self.image and self.image.name:
             self.image_url = self.image.url
             # Save only the image_url field to avoid recursion
             super().save(update_fields=["image_url"])
@@ -138,18 +255,20 @@ class MachineParameter(TimestampedModel):
     single_prod_wieght = models.FloatField(default=0.0)
     nozzle_weight = models.FloatField(default=0.0)
     clamping_pressure = models.FloatField(default=0.0)
+    # machines and materials live on the default database
     material = models.ForeignKey(
         Material,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
+        db_constraint=False,
     )
     machine = models.ForeignKey(
         Machine,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
-        
+        db_constraint=False,
     )
     conversation = models.ForeignKey(
         Conversation,
@@ -158,6 +277,15 @@ class MachineParameter(TimestampedModel):
         blank=True,
     )
 
+    class Meta:
+        indexes = [
+            # parameter branch of the timeline and the parameter list
+            models.Index(
+                fields=["conversation", "created_at"],
+                name="zbot_param_conv_idx",
+            ),
+        ]
+
 
 # bug reports
 class BugReport(TimestampedModel):
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+
+from core.url_signer import SignedURLListSerializer, SignedURLSerializerMixin
 from .models import (
     Conversation,
     TextMessage,
@@ -8,6 +10,7 @@ from .models import (
     Machine,
     Material,
 )
+from .helpers.utils import image_variant_urls, parse_legacy_metadata
 from management.serializers import (
     SimpleCompanySerializer,
     SimpleCustomerSerializer,
@@ -17,8 +20,9 @@ from management.serializers import (
 # from rest_framework.pagination import LimitOffsetPagination
 
 
-class ConversationImageMessageSerializer(serializers.ModelSerializer):
+class ConversationImageMessageSerializer(SignedURLSerializerMixin, serializers.ModelSerializer):
     conversation_id = serializers.CharField(read_only=True)
+    variant_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = ImageMessage
@@ -31,17 +35,35 @@ class ConversationImageMessageSerializer(serializers.ModelSerializer):
             "sender",
             "machine_model",
             "top_k",
+            "variants",
+            "variant_urls",
+            "content_hash",
+            "upload_status",
+            "attributes",
             "created_at",
             "updated_at",
             "conversation_id",
             "is_deleted",
         ]
 
-        read_only_fields = ["id","conversation_id","image_url", "created_at",
+        read_only_fields = ["id","conversation_id","image_url", "variants", "content_hash", "upload_status", "attributes", "created_at",
             "updated_at",
             "conversation_id",
             "is_deleted"]
         extra_kwargs = {"image": {"required": "True"}}
+        list_serializer_class = SignedURLListSerializer
+        signed_url_fields = ["image_url"]
+
+    def validate(self, attrs):
+        # keep the structured attributes in step with the legacy string
+        if attrs.get("metadata"):
+            attrs["attributes"] = parse_legacy_metadata(attrs["metadata"])
+        return attrs
+
+    def get_variant_urls(self, obj):
+        if obj.pk is None:
+            return {}
+        return image_variant_urls(obj.conversation_id, obj.pk)
 
 
 class TextMessageSerializer(serializers.ModelSerializer):
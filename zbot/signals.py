@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import TextMessage, ImageMessage, MachineParameter
+from .helpers.history_cache import history_cache
+from .helpers.history_pages import invalidate_history_page
+from .helpers.utils import history_turn, image_description
+
+
+@receiver(post_save, sender=TextMessage)
+def update_history_cache_on_text(sender, instance, created, **kwargs):
+    """Keep the cached AI history in sync with text message writes."""
+    conversation_id = instance.conversation_id
+    text_id = instance.id
+    if instance.is_deleted:
+        # the window has to reach further back, rebuild it on next use
+        transaction.on_commit(lambda: history_cache.invalidate(conversation_id))
+        return
+    if not created:
+        text = instance.text
+        transaction.on_commit(
+            lambda: history_cache.update_text(conversation_id, text_id, text)
+        )
+        return
+
+    turn = history_turn(text_id, instance.text, instance.sender, instance.created_at)
+
+    def append():
+        if not history_cache.is_cached(conversation_id):
+            # other processes may have it cached
+            history_cache.invalidate(conversation_id)
+            return
+        window_start, window_end = turn["window"]
+        images = ImageMessage.live.filter(
+            conversation_id=conversation_id,
+            sender=turn["sender"],
+            created_at__gte=window_start,
+            created_at__lt=window_end,
+        ).order_by("created_at")
+        for image_id, attributes in images.values_list("id", "attributes"):
+            turn["images"][image_id] = image_description(attributes)
+        history_cache.append_turn(conversation_id, turn)
+
+    transaction.on_commit(append)
+
+
+@receiver(post_save, sender=ImageMessage)
+def update_history_cache_on_image(sender, instance, **kwargs):
+    """Attach, refresh or drop an image description in the cached AI history."""
+    conversation_id = instance.conversation_id
+    image_id = instance.id
+    if instance.is_deleted:
+        transaction.on_commit(
+            lambda: history_cache.remove_image(conversation_id, image_id)
+        )
+        return
+    image_sender = instance.sender
+    created_at = instance.created_at
+    description = image_description(instance.attributes)
+    transaction.on_commit(
+        lambda: history_cache.set_image(
+            conversation_id, image_id, image_sender, created_at, description
+        )
+    )
+
+
+@receiver(post_save, sender=TextMessage)
+@receiver(post_save, sender=ImageMessage)
+@receiver(post_save, sender=MachineParameter)
+@receiver(post_delete, sender=MachineParameter)
+def invalidate_history_page_on_write(sender, instance, **kwargs):
+    """Invalidate the history page bucket a written entry belongs to."""
+    conversation_id = instance.conversation_id
+    created_at = instance.created_at
+    if conversation_id is None or created_at is None:
+        return
+    transaction.on_commit(
+        lambda: invalidate_history_page(conversation_id, created_at)
+    )
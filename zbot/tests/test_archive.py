@@ -0,0 +1,140 @@
+"""
+Tests for the archiving and rehydration of idle conversations.
+"""
+
+import json
+import zlib
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from zbot import models
+from zbot.helpers import archive
+
+
+class RehydrateForReadTests(SimpleTestCase):
+    """Test archived conversations are rehydrated before they are read."""
+
+    def rehydrate_for_read(self, archived):
+        with mock.patch.object(
+            archive.ConversationArchive, "objects"
+        ) as archives, mock.patch.object(
+            archive, "rehydrate_conversation"
+        ) as rehydrate, mock.patch.object(archive, "read_alias", return_value="replica"):
+            archives.using.return_value.filter.return_value.exists.return_value = archived
+            using = archive.rehydrate_for_read("c1")
+        return archives, rehydrate, using
+
+    def test_not_archived(self):
+        """Test the archive is looked up on the read database only."""
+        archives, rehydrate, using = self.rehydrate_for_read(archived=False)
+
+        archives.using.assert_called_once_with("replica")
+        rehydrate.assert_not_called()
+        self.assertIsNone(using)
+
+    def test_archived(self):
+        """Test a rehydrated conversation is read from the primary."""
+        _, rehydrate, using = self.rehydrate_for_read(archived=True)
+
+        rehydrate.assert_called_once_with("c1", None)
+        self.assertEqual(using, "default")
+
+
+class MissingValueTests(SimpleTestCase):
+    """Test the values of columns missing from older archives."""
+
+    def test_attributes_from_metadata(self):
+        """Test the attributes of older image rows are parsed from metadata."""
+        field = models.ImageMessage._meta.get_field("attributes")
+        connection = mock.Mock()
+        connection.ops.adapt_json_value.side_effect = lambda value, encoder: value
+        self.assertEqual(
+            archive._missing_value(
+                field, {"metadata": "description:a gear|utility:heater"}, connection
+            ),
+            {"description": "a gear", "utility": "heater"},
+        )
+        self.assertEqual(archive._missing_value(field, {"metadata": None}, connection), {})
+
+    def test_default(self):
+        """Test other missing columns take their default."""
+        field = models.ImageMessage._meta.get_field("upload_status")
+        self.assertEqual(
+            archive._missing_value(field, {"metadata": "a"}, mock.Mock()), field.get_default()
+        )
+
+
+class ArchiveRoundTripTests(TestCase):
+    """Test archiving an idle conversation and rehydrating it."""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email="archived@example.com", password="testpass123"
+        )
+        self.idle = models.Conversation.objects.create(name="idle", title="t", user=user)
+        self.active = models.Conversation.objects.create(name="active", title="t", user=user)
+        for conversation in (self.idle, self.active):
+            models.TextMessage.objects.create(conversation=conversation, text="hello")
+            models.TextMessage.objects.create(
+                conversation=conversation, text="Check the heater.", sender="ai"
+            )
+            models.ImageMessage.objects.create(
+                conversation=conversation,
+                metadata="description:a gear|utility:heater",
+                attributes={"description": "a gear", "utility": "heater"},
+                variants={"bucket": "zbot-image-input-v1", "thumbnail": "a.thumbnail.jpg"},
+            )
+        old = timezone.now() - timedelta(days=30)
+        for model in (models.Conversation, models.TextMessage, models.ImageMessage):
+            key = "id" if model is models.Conversation else "conversation_id"
+            model.objects.filter(**{key: self.idle.id}).update(updated_at=old)
+        self.cutoff = timezone.now() - timedelta(days=1)
+
+    def rows(self, model):
+        return list(
+            model.objects.filter(conversation=self.idle)
+            .order_by("id")
+            .values(*[field.attname for field in model._meta.concrete_fields])
+        )
+
+    def test_idle_selection(self):
+        """Test only conversations without recent writes or archive are selected."""
+        self.assertEqual(archive.find_idle_conversations(self.cutoff, 10), [self.idle.id])
+        archive.archive_conversation(self.idle.id)
+        self.assertEqual(archive.find_idle_conversations(self.cutoff, 10), [])
+
+    def test_round_trip(self):
+        """Test rehydrated messages keep their IDs, timestamps and JSON columns."""
+        texts, images = self.rows(models.TextMessage), self.rows(models.ImageMessage)
+
+        stored = archive.archive_conversation(self.idle.id)
+        self.assertEqual((stored.text_count, stored.image_count), (2, 1))
+        self.assertEqual(self.rows(models.TextMessage), [])
+        self.assertEqual(self.rows(models.ImageMessage), [])
+
+        self.assertTrue(archive.rehydrate_conversation(self.idle.id))
+        self.assertEqual(self.rows(models.TextMessage), texts)
+        self.assertEqual(self.rows(models.ImageMessage), images)
+        self.assertFalse(
+            models.ConversationArchive.objects.filter(conversation=self.idle).exists()
+        )
+        self.assertFalse(archive.rehydrate_conversation(self.idle.id))
+
+    def test_legacy_payload_attributes(self):
+        """Test archives written before attributes existed get them from metadata."""
+        stored = archive.archive_conversation(self.idle.id)
+        timeline = json.loads(zlib.decompress(bytes(stored.payload)))
+        index = timeline["columns"]["image"].index("attributes")
+        del timeline["columns"]["image"][index]
+        for row in timeline["rows"]["image"]:
+            del row[index]
+        stored.payload = zlib.compress(json.dumps(timeline).encode("utf-8"))
+        stored.save()
+
+        archive.rehydrate_conversation(self.idle.id)
+        image = models.ImageMessage.objects.get(conversation=self.idle)
+        self.assertEqual(image.attributes, {"description": "a gear", "utility": "heater"})
@@ -60,3 +60,25 @@ class ModelTests(TestCase):
             )
             self.assertIs(image_message.conversation, conversation)
             self.assertEqual(image_message.metadata, "test.jpg")
+
+    def test_delete_conversation_soft_deletes_messages(self):
+            """Test deleting a conversation soft deletes it and its messages."""
+            user = get_user_model().objects.create_user(
+                email="ismail@gmail.com",
+                password="test123",
+            )
+            conversation = models.Conversation.objects.create(
+                name="test conversation01",
+                title="test-conversation",
+                user=user,
+            )
+            models.TextMessage.objects.create(conversation=conversation, text="hello")
+            models.ImageMessage.objects.create(conversation=conversation, metadata="a.jpg")
+
+            conversation.delete()
+
+            self.assertFalse(models.Conversation.live.filter(id=conversation.id).exists())
+            self.assertTrue(models.Conversation.deleted.filter(id=conversation.id).exists())
+            self.assertEqual(models.TextMessage.live.filter(conversation=conversation).count(), 0)
+            self.assertEqual(models.ImageMessage.deleted.filter(conversation=conversation).count(), 1)
+            self.assertEqual(models.TextMessage.objects.filter(conversation=conversation).count(), 1)
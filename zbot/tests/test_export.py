@@ -0,0 +1,87 @@
+"""
+Tests for the NDJSON conversation export.
+"""
+
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from core.url_signer import sign_urls
+from zbot.helpers.export import ndjson_chunks
+from zbot.helpers.utils import iter_conversation_timeline
+
+
+def presigned(operation, Params, ExpiresIn):
+    return f"https://signed/{Params['Bucket']}/{Params['Key']}"
+
+
+@override_settings(SIGNED_URLS=True, AWS_S3_ENDPOINT_URL=None)
+class ExportTests(SimpleTestCase):
+    """Test the exported entries."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("zbot.helpers.storage.bucket_storage")
+        bucket_storage = patcher.start()
+        self.addCleanup(patcher.stop)
+        client = bucket_storage.return_value.connection.meta.client
+        client.generate_presigned_url.side_effect = presigned
+
+    def test_image_urls_are_signed_per_batch(self):
+        """Test image entries link presigned URLs, signed a batch at a time."""
+        entries = [
+            {"type": "image", "data": f"https://images.s3.amazonaws.com/v1/{i}.png"}
+            for i in range(3)
+        ] + [{"type": "text", "data": "https://images.s3.amazonaws.com/v1/text.png"}]
+        with mock.patch("core.url_signer.sign_urls", side_effect=sign_urls) as signer:
+            body = b"".join(ndjson_chunks(iter(entries), sign_batch=2))
+
+        lines = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(
+            [line["data"] for line in lines],
+            [
+                "https://signed/images/v1/0.png",
+                "https://signed/images/v1/1.png",
+                "https://signed/images/v1/2.png",
+                # text is left as written
+                "https://images.s3.amazonaws.com/v1/text.png",
+            ],
+        )
+        self.assertEqual(signer.call_count, 2)
+
+
+class TimelineExportTests(SimpleTestCase):
+    """Test the timeline is streamed from a server-side cursor."""
+
+    def test_rows_streamed_in_chunks(self):
+        """Test rows are read as the NDJSON chunks are consumed, oldest first."""
+        read = []
+
+        def rows():
+            for i in range(5):
+                read.append(i)
+                yield (str(i), "text", f"message {i}", None, None, "user", None, None)
+
+        with mock.patch("zbot.helpers.utils.connections") as connections, mock.patch(
+            "zbot.helpers.archive.rehydrate_conversation", return_value=False
+        ):
+            cursor = connections.__getitem__.return_value.chunked_cursor.return_value
+            cursor.__enter__.return_value.__iter__.return_value = rows()
+            chunks = ndjson_chunks(
+                iter_conversation_timeline("c1", using="default"), chunk_size=1, sign_batch=2
+            )
+            first = next(chunks)
+            # a sign batch is read ahead of the chunk it is written to
+            self.assertEqual(read, [0, 1])
+            body = first + b"".join(chunks)
+
+        connections.__getitem__.assert_called_once_with("default")
+        connections.__getitem__.return_value.cursor.assert_not_called()
+        statement = cursor.__enter__.return_value.execute.call_args.args[0]
+        self.assertTrue(statement.endswith("ORDER BY created_at ASC, id ASC;"))
+        self.assertEqual(
+            [json.loads(line)["data"] for line in body.decode().splitlines()],
+            [f"message {i}" for i in range(5)],
+        )
@@ -0,0 +1,174 @@
+"""
+Tests for the AI chat history cache.
+"""
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from zbot.helpers import utils
+from zbot.helpers.history_cache import HistoryCache, bump_shared_version, measure_turn
+from zbot.helpers.utils import history_turn
+
+
+def make_turn(text_id, minute, sender="user", message="hello"):
+    created_at = datetime(2025, 1, 1, 10, minute, 30, tzinfo=timezone.utc)
+    return history_turn(text_id, message, sender, created_at)
+
+
+class HistoryCacheTests(SimpleTestCase):
+    """Test the history cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.cache = HistoryCache(max_entries=2, ttl=60, max_turns=3, stats_every=0)
+
+    def test_miss_then_hit(self):
+        """Test a stored build is served and counted as a hit."""
+        self.assertIsNone(self.cache.get("c1", "chat"))
+        generation = self.cache.generation("c1")
+        self.assertTrue(self.cache.put("c1", "chat", [make_turn(1, 0)], generation))
+
+        turns = self.cache.get("c1", "chat")
+
+        self.assertEqual([turn["id"] for turn in turns], [1])
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_served_turns_are_copies(self):
+        """Test writes do not change turns already handed out."""
+        self.cache.put("c1", "chat", [make_turn(1, 0)], self.cache.generation("c1"))
+        turns = self.cache.get("c1", "chat")
+
+        self.cache.update_text("c1", 1, "edited")
+        self.cache.append_turn("c1", make_turn(2, 1))
+
+        self.assertEqual([turn["message"] for turn in turns], ["hello"])
+        self.assertEqual(
+            [turn["message"] for turn in self.cache.get("c1", "chat")], ["edited", "hello"]
+        )
+
+    def test_build_discarded_after_concurrent_write(self):
+        """Test a cold build is not stored when the conversation was written."""
+        generation = self.cache.generation("c1")
+        self.cache.invalidate("c1")
+
+        self.assertFalse(self.cache.put("c1", "chat", [make_turn(1, 0)], generation))
+        self.assertIsNone(self.cache.get("c1", "chat"))
+
+    def test_write_of_another_process(self):
+        """Test an entry is dropped once another process wrote the conversation."""
+        self.cache.put("c1", "chat", [make_turn(1, 0)], self.cache.generation("c1"))
+        self.cache.put("c2", "chat", [make_turn(1, 0)], self.cache.generation("c2"))
+        bump_shared_version("c1")
+
+        self.assertIsNone(self.cache.get("c1", "chat"))
+        self.assertIsNotNone(self.cache.get("c2", "chat"))
+
+    def test_update_after_write_of_another_process(self):
+        """Test a local write does not patch an entry missing another write."""
+        self.cache.put("c1", "chat", [make_turn(1, 0)], self.cache.generation("c1"))
+        bump_shared_version("c1")
+        self.cache.append_turn("c1", make_turn(3, 2))
+
+        self.assertFalse(self.cache.is_cached("c1"))
+
+    def test_local_writes_keep_the_entry(self):
+        """Test writes of this process update the entry in place."""
+        self.cache.put("c1", "chat", [make_turn(1, 0)], self.cache.generation("c1"))
+        self.cache.append_turn("c1", make_turn(2, 1))
+        self.cache.update_text("c1", 1, "edited")
+
+        turns = self.cache.get("c1", "chat")
+        self.assertEqual([turn["message"] for turn in turns], ["edited", "hello"])
+
+    def test_append_keeps_latest_turns(self):
+        """Test appended turns update every mode and stay bounded."""
+        for mode in ("chat", "ops"):
+            self.cache.put("c1", mode, [make_turn(1, 0)], self.cache.generation("c1"))
+
+        for text_id in (2, 3, 4):
+            self.cache.append_turn("c1", make_turn(text_id, text_id))
+
+        for mode in ("chat", "ops"):
+            turns = self.cache.get("c1", mode)
+            self.assertEqual([turn["id"] for turn in turns], [2, 3, 4])
+
+    def test_image_attached_to_matching_turn(self):
+        """Test image descriptions follow the sender and creation window."""
+        turns = [make_turn(1, 0, sender="user"), make_turn(2, 10, sender="ai")]
+        self.cache.put("c1", "chat", turns, self.cache.generation("c1"))
+        created_at = datetime(2025, 1, 1, 10, 11, tzinfo=timezone.utc)
+
+        self.cache.set_image("c1", 7, "ai", created_at, "alarm screen")
+        turns = self.cache.get("c1", "chat")
+        self.assertEqual(turns[0]["images"], {})
+        self.assertEqual(turns[1]["images"], {7: "alarm screen"})
+
+        self.cache.remove_image("c1", 7)
+        self.assertEqual(self.cache.get("c1", "chat")[1]["images"], {})
+
+    def test_lru_eviction(self):
+        """Test the least recently used conversation is evicted first."""
+        for conversation_id in ("c1", "c2"):
+            self.cache.put(
+                conversation_id,
+                "chat",
+                [make_turn(1, 0)],
+                self.cache.generation(conversation_id),
+            )
+        self.cache.get("c1", "chat")
+        self.cache.put("c3", "chat", [make_turn(1, 0)], self.cache.generation("c3"))
+
+        self.assertIsNotNone(self.cache.get("c1", "chat"))
+        self.assertIsNone(self.cache.get("c2", "chat"))
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+
+class HistoryWindowTests(SimpleTestCase):
+    """Test the token-budgeted history window."""
+
+    def make_turns(self, *lengths):
+        return [
+            measure_turn(make_turn(i, i, message="x" * length))
+            for i, length in enumerate(lengths)
+        ]
+
+    def test_window_within_budget(self):
+        """Test every turn is sent when the budget allows it."""
+        with patch.dict(utils.AI_HISTORY_BUDGETS, {"chat": 1000}):
+            window, metrics = utils.build_history_window(
+                self.make_turns(400, 400), None, "chat"
+            )
+
+        self.assertEqual(len(window), 2)
+        self.assertEqual(metrics["estimated_tokens"], 200)
+        self.assertFalse(metrics["truncated"])
+
+    def test_oldest_turns_dropped_first(self):
+        """Test old turns are dropped and the crossing turn is truncated."""
+        turns = self.make_turns(4000, 4000, 400, 400)
+        with patch.dict(utils.AI_HISTORY_BUDGETS, {"chat": 500}):
+            window, metrics = utils.build_history_window(turns, None, "chat")
+
+        self.assertEqual(metrics["turns_available"], 4)
+        self.assertEqual(metrics["turns_sent"], 3)
+        self.assertTrue(metrics["truncated"])
+        self.assertEqual(window[1:], [
+            {"role": "user", "message": "x" * 400, "imageDescription": []},
+        ] * 2)
+        self.assertLess(len(window[0]["message"]), 4000)
+
+    def test_query_excluded_and_latest_turn_kept(self):
+        """Test the current query is skipped and the latest turn always sent."""
+        turns = self.make_turns(100, 40000, 100)
+        with patch.dict(utils.AI_HISTORY_BUDGETS, {"ops": 10}):
+            window, metrics = utils.build_history_window(turns, 2, "ops")
+
+        self.assertEqual(metrics["turns_sent"], 1)
+        self.assertNotIn("imageDescription", window[0])
+        self.assertTrue(window[0]["message"].endswith("..."))
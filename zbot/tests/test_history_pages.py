@@ -0,0 +1,93 @@
+"""
+Tests for the bucketed conversation history pages.
+"""
+
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from zbot.helpers import history_pages
+
+
+OLD_ENTRY = datetime(2024, 5, 1, 8, 30, tzinfo=timezone.utc)
+
+
+@override_settings(SHARED_CACHE=True)
+@patch("zbot.helpers.history_pages.get_latest_timeline_entry", return_value=None)
+@patch("zbot.helpers.history_pages.get_timeline_range")
+class HistoryPageTests(SimpleTestCase):
+    """Test history page caching."""
+
+    def setUp(self):
+        cache.clear()
+        patcher = patch(
+            "zbot.helpers.history_pages.rehydrate_for_read", return_value=None
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = history_pages.bucket_of(OLD_ENTRY)
+
+    def test_historical_page_is_cached(self, patched_range, patched_latest):
+        """Test a historical bucket is served from cache with a stable ETag."""
+        patched_range.return_value = [{"id": "1", "created_at": OLD_ENTRY}]
+
+        body, etag, immutable = history_pages.get_history_page("c1", self.bucket)
+        cached_body, cached_etag, _ = history_pages.get_history_page("c1", self.bucket)
+
+        self.assertTrue(immutable)
+        self.assertEqual(patched_range.call_count, 1)
+        self.assertEqual((body, etag), (cached_body, cached_etag))
+        self.assertTrue(etag.startswith('"'))
+
+    def test_invalidation_only_touches_its_bucket(self, patched_range, patched_latest):
+        """Test a write only invalidates the bucket it falls in."""
+        patched_range.return_value = []
+        history_pages.get_history_page("c1", self.bucket)
+        history_pages.get_history_page("c1", self.bucket - 1)
+
+        history_pages.invalidate_history_page("c1", OLD_ENTRY)
+        history_pages.get_history_page("c1", self.bucket)
+        history_pages.get_history_page("c1", self.bucket - 1)
+
+        self.assertEqual(patched_range.call_count, 3)
+
+    def test_not_cached_without_a_shared_cache(self, patched_range, patched_latest):
+        """Test pages are built every time when workers do not share the cache."""
+        patched_range.return_value = [{"id": "1", "created_at": OLD_ENTRY}]
+        with self.settings(SHARED_CACHE=False):
+            first = history_pages.get_history_page("c1", self.bucket)
+            second = history_pages.get_history_page("c1", self.bucket)
+
+        self.assertEqual(patched_range.call_count, 2)
+        self.assertEqual(first, second)
+
+    def test_rehydrated_page_read_from_the_primary(self, patched_range, patched_latest):
+        """Test a rehydrated conversation is not read from a lagging replica."""
+        patched_range.return_value = []
+        with patch(
+            "zbot.helpers.history_pages.rehydrate_for_read", return_value="default"
+        ):
+            history_pages.get_history_page("c1")
+
+        self.assertEqual(patched_range.call_args.kwargs["using"], "default")
+        for call in patched_latest.call_args_list:
+            self.assertEqual(call.kwargs["using"], "default")
+
+    def test_versions_outlive_pages(self, patched_range, patched_latest):
+        """Test page versions expire, after the pages keyed by them."""
+        patched_range.return_value = []
+        with patch("zbot.helpers.history_pages.cache") as patched_cache:
+            patched_cache.get.return_value = None
+            history_pages.get_history_page("c1", self.bucket)
+            history_pages.invalidate_history_page("c1", OLD_ENTRY)
+
+        timeouts = [
+            call.kwargs["timeout"]
+            for call in patched_cache.add.call_args_list + patched_cache.set.call_args_list
+            if call.args[0].startswith("zbot:history-page-version:")
+        ]
+        self.assertEqual(len(timeouts), 3)
+        for timeout in timeouts:
+            self.assertGreater(timeout, history_pages.HISTORICAL_PAGE_TTL)
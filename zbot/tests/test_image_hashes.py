@@ -0,0 +1,112 @@
+"""
+Tests for the content hashes of uploaded images.
+"""
+
+import hashlib
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+
+from zbot.helpers.image_hashes import (
+    agent_image_query,
+    cached_description,
+    hash_bytes,
+    hash_file,
+    hashed_image_key,
+    remember_description,
+)
+
+
+CONTENT_HASH = hashlib.sha256(b"photo").hexdigest()
+
+
+class ImageHashTests(SimpleTestCase):
+    """Test image content hashes."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hash_file(self):
+        """Test a file hashes like its bytes and is left rewound."""
+        upload = SimpleUploadedFile("photo.jpg", b"photo")
+        upload.read()
+        self.assertEqual(hash_file(upload), CONTENT_HASH)
+        self.assertEqual(hash_bytes(b"photo"), CONTENT_HASH)
+        self.assertEqual(upload.read(), b"photo")
+
+    def test_hashed_image_key(self):
+        """Test the same content gets the same key, whatever its name."""
+        self.assertEqual(
+            hashed_image_key(CONTENT_HASH, "IMG_0001.JPG"),
+            f"v1/static/media/sha256/{CONTENT_HASH}.jpg",
+        )
+        self.assertEqual(
+            hashed_image_key(CONTENT_HASH, "IMG_0001.JPG"),
+            hashed_image_key(CONTENT_HASH, "copy.jpg"),
+        )
+
+    def test_description_cached(self):
+        """Test a remembered description is read without a query."""
+        remember_description(CONTENT_HASH, "description:a red square", 1)
+        with mock.patch("zbot.models.ImageMessage.objects") as objects:
+            self.assertEqual(
+                cached_description(CONTENT_HASH, 1), "description:a red square"
+            )
+            self.assertIsNone(cached_description("", 1))
+        objects.using.return_value.filter.assert_not_called()
+
+    def test_description_of_another_user(self):
+        """Test descriptions are not shared between users."""
+        remember_description(CONTENT_HASH, "description:a red square", 1)
+        with mock.patch("zbot.models.ImageMessage.objects") as objects:
+            queryset = objects.using.return_value.filter.return_value.exclude
+            queryset.return_value.order_by.return_value.values_list.return_value.first.return_value = None
+            self.assertIsNone(cached_description(CONTENT_HASH, 2))
+        objects.using.return_value.filter.assert_called_once_with(
+            content_hash=CONTENT_HASH,
+            conversation__user_id=2,
+            sender="user",
+            attributes__has_key="description",
+        )
+
+    def test_description_from_earlier_message(self):
+        """Test a description not cached is read from an earlier message once."""
+        with mock.patch("zbot.models.ImageMessage.objects") as objects:
+            queryset = objects.using.return_value.filter.return_value.exclude
+            queryset.return_value.order_by.return_value.values_list.return_value.first.return_value = (
+                "description:a red square"
+            )
+            self.assertEqual(
+                cached_description(CONTENT_HASH, 1), "description:a red square"
+            )
+            self.assertEqual(
+                cached_description(CONTENT_HASH, 1), "description:a red square"
+            )
+        objects.using.return_value.filter.assert_called_once_with(
+            content_hash=CONTENT_HASH,
+            conversation__user_id=1,
+            sender="user",
+            attributes__has_key="description",
+        )
+
+    def test_agent_image_query(self):
+        """Test the agent gets the description of an image seen before."""
+        remember_description(CONTENT_HASH, "description:a red square", 1)
+        image_message = SimpleNamespace(
+            content_hash=CONTENT_HASH,
+            variants={"bucket": "images", "analysis": "a.analysis.jpg"},
+        )
+        self.assertEqual(
+            agent_image_query(image_message, None, 1),
+            {
+                "bucket": "images",
+                "key": "a.analysis.jpg",
+                "imageDescription": "description:a red square",
+            },
+        )
+
+        image_message.content_hash = ""
+        self.assertNotIn("imageDescription", agent_image_query(image_message, None, 1))
@@ -0,0 +1,56 @@
+"""
+Tests for the structured attributes of image messages.
+"""
+
+from django.test import SimpleTestCase
+
+from zbot.helpers.utils import image_description, parse_legacy_metadata
+from zbot.serializers import ConversationImageMessageSerializer
+
+
+class ImageMetadataTests(SimpleTestCase):
+    """Test the conversion of legacy metadata strings to attributes."""
+
+    def test_ai_image_metadata(self):
+        """Test descriptions keep their colons and pipes."""
+        self.assertEqual(
+            parse_legacy_metadata("description:ratio 1:2 | top view|utility:cutting"),
+            {"description": "ratio 1:2 | top view", "utility": "cutting"},
+        )
+        self.assertEqual(
+            parse_legacy_metadata("description:a red square"),
+            {"description": "a red square"},
+        )
+
+    def test_similarity_search_metadata(self):
+        """Test markdown sections become one attribute each."""
+        self.assertEqual(
+            parse_legacy_metadata("### description\na gear\n\n### utility\ndrive\n"),
+            {"description": "a gear", "utility": "drive"},
+        )
+
+    def test_user_image_metadata(self):
+        """Test a plain string is the description."""
+        self.assertEqual(
+            parse_legacy_metadata("a photo: worn belt"), {"description": "a photo: worn belt"}
+        )
+        self.assertEqual(parse_legacy_metadata(""), {})
+        self.assertEqual(parse_legacy_metadata(None), {})
+
+    def test_image_description(self):
+        """Test the description is read from the attributes."""
+        self.assertEqual(image_description({"description": "a gear"}), "a gear")
+        self.assertEqual(image_description({"utility": "drive"}), "")
+        self.assertEqual(image_description(None), "")
+
+    def test_serializer_dual_writes(self):
+        """Test metadata written through the API also sets the attributes."""
+        serializer = ConversationImageMessageSerializer()
+        self.assertEqual(
+            serializer.validate({"metadata": "description:a gear|utility:drive"}),
+            {
+                "metadata": "description:a gear|utility:drive",
+                "attributes": {"description": "a gear", "utility": "drive"},
+            },
+        )
+        self.assertEqual(serializer.validate({"top_k": 3}), {"top_k": 3})
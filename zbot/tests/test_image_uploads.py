@@ -0,0 +1,223 @@
+"""
+Tests for the images uploaded in the background.
+"""
+
+import io
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from zbot.helpers.image_hashes import hash_bytes
+from zbot.helpers.image_uploads import (
+    process_upload,
+    ready_image,
+    settle_stale_uploads,
+    store_image,
+)
+from zbot.models import ImageMessage
+
+
+def photo():
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 200), "red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def pending_image(statuses):
+    """Returns a pending image message reading `statuses` from the database."""
+    image_message = ImageMessage(id=1, upload_status=ImageMessage.PENDING)
+
+    def refresh_from_db(using=None, fields=None):
+        image_message.upload_status = statuses.pop(0)
+
+    image_message.refresh_from_db = mock.Mock(side_effect=refresh_from_db)
+    return image_message
+
+
+@override_settings(
+    IMAGE_PIPELINE_WORKERS=0, IMAGE_ANALYSIS_MAX_SIDE=100, IMAGE_THUMBNAIL_MAX_SIDE=20
+)
+class StoreImageTests(SimpleTestCase):
+    """Test the upload pool stores images."""
+
+    def setUp(self):
+        patcher = mock.patch("zbot.models.ImageMessage.objects")
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+        messages = self.objects.using.return_value.filter.return_value
+        self.update = messages.update
+        messages.values_list.return_value = [("c1", datetime(2024, 5, 1, tzinfo=timezone.utc))]
+        patcher = mock.patch("zbot.helpers.image_uploads.invalidate_history_page")
+        self.invalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_store_image(self):
+        """Test the file and its variants are stored and the image is ready."""
+        storage = InMemoryStorage()
+        store_image(1, "default", storage, "media/a.jpg", photo())
+
+        self.assertTrue(storage.exists("media/a.jpg"))
+        self.objects.using.assert_called_once_with("default")
+        update = self.update.call_args.kwargs
+        self.assertEqual(update["upload_status"], ImageMessage.READY)
+        self.assertEqual(update["variants"]["analysis"], "media/a.analysis.jpg")
+        # pages cached while the image was pending are rebuilt
+        self.invalidate.assert_called_once_with(
+            "c1", datetime(2024, 5, 1, tzinfo=timezone.utc)
+        )
+        self.assertTrue(storage.exists(update["variants"]["thumbnail"]))
+
+    def test_reused_variants(self):
+        """Test variants of an earlier upload are not rendered again."""
+        storage = InMemoryStorage()
+        variants = {"bucket": None, "analysis": "b.analysis.jpg"}
+        store_image(1, "default", storage, "media/a.jpg", photo(), variants)
+
+        self.assertEqual(self.update.call_args.kwargs["variants"], variants)
+        self.assertFalse(storage.exists("media/a.analysis.jpg"))
+
+    def test_failed(self):
+        """Test an image that cannot be stored is marked failed."""
+        storage = mock.Mock()
+        storage.exists.return_value = False
+        storage.save.side_effect = OSError("unreachable")
+        store_image(1, "default", storage, "media/a.jpg", photo())
+
+        self.assertEqual(
+            self.update.call_args.kwargs["upload_status"], ImageMessage.FAILED
+        )
+
+
+@mock.patch("zbot.helpers.image_uploads.READY_POLL_INTERVAL", 0)
+class ReadyImageTests(SimpleTestCase):
+    """Test the agent waits for images uploaded in the background."""
+
+    def test_ready(self):
+        """Test images not pending are not read again."""
+        image_message = ImageMessage(id=1)
+        image_message.refresh_from_db = mock.Mock()
+        self.assertIs(ready_image(image_message), image_message)
+        image_message.refresh_from_db.assert_not_called()
+        self.assertIsNone(ready_image(None))
+
+    def test_waits_until_ready(self):
+        """Test a pending image is read until it is stored."""
+        image_message = pending_image(
+            [ImageMessage.PENDING, ImageMessage.PENDING, ImageMessage.READY]
+        )
+        ready_image(image_message, timeout=5)
+        self.assertEqual(image_message.upload_status, ImageMessage.READY)
+        self.assertEqual(image_message.refresh_from_db.call_count, 3)
+
+    def test_timeout(self):
+        """Test the wait gives up after the timeout."""
+        image_message = pending_image([ImageMessage.PENDING] * 2)
+        ready_image(image_message, timeout=0)
+        self.assertEqual(image_message.upload_status, ImageMessage.PENDING)
+        self.assertEqual(image_message.refresh_from_db.call_count, 1)
+
+    def test_stored_before_timeout(self):
+        """Test an image whose file is stored is ready once the wait gives up."""
+        image_message = pending_image([ImageMessage.PENDING])
+        image_message.image_url = "https://zbot-image-input-v1.s3.amazonaws.com/media/a.jpg"
+        with mock.patch("zbot.helpers.image_uploads.variant_storage") as storage:
+            storage.return_value.exists.return_value = True
+            ready_image(image_message, timeout=0)
+
+        storage.assert_called_once_with("zbot-image-input-v1")
+        storage.return_value.exists.assert_called_once_with("media/a.jpg")
+        self.assertEqual(image_message.upload_status, ImageMessage.READY)
+
+
+class SettleStaleUploadsTests(SimpleTestCase):
+    """Test image messages left pending by a stopped process are settled."""
+
+    def test_settle(self):
+        """Test stale messages are ready if their file is stored, failed otherwise."""
+        stored = ImageMessage(
+            id=1, image_url="https://zbot-image-input-v1.s3.amazonaws.com/media/a.jpg"
+        )
+        lost = ImageMessage(
+            id=2, image_url="https://zbot-image-input-v1.s3.amazonaws.com/media/b.jpg"
+        )
+        cutoff = datetime(2024, 5, 1, tzinfo=timezone.utc)
+        with mock.patch("zbot.models.ImageMessage.objects") as objects, mock.patch(
+            "zbot.helpers.image_uploads.variant_storage"
+        ) as storage, mock.patch("zbot.helpers.image_uploads._update") as update:
+            stale = objects.using.return_value.filter.return_value
+            stale.filter.return_value.order_by.return_value.__getitem__.side_effect = [
+                [stored, lost],
+                [],
+            ]
+            storage.return_value.exists.side_effect = lambda key: key == "media/a.jpg"
+            self.assertEqual(settle_stale_uploads(cutoff, 2, "default"), (1, 1))
+
+        objects.using.assert_called_once_with("default")
+        objects.using.return_value.filter.assert_called_once_with(
+            upload_status=ImageMessage.PENDING, updated_at__lt=cutoff
+        )
+        stale.filter.assert_any_call(pk__gt=2)
+        stale.filter.assert_any_call(pk__in=[1])
+        stale.filter.assert_any_call(pk__in=[2])
+        self.assertEqual(
+            [call.kwargs["upload_status"] for call in update.call_args_list],
+            [ImageMessage.READY, ImageMessage.FAILED],
+        )
+
+
+@override_settings(
+    IMAGE_PIPELINE_WORKERS=0, IMAGE_ANALYSIS_MAX_SIDE=100, IMAGE_THUMBNAIL_MAX_SIDE=20
+)
+class ProcessUploadTests(SimpleTestCase):
+    """Test the upload pool processes images uploaded straight to storage."""
+
+    def setUp(self):
+        patcher = mock.patch("zbot.models.ImageMessage.objects")
+        self.objects = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.messages = self.objects.using.return_value.filter.return_value
+        self.messages.values_list.return_value = []
+        self.storage = InMemoryStorage()
+        self.storage.save("uploads/a.jpg", ContentFile(photo()))
+
+    def process(self, source=None, description=None, describe=False):
+        with mock.patch(
+            "zbot.helpers.image_hashes.reusable_image", return_value=source
+        ) as reusable, mock.patch(
+            "zbot.helpers.image_hashes.cached_description", return_value=description
+        ):
+            process_upload(1, "default", self.storage, "uploads/a.jpg", 7, describe)
+        return reusable, self.messages.update.call_args.kwargs
+
+    def test_process_upload(self):
+        """Test the file is hashed, its variants rendered and the image ready."""
+        reusable, update = self.process()
+
+        reusable.assert_called_once_with(hash_bytes(photo()), 7, "default")
+        self.assertEqual(update["upload_status"], ImageMessage.READY)
+        self.assertEqual(update["content_hash"], hash_bytes(photo()))
+        self.assertTrue(self.storage.exists(update["variants"]["thumbnail"]))
+        self.assertNotIn("metadata", update)
+
+    def test_reused_variants_and_description(self):
+        """Test an earlier upload of the user lends its variants and description."""
+        source = ImageMessage(variants={"bucket": None, "analysis": "b.analysis.jpg"})
+        _, update = self.process(source, "description:a gear", describe=True)
+
+        self.assertEqual(update["variants"], source.variants)
+        self.assertFalse(self.storage.exists("uploads/a.analysis.jpg"))
+        self.assertEqual(update["metadata"], "description:a gear")
+        self.messages.filter.assert_called_once_with(attributes={})
+        self.messages.filter.return_value.update.assert_called_once_with(
+            attributes={"description": "a gear"}
+        )
+
+    def test_missing_file(self):
+        """Test an upload whose file cannot be read is marked failed."""
+        self.storage.delete("uploads/a.jpg")
+        _, update = self.process()
+        self.assertEqual(update["upload_status"], ImageMessage.FAILED)
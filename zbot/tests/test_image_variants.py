@@ -0,0 +1,158 @@
+"""
+Tests for the image variants rendered at upload time.
+"""
+
+import io
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.files.storage import InMemoryStorage
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from zbot.helpers.image_variants import (
+    analysis_image_location,
+    create_variants,
+    ensure_variants,
+    render_variants,
+    variant_key,
+    variant_source,
+)
+from zbot.helpers.utils import decode_timeline_row
+
+
+def photo(width=400, height=200, orientation=None):
+    """Returns a JPEG, with an EXIF orientation tag if given."""
+    image = Image.new("RGB", (width, height), "red")
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def size_of(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+@override_settings(
+    IMAGE_PIPELINE_WORKERS=0,
+    IMAGE_ANALYSIS_MAX_SIDE=100,
+    IMAGE_MEDIUM_MAX_SIDE=50,
+    IMAGE_THUMBNAIL_MAX_SIDE=20,
+)
+class ImageVariantTests(SimpleTestCase):
+    """Test image variants."""
+
+    def test_render_variants(self):
+        """Test variants are shrunk to their longest side and rotated upright."""
+        variants = render_variants(photo(orientation=6), {"small": (50, 80)})
+
+        # orientation 6 is a photo taken rotated by 90 degrees
+        self.assertEqual(size_of(variants["small"]), (25, 50))
+
+    def test_small_images_are_not_enlarged(self):
+        """Test an image smaller than a variant keeps its size."""
+        variants = render_variants(photo(40, 20), {"large": (100, 80)})
+
+        self.assertEqual(size_of(variants["large"]), (40, 20))
+
+    def test_create_variants(self):
+        """Test variants are stored next to the original."""
+        storage = InMemoryStorage()
+        key = storage.save("v1/static/media/a_photo.png", io.BytesIO(photo()))
+
+        variants = create_variants(storage, key)
+
+        self.assertEqual(variants["analysis"], "v1/static/media/a_photo.analysis.jpg")
+        self.assertEqual(variants["thumbnail"], variant_key(key, "thumbnail"))
+        with storage.open(variants["analysis"]) as analysis:
+            self.assertEqual(size_of(analysis.read()), (100, 50))
+        with storage.open(variants["thumbnail"]) as thumbnail:
+            self.assertEqual(size_of(thumbnail.read()), (20, 10))
+
+    def test_undecodable_image_has_no_variants(self):
+        """Test an image Pillow cannot decode keeps its original only."""
+        self.assertEqual(create_variants(InMemoryStorage(), "a.heic", b"not an image"), {})
+
+    def test_analysis_image_location(self):
+        """Test the agent reads the analysis variant when there is one."""
+        url = "https://images.s3.amazonaws.com/v1/a.png"
+        with_variants = SimpleNamespace(
+            variants={"bucket": "images", "analysis": "v1/a.analysis.jpg"}
+        )
+
+        self.assertEqual(
+            analysis_image_location(with_variants, url),
+            {"bucket": "images", "key": "v1/a.analysis.jpg"},
+        )
+        self.assertEqual(
+            analysis_image_location(SimpleNamespace(variants={}), url),
+            {"bucket": "images", "key": "v1/a.png"},
+        )
+        self.assertEqual(
+            analysis_image_location(None, url), {"bucket": "images", "key": "v1/a.png"}
+        )
+
+    def test_variant_source(self):
+        """Test missing variants are rendered from the analysis variant first."""
+        self.assertEqual(
+            variant_source(
+                SimpleNamespace(
+                    variants={"bucket": "images", "analysis": "v1/a.analysis.jpg"},
+                    image_url="https://images.s3.amazonaws.com/v1/a.png",
+                )
+            ),
+            ("images", "v1/a.analysis.jpg"),
+        )
+        self.assertEqual(
+            variant_source(
+                SimpleNamespace(
+                    variants={},
+                    image_url="https://images.s3.amazonaws.com/v1/a.png?X-Amz-Signature=s",
+                )
+            ),
+            ("images", "v1/a.png"),
+        )
+        self.assertIsNone(variant_source(SimpleNamespace(variants={}, image_url=None)))
+
+    @mock.patch("zbot.models.ImageMessage.objects")
+    def test_ensure_variants(self, objects):
+        """Test only the missing variants are rendered, and saved once."""
+        storage = InMemoryStorage()
+        key = storage.save("v1/a.analysis.jpg", io.BytesIO(photo()))
+        image_message = SimpleNamespace(
+            pk=1,
+            variants={"bucket": None, "analysis": key, "thumbnail": "v1/a.thumbnail.jpg"},
+            image_url=None,
+        )
+
+        with mock.patch(
+            "zbot.helpers.image_variants.variant_storage", return_value=storage
+        ):
+            variants = ensure_variants(image_message, using="default")
+            ensure_variants(image_message, using="default")
+
+        self.assertEqual(variants["thumbnail"], "v1/a.thumbnail.jpg")
+        with storage.open(variants["medium"]) as medium:
+            self.assertEqual(size_of(medium.read()), (50, 25))
+        objects.using.return_value.filter.return_value.update.assert_called_once_with(
+            variants=variants
+        )
+
+    def test_history_variant_urls(self):
+        """Test image history entries link their display variants."""
+        conversation_id = "6f1c2b1e-5d4a-4c3b-9a8f-7e6d5c4b3a21"
+        row = ("7", "image", "https://images.s3.amazonaws.com/v1/a.png", None, None,
+               "user", None, None)
+
+        entry = decode_timeline_row(row, conversation_id)
+
+        self.assertEqual(
+            entry["variants"]["thumbnail"],
+            f"/api/conversations/{conversation_id}/imageMessages/7/variants/thumbnail/",
+        )
+        self.assertEqual(set(entry["variants"]), {"thumbnail", "medium", "original"})
+        self.assertNotIn("variants", decode_timeline_row(row))
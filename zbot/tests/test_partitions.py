@@ -0,0 +1,135 @@
+"""
+Tests for the conversion of message tables to partitioned tables.
+"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from zbot.helpers import partitions
+from zbot.models import MachineParameter, TextMessage
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def executed(connections):
+    """Returns the (statement, params) executed on a mocked connection."""
+    cursor = connections.__getitem__.return_value.cursor.return_value.__enter__.return_value
+    return [
+        (str(call.args[0]), call.args[1] if len(call.args) > 1 else None)
+        for call in cursor.execute.call_args_list
+    ]
+
+
+class ConvertTableTests(SimpleTestCase):
+    """Test the statements converting a table."""
+
+    def convert(self, model, latest=None, months_ahead=2):
+        with mock.patch.object(partitions, "connections") as connections, mock.patch.object(
+            partitions, "transaction"
+        ):
+            cursor = connections.__getitem__.return_value.cursor.return_value.__enter__
+            # identity, serial sequence, latest row, next id
+            cursor.return_value.fetchone.side_effect = [[False], [None], [latest], [1]]
+            until = partitions.convert_table(model, "shard1", months_ahead)
+        return until, executed(connections)
+
+    def statements(self, model):
+        return [statement for statement, _ in self.convert(model)[1]]
+
+    def test_foreign_keys_without_constraint(self):
+        """Test machines and materials, not on the shards, get no constraint."""
+        foreign_keys = [
+            statement
+            for statement in self.statements(MachineParameter)
+            if "FOREIGN KEY" in statement
+        ]
+        self.assertEqual(len(foreign_keys), 1)
+        self.assertIn("FOREIGN KEY (conversation_id)", foreign_keys[0])
+
+    def test_legacy_bound_after_latest_row(self):
+        """Test the legacy partition ends after the month of its latest row."""
+        until, statements = self.convert(MachineParameter, latest=utc(2024, 3, 15, 10))
+        self.assertEqual(until, utc(2024, 4, 1))
+
+        bounds = {statement.split()[2]: params for statement, params in statements if params}
+        self.assertEqual(bounds["zbot_machineparameter_legacy"], [utc(2024, 4, 1)])
+        attach = [params for statement, params in statements if "ATTACH PARTITION" in statement]
+        self.assertEqual(attach, [[utc(2024, 4, 1)]])
+
+    def test_empty_table_bound(self):
+        """Test an empty table is bounded after the current month."""
+        until, _ = self.convert(MachineParameter)
+        this_month = partitions.month_start(datetime.now(timezone.utc))
+        self.assertEqual(until, partitions.next_month(this_month))
+
+    def test_monthly_partitions_before_default(self):
+        """Test the first monthly partitions are created before the default one."""
+        _, statements = self.convert(MachineParameter, latest=utc(2024, 12, 2))
+        created = [
+            (statement.split()[2], params)
+            for statement, params in statements
+            if statement.startswith("CREATE TABLE") and "PARTITION OF" in statement
+        ]
+        self.assertEqual(
+            created,
+            [
+                ("zbot_machineparameter_y2025m01", [utc(2025, 1, 1), utc(2025, 2, 1)]),
+                ("zbot_machineparameter_y2025m02", [utc(2025, 2, 1), utc(2025, 3, 1)]),
+                ("zbot_machineparameter_default", None),
+            ],
+        )
+
+
+class CreatePartitionTests(SimpleTestCase):
+    """Test the monthly partitions created after the conversion."""
+
+    def create(self, start, existing):
+        with mock.patch.object(partitions, "connections") as connections, mock.patch.object(
+            partitions, "list_partitions", return_value=existing
+        ):
+            created = partitions.create_partition(TextMessage, start, "shard1")
+        return created, executed(connections)
+
+    def test_create(self):
+        """Test a month past the legacy partition is created with its bounds."""
+        created, statements = self.create(
+            utc(2024, 5, 1), [("zbot_textmessage_legacy", "", utc(2024, 4, 1), 10)]
+        )
+        self.assertTrue(created)
+        self.assertEqual(len(statements), 1)
+        self.assertIn("zbot_textmessage_y2024m05 PARTITION OF zbot_textmessage", statements[0][0])
+        self.assertEqual(statements[0][1], [utc(2024, 5, 1), utc(2024, 6, 1)])
+
+    def test_covered_months_skipped(self):
+        """Test months held by the legacy partition or created are skipped."""
+        existing = [
+            ("zbot_textmessage_legacy", "", utc(2024, 4, 1), 10),
+            ("zbot_textmessage_y2024m04", "", utc(2024, 5, 1), 0),
+        ]
+        self.assertEqual(self.create(utc(2024, 3, 1), existing), (False, []))
+        self.assertEqual(self.create(utc(2024, 4, 1), existing), (False, []))
+
+
+class DetachPartitionTests(SimpleTestCase):
+    """Test the statements detaching a partition."""
+
+    def detach(self, drop):
+        with mock.patch.object(partitions, "connections") as connections, mock.patch.object(
+            partitions, "transaction"
+        ):
+            partitions.detach_partition(TextMessage, "zbot_textmessage_y2024m01", drop, "shard1")
+        return [statement for statement, _ in executed(connections)]
+
+    def test_detach(self):
+        """Test a detached partition is kept as a table unless dropped."""
+        self.assertEqual(
+            self.detach(drop=False),
+            ["ALTER TABLE zbot_textmessage DETACH PARTITION zbot_textmessage_y2024m01;"],
+        )
+        self.assertEqual(
+            self.detach(drop=True)[1:], ["DROP TABLE zbot_textmessage_y2024m01;"]
+        )
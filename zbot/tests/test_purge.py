@@ -0,0 +1,91 @@
+"""
+Tests for the S3 files deleted with purged image messages.
+"""
+
+import hashlib
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from zbot.helpers.image_hashes import hashed_image_key
+from zbot.helpers.purge import image_keys, message_keys, unshared_keys
+
+
+CONTENT_HASH = hashlib.sha256(b"photo").hexdigest()
+
+
+def upload_image_row():
+    """Returns (image, image_url, variants) as upload_image saves them."""
+    key = hashed_image_key(CONTENT_HASH, "IMG_0001.jpg")
+    return (
+        "IMG_0001.jpg",
+        f"https://zbot-image-input-v1.s3.amazonaws.com/{key}",
+        {
+            "bucket": "zbot-image-input-v1",
+            "analysis": f"{key[:-4]}.analysis.jpg",
+            "thumbnail": f"{key[:-4]}.thumbnail.jpg",
+        },
+    )
+
+
+class PurgeKeysTests(SimpleTestCase):
+    """Test the keys of purged image messages."""
+
+    def test_upload_image_keys(self):
+        """Test the object key is read from image_url, not the file name."""
+        key = hashed_image_key(CONTENT_HASH, "IMG_0001.jpg")
+        self.assertEqual(
+            message_keys(*upload_image_row()),
+            {key, f"{key[:-4]}.analysis.jpg", f"{key[:-4]}.thumbnail.jpg"},
+        )
+
+    def test_finalized_upload_keys(self):
+        """Test direct uploads, whose key is in image, and JSON text variants."""
+        self.assertEqual(
+            message_keys("v1/static/media/a.png", None, '{"bucket": null, "medium": "m.jpg"}'),
+            {"v1/static/media/a.png", "m.jpg"},
+        )
+        self.assertEqual(
+            message_keys(
+                "a.png", "https://zbot-image-input-v1.s3.amazonaws.com/v1/a%20b.png?X=1", {}
+            ),
+            {"v1/a b.png"},
+        )
+
+    def test_image_keys(self):
+        """Test the keys of a batch are read for images sent by the user only."""
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [(*upload_image_row(), CONTENT_HASH)]
+        keys, hashes = image_keys(cursor, "id", [7])
+
+        self.assertIn(hashed_image_key(CONTENT_HASH, "IMG_0001.jpg"), keys)
+        self.assertNotIn("IMG_0001.jpg", keys)
+        self.assertIn("sender = 'user'", cursor.execute.call_args.args[0])
+        self.assertEqual(hashes, {CONTENT_HASH})
+
+    @override_settings(USER_SHARDS=["default", "shard1"])
+    def test_shared_keys_are_kept(self):
+        """Test objects still used by a message on any shard are not deleted."""
+        image, image_url, variants = upload_image_row()
+        keys = message_keys(image, image_url, variants) | {"v1/static/media/own.png"}
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = []
+        with mock.patch("zbot.helpers.purge.connections") as connections:
+            shard_cursor = connections.__getitem__.return_value.cursor.return_value.__enter__
+            # the same photo uploaded by a user of another shard
+            shard_cursor.return_value.fetchall.return_value = [
+                ("copy.jpg", image_url, variants)
+            ]
+            self.assertEqual(
+                unshared_keys(cursor, keys, {CONTENT_HASH}, "default"),
+                ["v1/static/media/own.png"],
+            )
+        connections.__getitem__.assert_called_once_with("shard1")
+
+    def test_unshared_keys(self):
+        """Test the objects of a content no other message has are deleted."""
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = []
+        keys = message_keys(*upload_image_row())
+        self.assertEqual(unshared_keys(cursor, keys, {CONTENT_HASH}), sorted(keys))
+        self.assertEqual(unshared_keys(cursor, {"a.png"}, set()), ["a.png"])
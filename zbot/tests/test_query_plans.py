@@ -0,0 +1,231 @@
+"""
+Tests for the query plans of the hot message access paths.
+
+They seed ZBOT_PLAN_TESTS_ROWS text messages (1M by default) into the test
+database and take minutes, so they only run when ZBOT_PLAN_TESTS is set:
+
+    ZBOT_PLAN_TESTS=1 python manage.py test zbot.tests.test_query_plans
+"""
+
+import os
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection
+from django.test import TestCase
+
+from zbot.helpers.purge import EXPIRED_ROWS_QUERY
+from zbot.helpers.utils import (
+    HISTORY_IMAGES_QUERY,
+    HISTORY_TURNS_QUERY,
+    TIMELINE_COUNT_QUERY,
+    TIMELINE_QUERY,
+)
+from zbot.models import (
+    Conversation,
+    ImageMessage,
+    MachineParameter,
+    TextMessage,
+)
+
+
+ROWS = int(os.getenv("ZBOT_PLAN_TESTS_ROWS", 1_000_000))
+MESSAGES_PER_CONVERSATION = 100
+CONVERSATIONS = max(ROWS // MESSAGES_PER_CONVERSATION, 1)
+USERS = max(CONVERSATIONS // 10, 1)
+STARTED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def conversation_id(number):
+    return f"md5(({number})::TEXT)::UUID"
+
+
+def seed(model, rows, expressions):
+    """
+    Inserts `rows` rows into the table of a model with one INSERT ... SELECT
+    over generate_series(1, rows) AS i. Columns without an SQL expression
+    get the default of their field.
+    """
+    columns, values, params = [], [], []
+    for field in model._meta.concrete_fields:
+        if field.column in expressions:
+            columns.append(field.column)
+            values.append(expressions[field.column])
+        elif not field.primary_key or field.has_default():
+            columns.append(field.column)
+            values.append("%s")
+            params.append(field.get_db_prep_save(field.get_default(), connection))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {model._meta.db_table} ({', '.join(columns)}) "
+            f"SELECT {', '.join(values)} FROM generate_series(1, %s) AS i;",
+            params + [rows],
+        )
+
+
+def message_expressions(spread):
+    # messages are spread over the conversations, one every `spread` seconds
+    return {
+        "conversation_id": conversation_id(f"1 + mod(i, {CONVERSATIONS})"),
+        "created_at": (
+            f"'{STARTED.isoformat()}'::TIMESTAMPTZ + i * INTERVAL '{spread} seconds'"
+        ),
+        "updated_at": "NOW()",
+        "is_deleted": "mod(i, 20) = 0",
+        "sender": "CASE WHEN mod(i, 2) = 0 THEN 'user' ELSE 'ai' END",
+    }
+
+
+def index_names(plan):
+    """Returns the indexes scanned by a JSON plan and the seq scanned tables."""
+    indexes, seq_scans = set(), set()
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            indexes.add(node["Index Name"])
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.add(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return indexes, seq_scans
+
+
+@unittest.skipUnless(os.getenv("ZBOT_PLAN_TESTS"), "set ZBOT_PLAN_TESTS to run")
+class QueryPlanTests(TestCase):
+    """Test the hot message queries use their indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(
+            Conversation,
+            CONVERSATIONS,
+            {
+                "id": conversation_id("i"),
+                "name": "'plan-' || i",
+                "title": "'plan'",
+                "type": "'chat'",
+                "user_id": f"1 + mod(i, {USERS})",
+                "created_at": "'2023-12-01'::TIMESTAMPTZ",
+                "updated_at": "NOW()",
+                "is_deleted": "mod(i, 50) = 0",
+            },
+        )
+        text = message_expressions(1)
+        seed(TextMessage, ROWS, {**text, "text": "repeat('x', 200)", "machine_model": "'m'"})
+        image = message_expressions(10)
+        seed(
+            ImageMessage,
+            ROWS // 10,
+            {
+                **image,
+                "metadata": "'description:a|utility:b'",
+                "attributes": """'{"description": "a", "utility": "b"}'::JSONB""",
+            },
+        )
+        parameter = message_expressions(10)
+        del parameter["is_deleted"], parameter["sender"]
+        seed(MachineParameter, ROWS // 10, {**parameter, "id": "md5('p' || i)::UUID"})
+        with connection.cursor() as cursor:
+            for model in (Conversation, TextMessage, ImageMessage, MachineParameter):
+                cursor.execute(f"ANALYZE {model._meta.db_table};")
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {conversation_id(CONVERSATIONS // 2)};")
+            self.conversation_id = cursor.fetchone()[0]
+
+    def explain(self, query, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return index_names(plan[0]["Plan"])
+
+    def explain_queryset(self, queryset):
+        # Django unwraps the one element list of the JSON plan
+        plan = json.loads(queryset.explain(format="json"))
+        if isinstance(plan, list):
+            plan = plan[0]
+        return index_names(plan["Plan"])
+
+    def assertUsesIndexes(self, plan, *expected):
+        indexes, seq_scans = plan
+        for index in expected:
+            self.assertIn(index, indexes)
+        self.assertEqual(seq_scans, set())
+
+    def test_history_page(self):
+        """Test a history page reads every branch of the timeline by index."""
+        plan = self.explain(
+            TIMELINE_QUERY + " ORDER BY created_at DESC LIMIT %(limit)s OFFSET 0;",
+            {"conversation_id": self.conversation_id, "limit": 20},
+        )
+        self.assertUsesIndexes(
+            plan,
+            "zbot_text_live_conv_idx",
+            "zbot_image_live_conv_idx",
+            "zbot_param_conv_idx",
+        )
+
+    def test_history_count(self):
+        """Test the history count is read by index."""
+        plan = self.explain(TIMELINE_COUNT_QUERY, {"conversation_id": self.conversation_id})
+        self.assertUsesIndexes(
+            plan,
+            "zbot_text_live_conv_idx",
+            "zbot_image_live_conv_idx",
+            "zbot_param_conv_idx",
+        )
+
+    def test_ai_history(self):
+        """Test the AI history turns and their images are read by index."""
+        plan = self.explain(
+            HISTORY_TURNS_QUERY, {"conversation_id": self.conversation_id, "limit": 13}
+        )
+        self.assertUsesIndexes(plan, "zbot_text_live_conv_idx")
+
+        plan = self.explain(
+            HISTORY_IMAGES_QUERY,
+            {
+                "conversation_id": self.conversation_id,
+                "since": STARTED + timedelta(days=3),
+                "until": STARTED + timedelta(days=4),
+            },
+        )
+        self.assertUsesIndexes(plan, "zbot_image_live_conv_idx")
+
+    def test_lists(self):
+        """Test the conversation and message lists are read by index."""
+        plan = self.explain_queryset(
+            Conversation.live.filter(user_id=USERS // 2).order_by("-created_at")[:20]
+        )
+        self.assertUsesIndexes(plan, "zbot_conv_live_user_idx")
+
+        plan = self.explain_queryset(
+            TextMessage.live.filter(conversation_id=self.conversation_id).order_by(
+                "-created_at"
+            )[:20]
+        )
+        self.assertUsesIndexes(plan, "zbot_text_live_conv_idx")
+
+        plan = self.explain_queryset(
+            MachineParameter.objects.filter(
+                conversation_id=self.conversation_id
+            ).order_by("-created_at")[:20]
+        )
+        self.assertUsesIndexes(plan, "zbot_param_conv_idx")
+
+    def test_purge_scan(self):
+        """Test the purge finds soft-deleted rows without a table scan."""
+        for model, index in (
+            (TextMessage, "zbot_text_deleted_idx"),
+            (ImageMessage, "zbot_image_deleted_idx"),
+            (Conversation, "zbot_conv_deleted_idx"),
+        ):
+            query = EXPIRED_ROWS_QUERY.format(
+                pk=model._meta.pk.column, table=model._meta.db_table, after=""
+            )
+            plan = self.explain(query, {"cutoff": datetime.now(timezone.utc), "limit": 500})
+            self.assertUsesIndexes(plan, index)
@@ -0,0 +1,109 @@
+"""
+Tests for the views reading and writing conversations of sharded users
+outside of the request, once its shard is reset.
+"""
+
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+
+from core.db_router import _shard
+from zbot.views import ConversationViewSet, response_queue
+
+
+def sharded_conversation():
+    return SimpleNamespace(
+        id="6f1c2b1e-5d4a-4c3b-9a8f-7e6d5c4b3a21",
+        user_id=1,
+        _state=SimpleNamespace(db="shard1"),
+    )
+
+
+class ExportTests(SimpleTestCase):
+    """Test exports read the shard of the user once the response streams."""
+
+    def export(self, archived=False):
+        view = ConversationViewSet()
+        view.get_object = sharded_conversation
+        token = _shard.set("shard1")
+        try:
+            response = view.export(RequestFactory().get("/"), pk=sharded_conversation().id)
+        finally:
+            # dispatch resets the shard before the response is consumed
+            _shard.reset(token)
+
+        with mock.patch("zbot.helpers.utils.connections") as connections, mock.patch(
+            "zbot.helpers.archive.rehydrate_conversation", return_value=archived
+        ) as rehydrate:
+            cursor = connections.__getitem__.return_value.chunked_cursor.return_value
+            cursor.__enter__.return_value.__iter__.return_value = iter(
+                [("7", "text", "hello", None, None, "user", "2024-01-01", None)]
+            )
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        rehydrate.assert_called_once_with(sharded_conversation().id, "shard1")
+        return connections, lines
+
+    def test_sharded_export(self):
+        """Test the timeline is read from the shard of the conversation."""
+        connections, lines = self.export()
+        connections.__getitem__.assert_called_once_with("shard1")
+        self.assertEqual(json.loads(lines[0])["data"], "hello")
+
+    def test_rehydrated_export(self):
+        """Test an archived conversation is read where it was rehydrated."""
+        connections, _ = self.export(archived=True)
+        connections.__getitem__.assert_called_once_with("shard1")
+
+
+class SaveResponseTests(SimpleTestCase):
+    """Test the streamed responses are saved on the shard of the conversation."""
+
+    def setUp(self):
+        patcher = mock.patch("zbot.views.connections")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_saved_on_the_conversation_shard(self):
+        """Test the image description and the response go to the shard."""
+        full_response = json.dumps(
+            json.dumps(
+                {"response": "Check the heater.", "images": [], "imageInputDescription": "a gear"}
+            )
+        )
+        with mock.patch("zbot.views.ImageMessage.objects") as images, mock.patch(
+            "zbot.views.TextMessage.objects"
+        ) as texts:
+            image_message = images.using.return_value.get.return_value
+            image_message.attributes = {}
+            texts.using.return_value.create.return_value.id = 8
+            ConversationViewSet().save_response_to_db(
+                full_response, sharded_conversation(), "m", {"id": 7}
+            )
+
+        images.using.assert_called_with("shard1")
+        image_message.save.assert_called_once_with(using="shard1")
+        self.assertEqual(image_message.attributes, {"description": "a gear"})
+        texts.using.assert_called_once_with("shard1")
+        self.assertEqual(
+            response_queue.get_nowait(),
+            {"text": {"id": 8, "text": "Check the heater."}, "images": []},
+        )
+
+    def test_failure_releases_the_stream(self):
+        """Test the stream waiting on the queue gets None when saving fails."""
+        with mock.patch("zbot.views.ImageMessage.objects") as images:
+            images.using.return_value.get.side_effect = Exception("does not exist")
+            ConversationViewSet().save_response_to_db(
+                json.dumps(json.dumps({"response": "", "images": [], "imageInputDescription": "a"})),
+                sharded_conversation(),
+                "m",
+                {"id": 7},
+            )
+            ConversationViewSet().save_response_to_db(
+                "not json", sharded_conversation(), "m", None
+            )
+
+        self.assertIsNone(response_queue.get_nowait())
+        self.assertIsNone(response_queue.get_nowait())
@@ -0,0 +1,114 @@
+"""
+Tests for moving the conversations of a user to another shard.
+"""
+
+import unittest
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core.models import UserShard
+from zbot import models
+from zbot.helpers import sharding
+
+
+@unittest.skipUnless("shard1" in settings.DATABASES, "set DATABASE_SHARDS to run")
+class MoveUserTests(TestCase):
+    """Test moving a user between the default database and a shard."""
+
+    databases = {"default", "shard1"}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email="moved@example.com", password="testpass123"
+        )
+        UserShard.objects.create(user=self.user, shard="default")
+        self.conversations = []
+        for i in range(3):
+            conversation = models.Conversation.objects.using("default").create(
+                name=f"conversation {i}", title="title", user=self.user
+            )
+            models.TextMessage.objects.using("default").bulk_create(
+                models.TextMessage(conversation=conversation, text=f"message {j}")
+                for j in range(4)
+            )
+            models.ImageMessage.objects.using("default").create(
+                conversation=conversation, metadata="a.jpg", attributes={"tags": ["gear"]}
+            )
+            models.MachineParameter.objects.using("default").create(
+                conversation=conversation
+            )
+            self.conversations.append(conversation.id)
+        patcher = mock.patch.object(sharding, "_invalidate_history")
+        self.invalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def texts(self, using):
+        return sorted(
+            models.TextMessage.objects.using(using)
+            .filter(conversation_id__in=self.conversations)
+            .values_list("text", flat=True)
+        )
+
+    def assertMoved(self):
+        self.assertEqual(len(self.texts("shard1")), 12)
+        self.assertEqual(self.texts("default"), [])
+        image = models.ImageMessage.objects.using("shard1").get(
+            conversation_id=self.conversations[0]
+        )
+        self.assertEqual(image.attributes, {"tags": ["gear"]})
+        self.assertEqual(
+            models.MachineParameter.objects.using("shard1")
+            .filter(conversation_id__in=self.conversations)
+            .count(),
+            3,
+        )
+        directory = UserShard.objects.using("default").get(user=self.user)
+        self.assertEqual((directory.shard, directory.moving), ("shard1", False))
+
+    def test_move(self):
+        """Test the rows are copied, the old ones deleted and history invalidated."""
+        moved = sharding.move_user(self.user.id, "shard1", wait=0)
+
+        self.assertEqual(moved, 3 + 12 + 3 + 3)
+        self.assertMoved()
+        self.invalidate.assert_called_with(self.conversations)
+
+    def test_target_leftovers_are_purged(self):
+        """Test rows left on the target by an interrupted move are replaced."""
+        sharding.copy_rows(
+            models.Conversation, self.conversations[:1], "default", "shard1", 100
+        )
+        sharding.copy_rows(
+            models.TextMessage, self.conversations[:1], "default", "shard1", 100
+        )
+
+        sharding.move_user(self.user.id, "shard1", wait=0)
+
+        self.assertMoved()
+
+    def test_rerun_after_failure(self):
+        """Test a failed move leaves the user on its shard and can run again."""
+        copy_rows = sharding.copy_rows
+        moving = []
+
+        def failing_copy(model, *args):
+            moving.append(UserShard.objects.using("default").get(user=self.user).moving)
+            if model is models.ImageMessage:
+                raise RuntimeError("connection lost")
+            return copy_rows(model, *args)
+
+        with mock.patch.object(sharding, "copy_rows", side_effect=failing_copy):
+            with self.assertRaises(RuntimeError):
+                sharding.move_user(self.user.id, "shard1", wait=0)
+
+        # writes are rejected while the rows are copied
+        self.assertTrue(all(moving))
+        directory = UserShard.objects.using("default").get(user=self.user)
+        self.assertEqual((directory.shard, directory.moving), ("default", False))
+        self.assertEqual(len(self.texts("default")), 12)
+
+        sharding.move_user(self.user.id, "shard1", wait=0)
+        self.assertMoved()
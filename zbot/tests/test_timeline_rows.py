@@ -0,0 +1,88 @@
+"""
+Tests for the decoding of the rows of the timeline query.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from django.test import SimpleTestCase
+
+from zbot.helpers.utils import TIMELINE_ROW_DECODERS, decode_timeline_row
+
+
+CREATED_AT = datetime(2025, 1, 1, 10, 0, 30, 123456, tzinfo=timezone.utc)
+
+# fine_tuning as built by the machine_parameters branch of the query, for a
+# parameter row with its array columns empty and its scalars unset
+FINE_TUNING = {
+    "injection_temperature": [],
+    "position": [12.5, 30.0],
+    "injection_pressure": [],
+    "velocity": [],
+    "mold_temperature": 0.0,
+    "cooling_time": 12.75,
+    "hot_runner_temperature": 0.0,
+    "decompression": 0.0,
+    "hold_pressure": [],
+    "hold_velocity": [],
+    "hold_time": [],
+    "back_pressure": [],
+    "clamping_force": 1234.5678,
+    "injection_weight": 0.0,
+    "num_of_cavities": 0.0,
+    "prod_wieght": 0.1,
+    "machine_id": "",
+    "material_id": "",
+}
+
+
+def parameter_row(fine_tuning, title="Settings"):
+    return ("3", "parameter", title, None, fine_tuning, "user", CREATED_AT, None)
+
+
+class ParameterRowTests(SimpleTestCase):
+    """Test parameter rows decode the same whatever the driver hands back."""
+
+    def test_native_json(self):
+        """Test fine tuning already decoded by psycopg2 is kept as is."""
+        entry = decode_timeline_row(parameter_row(FINE_TUNING))
+
+        self.assertEqual(
+            entry,
+            {
+                "id": "3",
+                "type": "parameter",
+                "data": "Settings",
+                "fineTunning": FINE_TUNING,
+                "sender": "user",
+                "created_at": CREATED_AT,
+            },
+        )
+
+    def test_text_json(self):
+        """Test fine tuning sent as text keeps its floats and empty arrays."""
+        entry = decode_timeline_row(parameter_row(json.dumps(FINE_TUNING)))
+
+        self.assertEqual(entry["fineTunning"], FINE_TUNING)
+        self.assertIsInstance(entry["fineTunning"]["mold_temperature"], float)
+        self.assertEqual(entry["fineTunning"]["clamping_force"], 1234.5678)
+        self.assertEqual(entry["fineTunning"]["hold_time"], [])
+
+    def test_null_columns(self):
+        """Test a parameter without title or fine tuning decodes to None."""
+        entry = TIMELINE_ROW_DECODERS["parameter"](parameter_row(None, title=None))
+
+        self.assertIsNone(entry["data"])
+        self.assertIsNone(entry["fineTunning"])
+        self.assertNotIn("variants", decode_timeline_row(parameter_row(None), "c1"))
+
+
+class ImageRowTests(SimpleTestCase):
+    """Test the JSON attributes of image rows."""
+
+    def test_attributes(self):
+        """Test attributes decode from text, and null attributes to {}."""
+        row = ("7", "image", "a.png", None, None, "user", CREATED_AT, '{"score": 0.5}')
+        self.assertEqual(decode_timeline_row(row)["attributes"], {"score": 0.5})
+        row = row[:7] + (None,)
+        self.assertEqual(decode_timeline_row(row)["attributes"], {})
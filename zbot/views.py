@@ -5,6 +5,7 @@ import math
 import logging
 import threading
 import queue
+import mimetypes
 from django.conf import settings
 
 from datetime import datetime
@@ -16,11 +17,18 @@ import uuid
 
 # import httpx
 
-from django.http import StreamingHttpResponse
+from django.http import (
+    StreamingHttpResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+)
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_protect
 from django.core.files.storage import default_storage
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections
 
 
 from rest_framework import status
@@ -57,19 +65,57 @@ from .models import (
 )
 from aws_xray_sdk.core import xray_recorder
 from .helpers.sse_renderer import ServerSentEventRenderer
+from .helpers.image_hashes import (
+    agent_image_query,
+    cached_description,
+    hash_file,
+    hashed_image_key,
+    remember_description,
+    reusable_image,
+)
+from .helpers.image_uploads import (
+    ready_image,
+    start_image_upload,
+    start_upload_processing,
+)
+from .helpers.image_variants import (
+    DISPLAY_VARIANTS,
+    analysis_image_location,
+    create_variants,
+    ensure_variants,
+    variant_storage,
+)
+from .helpers.storage import image_storage
+from .helpers.export import ndjson_chunks, gzip_chunks, accepts_gzip
+from .helpers.history_pages import get_history_page
 from .helpers.utils import (
     get_conversation_history,
-    get_history_for_ai,
-    split_s3_url,
+    get_history_window_for_ai,
+    parse_legacy_metadata,
+    iter_conversation_timeline,
     restructure_images,
 )
 from .filters import ConversationFilter, MachineParameterFilter, MachineFilter  
 from .paginations import CustomLimitOffsetPagination
 
+from core.db_router import ReplicaReadMixin, UserShardMixin, write_alias
 from core.decorators import use_db_pool
+from core.uploads import (
+    presign_upload,
+    read_upload_token,
+    upload_key,
+    upload_token,
+    uploaded_size,
+)
+from core.url_signer import sign_fields, sign_url
 
 logger = logging.getLogger(__name__)
 
+# image extensions accepted by ImageMessage.image
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "heic"]
+# seconds clients may reuse a variant redirect, its presigned URL lasts an hour
+VARIANT_REDIRECT_MAX_AGE = 600
+
 retry_strategy = Retry(
     total=5,
     backoff_factor=10,
@@ -91,7 +137,8 @@ response_queue = queue.Queue()
 # @csrf_protect
 
 @xray_recorder.capture("ConversationViewSet")
-class ConversationViewSet(ModelViewSet):
+@use_db_pool
+class ConversationViewSet(UserShardMixin, ReplicaReadMixin, ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -105,7 +152,7 @@ class ConversationViewSet(ModelViewSet):
             return Conversation.objects.none()
         """Retrieve conversations for authenticated user"""
         # filter out deleted
-        return Conversation.objects.filter(user=self.request.user).order_by(
+        return Conversation.live.filter(user=self.request.user).order_by(
             "-created_at"
         )
     
@@ -120,9 +167,16 @@ class ConversationViewSet(ModelViewSet):
         try:
             limit = int(request.query_params.get("limit", 10))
             start = int(request.query_params.get("start", 0))
-            history = get_conversation_history(pk, limit, start)
+            history = get_conversation_history(
+                pk, limit, start, conn=self.db_connection
+            )
             conversation_history = history[0]
             total_count = history[1]
+            # one signing batch for the images of the page
+            sign_fields(
+                [entry for entry in conversation_history if entry["type"] == "image"],
+                ["data"],
+            )
             # logger.info(f"Retrieved conversation history: {conversation_history}")
 
             # Use your custom pagination class
@@ -143,6 +197,54 @@ class ConversationViewSet(ModelViewSet):
                 {"detail": "Failed to retrieve conversation history."}, status=500
             )
 
+    @action(detail=True, methods=["GET"], url_path="history-pages")
+    def history_pages(self, request, pk=None):
+        """Retrieve one chronological bucket of the conversation history."""
+        conversation = self.get_object()
+        try:
+            bucket = request.query_params.get("bucket")
+            bucket = int(bucket) if bucket is not None else None
+        except ValueError:
+            return Response(
+                {"bucket": "Must be a valid integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        body, etag, _ = get_history_page(conversation.id, bucket)
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        # historical buckets change too when old messages are edited or
+        # deleted, clients revalidate every page, unchanged ones get a 304
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+    @action(detail=True, methods=["GET"], url_path="export")
+    def export(self, request, pk=None):
+        """Stream the whole conversation as NDJSON, oldest entry first."""
+        conversation = self.get_object()
+        # the response is streamed after dispatch reset the shard, resolve
+        # the databases now
+        timeline = iter_conversation_timeline(
+            conversation.id, using=conversation._state.db, shard=write_alias()
+        )
+        chunks = ndjson_chunks(timeline)
+        gzipped = accepts_gzip(request)
+        if gzipped:
+            chunks = gzip_chunks(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type="application/x-ndjson")
+        response["Content-Disposition"] = (
+            f'attachment; filename="conversation-{conversation.id}.ndjson"'
+        )
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        response["Vary"] = "Accept-Encoding"
+        response["X-Accel-Buffering"] = "no"  # Disable buffering in nginx
+        return response
+
     @action(detail=False, methods=["post"])
     def calculate_parameters(self, request, *args, **kwargs):
         frontend_data = request.data
@@ -257,9 +359,16 @@ class ConversationViewSet(ModelViewSet):
         recieved_image_query = frontend_data.get("imageQuery", None)
         imageQuery = None
         if recieved_image_query:
-            imageQuery = split_s3_url(recieved_image_query["image_url"])
+            imageQuery = agent_image_query(
+                # an image uploaded in the background is needed now
+                ready_image(ImageMessage.live.filter(id=recieved_image_query.get("id")).first()),
+                recieved_image_query["image_url"],
+                conversation.user_id,
+            )
         #        logger.info(f"Image query object: {imageQuery}")
-        chatHistory = get_history_for_ai(text_query_id, conversation.id, "chat")
+        chatHistory, history_metrics = get_history_window_for_ai(
+            text_query_id, conversation.id, "chat"
+        )
 
         try:
 
@@ -323,7 +432,14 @@ class ConversationViewSet(ModelViewSet):
                         )
                         # logger.info(f"Received image description: {image_input_desc}")
                         imageMessage.metadata = image_input_desc
+                        imageMessage.attributes = {
+                            **imageMessage.attributes,
+                            "description": image_input_desc,
+                        }
                         imageMessage.save()
+                        remember_description(
+                        imageMessage.content_hash, image_input_desc, conversation.user_id
+                    )
 
                     images = restructure_images(response_images)
                     # logger.info(f"Structured images: {images}, Type: {type(images)}")
@@ -358,6 +474,10 @@ class ConversationViewSet(ModelViewSet):
                                 conversation=conversation,
                                 image_url=image_url_ai,
                                 metadata=f"description:{image_desc_ai}|utility:{image_util_ai}",
+                                attributes={
+                                    "description": image_desc_ai,
+                                    "utility": image_util_ai,
+                                },
                                 machine_model=machine_model,
                                 sender="ai",
                             )
@@ -377,7 +497,7 @@ class ConversationViewSet(ModelViewSet):
                     zbot_time = elapsed_time - start_time
                     django_time = final_response_time - elapsed_time
 
-                    logger.info(f"user id : {self.request.user.id}, zbot time : {zbot_time} , django time : {django_time}")
+                    logger.info(f"user id : {self.request.user.id}, zbot time : {zbot_time} , django time : {django_time}, history : {history_metrics}")
                     response_data = {
                         "response": {
                             "text": serialized_text.data if serialized_text else None,
@@ -568,7 +688,9 @@ class ConversationViewSet(ModelViewSet):
         #     imageQuery = split_s3_url(received_image_query["image_url"])
         #        logger.info(f"Image query object: {imageQuery}")
 
-        chatHistory = get_history_for_ai(text_query_id, conversation.id, "ops")
+        chatHistory, history_metrics = get_history_window_for_ai(
+            text_query_id, conversation.id, "ops"
+        )
 
         # logger.info(
         #     "Sent message from frontend: "
@@ -624,6 +746,7 @@ class ConversationViewSet(ModelViewSet):
                 received_image_query,
                 user_id=self.request.user.id,
                 ai_endpoint=ai_endpoint,
+                history_metrics=history_metrics,
             )
         )
         response["X-Accel-Buffering"] = "no"  # Disable buffering in nginx
@@ -635,10 +758,7 @@ class ConversationViewSet(ModelViewSet):
     def similarity_search(self, request, *args, **kwargs):
         """Perform similarity search on an image message."""
         # Retrieve the conversation instance
-        conversation = Conversation.objects.filter(
-            id=self.kwargs.get("pk"),
-            is_deleted=False
-        ).first()
+        conversation = Conversation.live.filter(id=self.kwargs.get("pk")).first()
         if not conversation:
             return Response(
                 {"detail": "Conversation not found."},
@@ -647,17 +767,14 @@ class ConversationViewSet(ModelViewSet):
         # Validate the request data
 
        
-        image = ImageMessage.objects.filter(
-            id=request.data.get("image_id"),
-            is_deleted=False
-        ).first()
+        image = ImageMessage.live.filter(id=request.data.get("image_id")).first()
         if not image:
             return Response(
                 {"detail": "Image message  not found."},
                 status=status.HTTP_400_BAD_REQUEST
                 )
         
-        image_to_send = {
+        image_to_send = analysis_image_location(image, None) or {
             "bucket": "zbot-image-input-v1",
             "key": image.image_url.split(".amazonaws.com/")[-1],
         }
@@ -677,6 +794,7 @@ class ConversationViewSet(ModelViewSet):
             retrieved_images = ms_response_data.get("retrieved_images", [])
             for retrieved_image in retrieved_images:
                 metadata = retrieved_image.get("metadata", {})
+                retrieved_image["attributes"] = dict(metadata)
                 # Convert metadata dict to markdown string
                 markdown_lines = []
                 for k, v in metadata.items():
@@ -692,6 +810,7 @@ class ConversationViewSet(ModelViewSet):
                     top_k=1, 
                     image_url=retrieved_image.get("url"),
                     metadata=retrieved_image.get("metadata"),
+                    attributes=retrieved_image.pop("attributes"),
                     sender="ai",
                 )
         except Exception as e:
@@ -762,9 +881,14 @@ class ConversationViewSet(ModelViewSet):
         received_image_query = frontend_data.get("imageQuery", None)
         imageQuery = None
         if received_image_query:
-            imageQuery = split_s3_url(received_image_query["image_url"])
+            imageQuery = agent_image_query(
+                # an image uploaded in the background is needed now
+                ready_image(ImageMessage.live.filter(id=received_image_query.get("id")).first()),
+                received_image_query["image_url"],
+                conversation.user_id,
+            )
         #        logger.info(f"Image query object: {imageQuery}")
-        chatHistory = get_history_for_ai(
+        chatHistory, history_metrics = get_history_window_for_ai(
             text_query_id, conversation.id, "chat"
         )
         # formatted_chat_history = json.dumps(chatHistory, indent=4, ensure_ascii=False)
@@ -796,6 +920,7 @@ class ConversationViewSet(ModelViewSet):
                 received_image_query,
                 user_id=self.request.user.id,
                 ai_endpoint=ai_endpoint,
+                history_metrics=history_metrics,
             )
         )
         response["X-Accel-Buffering"] = "no"  # Disable buffering in nginx
@@ -813,6 +938,7 @@ class ConversationViewSet(ModelViewSet):
         received_image_query=None,
         user_id=None,
         ai_endpoint=None,
+        history_metrics=None,
     ):
         try:
 
@@ -896,7 +1022,7 @@ class ConversationViewSet(ModelViewSet):
             # Once streaming is complete, process the complete response'
             full_response = complete_buffer
             stream_time = elapsed_time - chunk_time
-            logger.info(f"user id: {user_id}, first chunk : {first_chunk}, stream_time: {stream_time } seconds")
+            logger.info(f"user id: {user_id}, first chunk : {first_chunk}, stream_time: {stream_time } seconds, history : {history_metrics}")
 
             threading.Thread(
                 target=self.save_response_to_db,
@@ -933,6 +1059,10 @@ class ConversationViewSet(ModelViewSet):
         machine_model,
         received_image_query,
     ):
+        # runs in its own thread, after the request reset its shard: queries
+        # go to the database of the conversation explicitly
+        using = conversation._state.db
+        response = None
         try:
             start_time = time.time()
 
@@ -951,16 +1081,23 @@ class ConversationViewSet(ModelViewSet):
             if received_image_query:
                 image_input_desc = response_data["imageInputDescription"]
                 if image_input_desc:
-                    imageMessage = ImageMessage.objects.get(
+                    imageMessage = ImageMessage.objects.using(using).get(
                         id=received_image_query["id"]
                     )
                     imageMessage.metadata = image_input_desc
-                    imageMessage.save()
+                    imageMessage.attributes = {
+                        **imageMessage.attributes,
+                        "description": image_input_desc,
+                    }
+                    imageMessage.save(using=using)
+                    remember_description(
+                        imageMessage.content_hash, image_input_desc, conversation.user_id
+                    )
 
             # Save text response
             saved_text = None
             if response_text:
-                text_message = TextMessage.objects.create(
+                text_message = TextMessage.objects.using(using).create(
                     conversation=conversation,
                     text=response_text,
                     machine_model=machine_model,
@@ -981,10 +1118,11 @@ class ConversationViewSet(ModelViewSet):
                     image_desc = image["description"]
                     image_util = image["utility"]
                     metadata = f"description:{image_desc}|utility:{image_util}"
-                    image_message = ImageMessage.objects.create(
+                    image_message = ImageMessage.objects.using(using).create(
                         conversation=conversation,
                         image_url=image_url,
                         metadata=metadata,
+                        attributes={"description": image_desc, "utility": image_util},
                         machine_model=machine_model,
                         sender="ai",
                     )
@@ -1008,19 +1146,23 @@ class ConversationViewSet(ModelViewSet):
             logger.info(
                 f"Time to save to the database: {saved_time - start_time} seconds"
             )
-            response_queue.put(response)
             # return response
 
         except json.JSONDecodeError:
             logger.error("Failed to decode JSON response: %s", full_response)
         except Exception as e:
             logger.error("Error saving response to database: %s", str(e))
+        finally:
+            # the stream waits on the queue, it gets None when saving failed
+            response_queue.put(response)
+            # connections are per thread, do not leak this one
+            connections.close_all()
 
    
    
     
 
-class TextMessageViewSet(ModelViewSet):
+class TextMessageViewSet(UserShardMixin, ReplicaReadMixin, ModelViewSet):
     """Manage text messages"""
 
     serializer_class = TextMessageSerializer
@@ -1028,9 +1170,8 @@ class TextMessageViewSet(ModelViewSet):
 
     def get_queryset(self):
         # filter text messages by conversation_id
-        return TextMessage.objects.filter(
+        return TextMessage.live.filter(
             conversation_id=self.kwargs.get("conversation_pk"),
-            is_deleted=False,
         ).order_by("-created_at")
 
     def get_serializer_context(self):
@@ -1051,7 +1192,7 @@ class TextMessageViewSet(ModelViewSet):
         serializer.save(conversation=conversation)
 
 
-class ImageMessageViewSet(ModelViewSet):
+class ImageMessageViewSet(UserShardMixin, ReplicaReadMixin, ModelViewSet):
     """Manage image messages"""
 
     serializer_class = ConversationImageMessageSerializer
@@ -1059,9 +1200,8 @@ class ImageMessageViewSet(ModelViewSet):
 
     def get_queryset(self):
         # filter image messages by conversation_id
-        return ImageMessage.objects.filter(
+        return ImageMessage.live.filter(
             conversation_id=self.kwargs.get("conversation_pk"),
-            is_deleted=False,
         ).order_by("-created_at")
 
     def get_serializer_context(self):
@@ -1086,9 +1226,7 @@ class ImageMessageViewSet(ModelViewSet):
     def upload_image(self, request, *args, **kwargs):
         # Use the custom serializer for validation
         conversation_id = self.kwargs.get("conversation_pk")
-        conversation = Conversation.objects.filter(
-            id=conversation_id, is_deleted=False
-        ).first()
+        conversation = Conversation.live.filter(id=conversation_id).first()
         if not conversation:
             return Response(
                 {"error": "Conversation does not exist."},
@@ -1109,18 +1247,43 @@ class ImageMessageViewSet(ModelViewSet):
             }
 
             if image_file:
-                # Generate the desired file name
-                filename = f"v1/static/media/{conversation_id}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.{image_file.name}"
+                # the same photo uploaded again reuses its object
+                content_hash = hash_file(image_file)
+                filename = hashed_image_key(content_hash, image_file.name)
+                # with ?async=true the file is stored by the upload pool and
+                # the message is answered pending, with a 202
+                in_background = request.query_params.get("async") in ("1", "true")
 
                 try:
-                    # Save the file using default_storage
-                    file_path = default_storage.save(filename, image_file)
+                    source = reusable_image(content_hash, conversation.user_id)
+                    variants = source.variants if source is not None else None
+                    upload_status = ImageMessage.READY
+                    if in_background:
+                        file_path = filename
+                        if variants is None or not default_storage.exists(file_path):
+                            upload_status = ImageMessage.PENDING
+                    elif default_storage.exists(filename):
+                        file_path = filename
+                    else:
+                        # Save the file using default_storage
+                        file_path = default_storage.save(filename, image_file)
+                    if variants is None and upload_status == ImageMessage.READY:
+                        image_file.seek(0)
+                        variants = create_variants(
+                            default_storage, file_path, image_file.read()
+                        )
 
                     # Log the successful upload
                     # logger.info(f"Image uploaded successfully: {file_path}")
                     image_name = image_file.name.split("/")[-1]
                     image_url = (
-                        f"https://zbot-image-input-v1.s3.amazonaws.com/{uuid.uuid4()}_{image_file.name}"
+                        f"https://zbot-image-input-v1.s3.amazonaws.com/{file_path}"
+                    )
+                    additional_data.setdefault(
+                        "metadata", cached_description(content_hash, conversation.user_id)
+                    )
+                    additional_data.setdefault(
+                        "attributes", parse_legacy_metadata(additional_data["metadata"])
                     )
 
                     # Create an ImageMessage object
@@ -1128,9 +1291,21 @@ class ImageMessageViewSet(ModelViewSet):
                         image_url=image_url,
                         image=image_name,
                         conversation=conversation,
+                        variants=variants or {},
+                        content_hash=content_hash,
+                        upload_status=upload_status,
                         **additional_data,
                     )
                     image_message.save()
+                    if upload_status == ImageMessage.PENDING:
+                        image_file.seek(0)
+                        start_image_upload(
+                            image_message,
+                            default_storage,
+                            file_path,
+                            image_file.read(),
+                            variants,
+                        )
 
                     # Serialize the saved object for the response
                     response_serializer = ConversationImageMessageSerializer(
@@ -1140,7 +1315,12 @@ class ImageMessageViewSet(ModelViewSet):
                     logger.info(f"Upload image time: {upload_time - start_time}")
                     # logger.debug(f"Serialized data: {response_serializer.data}")
                     return Response(
-                        response_serializer.data, status=status.HTTP_201_CREATED
+                        response_serializer.data,
+                        status=(
+                            status.HTTP_202_ACCEPTED
+                            if upload_status == ImageMessage.PENDING
+                            else status.HTTP_201_CREATED
+                        ),
                     )
                 except Exception as e:
                     logger.error(f"Error creating image message: {str(e)}")
@@ -1151,8 +1331,124 @@ class ImageMessageViewSet(ModelViewSet):
         return Response(
             {"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
         )
-    
-    
+
+    @action(detail=False, methods=["post"], url_path="upload-url")
+    def upload_url(self, request, *args, **kwargs):
+        """
+        Issue a presigned POST uploading an image straight to S3, then
+        create the image message with finalize-upload.
+        """
+        conversation_id = self.kwargs.get("conversation_pk")
+        if not Conversation.live.filter(id=conversation_id).exists():
+            return Response(
+                {"error": "Conversation does not exist."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        filename = request.data.get("filename")
+        key = upload_key("v1/static/media", filename, IMAGE_EXTENSIONS)
+        content_type = (
+            request.data.get("content_type")
+            or mimetypes.guess_type(key)[0]
+            or "application/octet-stream"
+        )
+        return Response(
+            {
+                "upload": presign_upload(image_storage(), key, content_type),
+                "upload_token": upload_token(
+                    key=key, user=request.user.pk, conversation=conversation_id
+                ),
+                "expires_in": settings.UPLOAD_URL_EXPIRES,
+            }
+        )
+
+    @action(detail=False, methods=["post"], url_path="finalize-upload")
+    def finalize_upload(self, request, *args, **kwargs):
+        """Create the image message of an image uploaded with upload-url."""
+        conversation_id = self.kwargs.get("conversation_pk")
+        claims = read_upload_token(
+            request.data.get("upload_token"),
+            user=request.user.pk,
+            conversation=conversation_id,
+        )
+        conversation = Conversation.live.filter(id=conversation_id).first()
+        if not conversation:
+            return Response(
+                {"error": "Conversation does not exist."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # a retried finalize returns the message of the first one
+        image_message = ImageMessage.objects.filter(
+            conversation=conversation, image=claims["key"]
+        ).first()
+        if image_message:
+            return Response(ConversationImageMessageSerializer(image_message).data)
+
+        serializer = ConversationImageMessageSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        additional_data = {
+            key: value
+            for key, value in serializer.validated_data.items()
+            if key != "image" and key != "image_url"
+        }
+
+        storage = image_storage()
+        uploaded_size(storage, claims["key"])
+        # the metadata of a content described before is filled in once hashed
+        describe = "metadata" not in additional_data
+        if not describe:
+            additional_data.setdefault(
+                "attributes", parse_legacy_metadata(additional_data["metadata"])
+            )
+        # hashing and rendering the variants read the whole file, they run in
+        # the upload pool; the agent waits for the message to be ready
+        image_message = ImageMessage.objects.create(
+            image=claims["key"],
+            conversation=conversation,
+            upload_status=ImageMessage.PENDING,
+            **additional_data,
+        )
+        start_upload_processing(image_message, storage, claims["key"], describe)
+        return Response(
+            ConversationImageMessageSerializer(image_message).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"variants/(?P<name>[a-z]+)",
+        url_name="variant",
+    )
+    def variant(self, request, name=None, *args, **kwargs):
+        """
+        Redirect to a display variant of the image, rendering it first for
+        images uploaded before it existed, or to the original (presigned
+        when SIGNED_URLS is on). Falls back to the original.
+        """
+        if name not in DISPLAY_VARIANTS and name != "original":
+            return Response(
+                {"error": f"Variants are: {', '.join(DISPLAY_VARIANTS)}, original."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        image_message = self.get_object()
+        variants = image_message.variants
+        if name != "original" and image_message.upload_status == ImageMessage.READY:
+            variants = ensure_variants(image_message)
+
+        if name != "original" and variants.get(name):
+            url = variant_storage(variants.get("bucket")).url(variants[name])
+        elif image_message.image_url:
+            url = sign_url(image_message.image_url)
+        else:
+            return Response(
+                {"error": "The image is not available."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        response = HttpResponseRedirect(url)
+        # shorter than the expiry of presigned URLs
+        response["Cache-Control"] = f"private, max-age={VARIANT_REDIRECT_MAX_AGE}"
+        return response
 
     # def update(self, request, *args, **kwargs):
     #     partial = kwargs.pop("partial", False)
@@ -1176,7 +1472,7 @@ class ImageMessageViewSet(ModelViewSet):
     #         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MachineViewSet(ModelViewSet):
+class MachineViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = MachineSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = MachineFilter
@@ -1187,13 +1483,13 @@ class MachineViewSet(ModelViewSet):
         return Machine.objects.order_by("-created_at")
 
 
-class MaterialViewSet(ModelViewSet):
+class MaterialViewSet(ReplicaReadMixin, ModelViewSet):
     queryset = Material.objects.all()
     serializer_class = MaterialSerializer
     permission_classes = [IsAuthenticated]
 
 
-class MachineParameterViewSet(ModelViewSet):
+class MachineParameterViewSet(UserShardMixin, ReplicaReadMixin, ModelViewSet):
     serializer_class = MachineParameterSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = MachineParameterFilter